@@ -1,6 +1,114 @@
 """module for dealing with actions taken by the app
 """
-from typing import List
+from __future__ import annotations
+import platform
+import re
+from typing import List, Optional, Tuple
+
+from pynput.keyboard import Key
+
+from ui.kb_controller import KBCntrlrWrapper
+
+# the modifier that makes backspace delete a whole word
+WORD_JUMP_KEY = Key.alt if platform.system() == 'Darwin' else Key.ctrl
+
+# what gets deleted in one step of an undo: either a word that a word jump
+# can be trusted to delete (ascii letters and digits only, apps disagree on
+# everything else, with at most one space after it) or a single character
+_deletion_step_re = re.compile(r'[A-Za-z0-9]+ ?|.', re.DOTALL)
+
+
+def plan_deletion(text: str, word_jumps: bool = False
+        ) -> List[Tuple[str, int]]:
+    """Work out the fewest keystrokes to delete some text that was just typed
+
+    A word jump is only used where the typed text shows exactly where it will
+    stop: at a space, inside the text being deleted. Otherwise (e.g. for the
+    first word, which might carry on into text that was already there) it's
+    backspaces.
+
+    Args:
+        text: the text to delete, which must be right before the cursor
+        word_jumps: whether word jumps (see WORD_JUMP_KEY) can be used
+
+    Returns:
+        runs of keystrokes, in order, as (kind, count) where kind is
+        'backspace' or 'word'
+    """
+    if not word_jumps:
+        return [('backspace', len(text))] if text else []
+
+    steps = _deletion_step_re.findall(text)
+    plan = []
+    # going backwards, the step before the current one
+    for istep in range(len(steps) - 1, -1, -1):
+        step = steps[istep]
+        if len(step) > 1 and istep > 0 and steps[istep - 1][-1] == ' ':
+            kind, count = 'word', 1
+        else:
+            kind, count = 'backspace', len(step)
+        if plan and plan[-1][0] == kind:
+            plan[-1] = (kind, plan[-1][1] + count)
+        else:
+            plan.append((kind, count))
+    return plan
+
+
+class UndoPlan:
+    """Text to delete for an undo, collected over several actions
+
+    Undoing actions back to back (even across utterances) mostly just deletes
+    more and more of what was typed last, so the deletion is held back until
+    something else needs doing, and then goes to the keyboard controller in
+    one batch. Use with the python "with" statement, to delete whatever's 
+    left at the end.
+    """
+
+    def __init__(self):
+        # the text to delete, most recently typed first
+        self._texts: List[str] = []
+        self._kb_controller: KBCntrlrWrapper = None
+        self._word_jumps = True
+
+    def delete(self, text: str, kb_controller: KBCntrlrWrapper,
+            word_jumps: bool = False):
+        """Add some text to delete, typed before anything added so far
+
+        Args:
+            text: the text
+            kb_controller: the keyboard controller (wrapper) it was typed with
+            word_jumps: whether the app it was typed into can be trusted with
+                word jumps. Only used if it's true for all the text
+        """
+        self._texts.append(text)
+        self._kb_controller = kb_controller
+        self._word_jumps = self._word_jumps and word_jumps
+
+    def flush(self):
+        """Delete everything collected so far
+        """
+        if self._texts:
+            text = ''.join(reversed(self._texts))
+            with self._kb_controller.batch() as batch:
+                for kind, count in plan_deletion(text, self._word_jumps):
+                    if kind == 'word':
+                        batch.press(WORD_JUMP_KEY)
+                    for _ in range(count):
+                        batch.tap(Key.backspace)
+                    if kind == 'word':
+                        batch.release(WORD_JUMP_KEY)
+        self._texts = []
+        self._word_jumps = True
+
+    def __enter__(self) -> UndoPlan:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # like a batch, don't carry out half an undo
+        if exc_type is None:
+            self.flush()
+        return False
+
 
 class Action:
     """An action that can be taken by the app
@@ -8,11 +116,16 @@ class Action:
     For now, includes:
     - written text
     - executed commands
+
+    Lots of these pile up in the history over a long session, so subclasses
+    should declare __slots__
     """
+    __slots__ = ()
+
     def undo(self) -> bool:
         """Reverts the effect of the action
 
-        Should be implemented in action subclasses
+        Action subclasses should implement either this or undo_into()
 
         Basically, if the user would expect an undo for this action to 
         actually count as an undo, then it's substantial. The primary use 
@@ -24,11 +137,30 @@ class Action:
         Returns:
             True if this undo was "substantial".  
         """
-        raise NotImplementedError
+        with UndoPlan() as plan:
+            return self.undo_into(plan)
+
+    def undo_into(self, plan: UndoPlan) -> bool:
+        """Reverts the effect of the action, as part of a bigger undo
+
+        Actions that just delete typed text should add it to the plan, to be
+        deleted along with everything else. By default, the action gets
+        undone straight away, after whatever's on the plan so far
+
+        Args:
+            plan: the undo in progress
+
+        Returns:
+            see undo()
+        """
+        plan.flush()
+        return self.undo()
 
 class UtteranceHistory:
     """History of the actions in one utterance
     """
+    __slots__ = ('actions',)
+
     def __init__(self, actions: List[Action]):
         """Init
         
@@ -44,10 +176,22 @@ class UtteranceHistory:
             True if this undo was "substantial". See documentation for     
                 Action() for more information
         """
+        with UndoPlan() as plan:
+            return self.undo_into(plan)
+
+    def undo_into(self, plan: UndoPlan) -> bool:
+        """Undo the utterance, as part of a bigger undo
+
+        Args:
+            plan: see Action.undo_into()
+
+        Returns:
+            see undo()
+        """
         substantial = False
         for action in reversed(self.actions):
             # if any of the actions was considered substantial, the whole utterance is substantial
-            new_substantial = action.undo()
+            new_substantial = action.undo_into(plan)
             substantial = substantial or new_substantial
         return substantial
 
@@ -68,14 +212,20 @@ class ActionHistory:
         utterance = UtteranceHistory(actions)
         self.utterance_history.append(utterance)
 
-    def undo_utterance(self) -> bool:
+    def undo_utterance(self, plan: Optional[UndoPlan] = None) -> bool:
         """Undo the last utterance
 
+        Args:
+            plan: to undo several utterances in one go. See 
+                Action.undo_into()
+
         Returns:
             True if this undo was "substantial". See documentation for     
                 Action() for more information
         """
         last_utterance = self.utterance_history.pop()
-        return last_utterance.undo()
+        if plan is None:
+            return last_utterance.undo()
+        return last_utterance.undo_into(plan)
 
 
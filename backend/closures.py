@@ -0,0 +1,110 @@
+"""Fixing the whitespace around closures: text surrounded by the relevant
+special character, e.g. `asdf`, "asdf" or (asdf)
+
+Speech to text puts spaces around everything, so "quote hello quote" ends up
+as ' " hello " '. The space just inside each closure needs to go.
+"""
+
+import re
+
+# the characters that open or close a closure
+_CLOSURE_CHARS_RE = re.compile(r'[`"\'()]')
+
+# characters where the same one opens a closure and then closes it
+_TOGGLE_CHARS = '`"\''
+
+class ClosureFixer:
+    """Takes out the whitespace just inside closures
+
+    Keeps track of which closures are open from one utterance to the next, so
+    a quote opened in one utterance gets closed in the next. Call reset() when
+    the text is going somewhere new, e.g. after the user clicks somewhere.
+
+    Leaves alone:
+    - escaped closure characters, e.g. \\"
+    - apostrophes inside words, e.g. don't
+
+    Closures of different kinds can nest, e.g. ("it's `here`"), since each kind
+    is tracked separately.
+    """
+
+    def __init__(self):
+        # for each of _TOGGLE_CHARS, whether the next one opens a closure
+        self._opens = {}
+        # whether the last text ended by opening a closure, so the space at
+        # the start of the next text is just inside it
+        self._strip_leading_space = False
+        self.reset()
+
+    def reset(self):
+        """Forget which closures are open
+        """
+        self._opens = {char: True for char in _TOGGLE_CHARS}
+        self._strip_leading_space = False
+
+    def fix(self, the_text: str, remove_space_before_open_paren: bool = False,
+            remove_space_after_close_paren: bool = False) -> str:
+        """Fix the whitespace around closures in some text
+
+        Looks at each closure character once, so takes time linear in the
+        length of the text.
+
+        Args:
+            the_text: the text to fix
+            remove_space_before_open_paren: also take out the space before
+                (, e.g. "print (" -> "print("
+            remove_space_after_close_paren: also take out the space after )
+
+        Returns:
+            the fixed text
+        """
+        if not the_text:
+            return the_text
+        # indices of the whitespace to remove, if they are whitespace
+        remove_indcs = set()
+        # whether the text ends by opening a closure
+        ends_open = False
+        if self._strip_leading_space:
+            remove_indcs.add(0)
+            self._strip_leading_space = False
+
+        for match in _CLOSURE_CHARS_RE.finditer(the_text):
+            ichar = match.start()
+            char = the_text[ichar]
+            if ichar > 0 and the_text[ichar - 1] == '\\':
+                continue
+            if char in _TOGGLE_CHARS:
+                if char == "'" and 0 < ichar < len(the_text) - 1 and \
+                        the_text[ichar - 1].isalnum() and \
+                        the_text[ichar + 1].isalnum():
+                    continue
+                if self._opens[char]:
+                    # remove the following white space, if any
+                    remove_indcs.add(ichar + 1)
+                    ends_open = ichar == len(the_text) - 1
+                else:
+                    # remove the preceding whitespace, if any
+                    remove_indcs.add(ichar - 1)
+                self._opens[char] = not self._opens[char]
+            elif char == '(':
+                if remove_space_before_open_paren:
+                    remove_indcs.add(ichar - 1)
+                remove_indcs.add(ichar + 1)
+                ends_open = ichar == len(the_text) - 1
+            else:
+                remove_indcs.add(ichar - 1)
+                if remove_space_after_close_paren:
+                    remove_indcs.add(ichar + 1)
+
+        # not for a closing ) at the end, even though the space after it
+        # might be going: that one's outside the closure
+        self._strip_leading_space = ends_open
+
+        pieces = []
+        last_index = 0
+        for index in sorted(remove_indcs):
+            if 0 <= index < len(the_text) and the_text[index] == ' ':
+                pieces.append(the_text[last_index:index])
+                last_index = index + 1
+        pieces.append(the_text[last_index:])
+        return ''.join(pieces)
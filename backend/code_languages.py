@@ -0,0 +1,151 @@
+"""Tables for dictating code, per language
+
+What gets said for each symbol, which words are keywords, and how identifiers
+are cased all live in code_languages.yml. A language's tables get compiled
+(see LanguageTable) the first time that language is used, then cached, so
+formatting an utterance is just lookups.
+"""
+
+from collections import namedtuple
+from os import path
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+from backend.casing import CASES
+
+# the file with the tables for all the languages
+LANGUAGES_FILE = path.join(path.dirname(__file__), 'code_languages.yml')
+
+# spacing name -> whether there's a space (before, after)
+SPACINGS = {
+    'both': (True, True),
+    'none': (False, False),
+    'after': (False, True),
+    'before': (True, False),
+}
+
+# something said that means something in code
+# - text: what to type
+# - kind: 'symbol', 'quote', 'keyword', or 'casing' (text is then the case
+#     for the next identifier)
+# - space_before, space_after: whether it wants a space before / after it
+CodeToken = namedtuple('CodeToken',
+    ['text', 'kind', 'space_before', 'space_after'])
+
+class LanguageTable:
+    """The compiled tables for one language
+
+    Args:
+        name: the language's name
+        table_def: the language's tables from code_languages.yml, with
+            the common ones merged in
+    """
+
+    def __init__(self, name: str, table_def: Dict[str, Any]):
+        self.name = name
+        # how to join up the words of an identifier
+        self.casing: str = table_def.get('casing', 'snake')
+        if self.casing not in CASES:
+            raise ValueError(f'Unknown casing "{self.casing}" for language '
+                f'"{name}"')
+
+        # first spoken word -> [(all the spoken words, token)], longest first
+        self._phrases: Dict[str, List[Tuple[Tuple[str, ...], CodeToken]]] = {}
+        for spoken, (text, spacing) in table_def.get('symbols', {}).items():
+            if spacing == 'quote':
+                self._add_phrase(spoken, CodeToken(text, 'quote', True, True))
+            elif spacing in SPACINGS:
+                self._add_phrase(spoken,
+                    CodeToken(text, 'symbol', *SPACINGS[spacing]))
+            else:
+                raise ValueError(f'Unknown spacing "{spacing}" for "{spoken}" '
+                    f'in language "{name}"')
+        for keyword in table_def.get('keywords', []):
+            self._add_phrase(keyword, CodeToken(keyword, 'keyword', True, True))
+        for spoken, keyword in table_def.get('spoken_keywords', {}).items():
+            self._add_phrase(spoken, CodeToken(keyword, 'keyword', True, True))
+        for spoken, case in table_def.get('casing_words', {}).items():
+            if case not in CASES:
+                raise ValueError(f'Unknown casing "{case}" for "{spoken}" in '
+                    f'language "{name}"')
+            self._add_phrase(spoken, CodeToken(case, 'casing', False, False))
+        for phrases in self._phrases.values():
+            phrases.sort(key=lambda phrase: len(phrase[0]), reverse=True)
+
+    def _add_phrase(self, spoken: str, token: CodeToken):
+        """Add something that can be said
+
+        Args:
+            spoken: what's said
+            token: what it means
+        """
+        words = tuple(spoken.split())
+        phrases = self._phrases.setdefault(words[0], [])
+        # later definitions win, e.g. the language's own over common
+        phrases[:] = [phrase for phrase in phrases if phrase[0] != words]
+        phrases.append((words, token))
+
+    def match(self, words: List[str], start: int
+            ) -> Tuple[Optional[CodeToken], int]:
+        """Find the longest phrase said starting at some word
+
+        Args:
+            words: all the words said
+            start: index of the word to start at
+
+        Returns:
+            the token, or None if nothing matches, and the number of words it
+                takes up
+        """
+        for phrase_words, token in self._phrases.get(words[start], []):
+            if tuple(words[start:start + len(phrase_words)]) == phrase_words:
+                return token, len(phrase_words)
+        return None, 1
+
+# the contents of LANGUAGES_FILE, once something needs it
+_languages_def: Optional[Dict[str, Dict[str, Any]]] = None
+# language name -> its compiled tables, once something's used it
+_language_tables: Dict[str, LanguageTable] = {}
+
+def get_language_table(name: str) -> LanguageTable:
+    """Get the compiled tables for a language, compiling them the first time
+
+    Args:
+        name: the language's name, one of those in code_languages.yml
+
+    Raises:
+        ValueError: if there's no such language
+
+    Returns:
+        the tables
+    """
+    table = _language_tables.get(name)
+    if table is not None:
+        return table
+
+    global _languages_def # pylint: disable=global-statement
+    if _languages_def is None:
+        with open(LANGUAGES_FILE, 'r') as f:
+            _languages_def = yaml.safe_load(f)
+    if name == 'common' or name not in _languages_def:
+        raise ValueError(f'Unknown language "{name}", should be one of '
+            f'{[lang for lang in _languages_def if lang != "common"]}')
+
+    # the language's own tables on top of the common ones
+    common_def = _languages_def.get('common') or {}
+    language_def = _languages_def[name] or {}
+    table_def = {}
+    for key in set(common_def) | set(language_def):
+        if isinstance(language_def.get(key, common_def.get(key)), dict):
+            table_def[key] = {**common_def.get(key, {}),
+                **language_def.get(key, {})}
+        elif isinstance(language_def.get(key, common_def.get(key)), list):
+            table_def[key] = common_def.get(key, []) + \
+                language_def.get(key, [])
+        else:
+            table_def[key] = language_def.get(key, common_def.get(key))
+
+    table = LanguageTable(name, table_def)
+    _language_tables[name] = table
+    return table
@@ -0,0 +1,266 @@
+"""Compact trie for looking up multi-word command names
+
+Command names are sequences of word tokens, e.g. "git add all". Looking up
+which command (if any) a stream of spoken tokens starts with is a walk down
+a trie, one token at a time. With lots of commands and aliases a tree of
+nested dicts gets heavy (one dict per node), so instead:
+- every distinct token is interned and given an integer id
+- nodes are just integers, with the root at 0
+- all the edges live in a single flat dict, keyed by (node, token id) packed
+  into one int
+- the command name ending at each node (if any) lives in a flat array
+"""
+
+from array import array
+import sys
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# the id of the root node
+ROOT_NODE = 0
+
+# value stored for nodes where no command name ends
+NO_VALUE = -1
+
+# edge keys are (node << TOKEN_ID_BITS) | token_id
+TOKEN_ID_BITS = 32
+
+
+class CommandTrie:
+    """Trie over the word tokens of command names, of any depth
+
+    Build it up with add(), then use longest_match() or a TrieCursor to
+    look things up.
+    """
+
+    def __init__(self):
+        # token string -> token id
+        self._token_ids: Dict[str, int] = {}
+        # packed (node, token id) -> child node
+        self._edges: Dict[int, int] = {}
+        # node -> index into self._names of the name ending there, or NO_VALUE
+        self._values = array('i', [NO_VALUE])
+        # the names stored in the trie
+        self._names: List[str] = []
+        # length, in tokens, of the longest name
+        self.max_depth = 0
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    @property
+    def num_nodes(self) -> int:
+        """Number of nodes in the trie, including the root
+        """
+        return len(self._values)
+
+    def _intern_token(self, token: str) -> int:
+        """Get the id of a token, assigning a new one if it's not known yet
+
+        Args:
+            token: the token
+
+        Returns:
+            the token id
+        """
+        token_id = self._token_ids.get(token)
+        if token_id is None:
+            token_id = len(self._token_ids)
+            self._token_ids[sys.intern(token)] = token_id
+        return token_id
+
+    def add(self, name: str) -> bool:
+        """Add a name to the trie
+
+        Args:
+            name: the name, as space separated tokens
+
+        Returns:
+            True if the name was added, False if it was already there
+        """
+        tokens = name.split()
+        if not tokens:
+            raise ValueError('Cannot add an empty name')
+
+        node = ROOT_NODE
+        for token in tokens:
+            key = (node << TOKEN_ID_BITS) | self._intern_token(token)
+            child = self._edges.get(key)
+            if child is None:
+                child = len(self._values)
+                self._values.append(NO_VALUE)
+                self._edges[key] = child
+            node = child
+
+        if self._values[node] != NO_VALUE:
+            return False
+        self._values[node] = len(self._names)
+        self._names.append(' '.join(tokens))
+        self.max_depth = max(self.max_depth, len(tokens))
+        return True
+
+    def child(self, node: int, token: str) -> Optional[int]:
+        """Follow the edge for a token out of a node
+
+        Args:
+            node: the node to start from
+            token: the token
+
+        Returns:
+            the child node, or None if there's no such edge
+        """
+        token_id = self._token_ids.get(token)
+        if token_id is None:
+            return None
+        return self._edges.get((node << TOKEN_ID_BITS) | token_id)
+
+    def value(self, node: int) -> Optional[str]:
+        """Get the name that ends at a node
+
+        Args:
+            node: the node
+
+        Returns:
+            the name, or None if no name ends there
+        """
+        index = self._values[node]
+        if index == NO_VALUE:
+            return None
+        return self._names[index]
+
+    def node_at(self, tokens: Sequence[str]) -> Optional[int]:
+        """Follow the edges for a sequence of tokens from the root
+
+        Args:
+            tokens: the tokens
+
+        Returns:
+            the node reached, or None if the tokens aren't a prefix of any
+                name
+        """
+        node = ROOT_NODE
+        for token in tokens:
+            node = self.child(node, token)
+            if node is None:
+                return None
+        return node
+
+    def next_tokens(self, tokens_so_far: Sequence[str]) -> List[str]:
+        """Get the tokens that can follow a prefix of tokens
+
+        This scans all the edges, so it's meant for introspection rather
+        than for parsing. Use a TrieCursor for that.
+
+        Args:
+            tokens_so_far: the prefix
+
+        Returns:
+            the tokens that can follow, or an empty list if the prefix isn't
+                in the trie
+        """
+        node = self.node_at(tokens_so_far)
+        if node is None:
+            return []
+
+        tokens_by_id = {token_id: token
+            for token, token_id in self._token_ids.items()}
+        mask = (1 << TOKEN_ID_BITS) - 1
+        return [tokens_by_id[key & mask] for key in self._edges
+            if key >> TOKEN_ID_BITS == node]
+
+    def longest_match(self, tokens: Sequence[str],
+            start: int = 0) -> Tuple[Optional[str], int]:
+        """Find the longest name that the tokens start with
+
+        Args:
+            tokens: the tokens to match against
+            start: the index of the token to start matching at
+
+        Returns:
+            Tuple of:
+            - the longest matching name, or None if nothing matched
+            - the number of tokens the name spans
+        """
+        token_ids = self._token_ids
+        edges = self._edges
+        values = self._values
+
+        node = ROOT_NODE
+        best_index = NO_VALUE
+        best_len = 0
+        for itoken in range(start, len(tokens)):
+            token_id = token_ids.get(tokens[itoken])
+            if token_id is None:
+                break
+            node = edges.get((node << TOKEN_ID_BITS) | token_id)
+            if node is None:
+                break
+            if values[node] != NO_VALUE:
+                best_index = values[node]
+                best_len = itoken - start + 1
+
+        if best_index == NO_VALUE:
+            return None, 0
+        return self._names[best_index], best_len
+
+    def cursor(self) -> 'TrieCursor':
+        """Get a cursor for walking the trie one token at a time
+
+        Returns:
+            a cursor at the root
+        """
+        return TrieCursor(self)
+
+
+class TrieCursor:
+    """A position in a CommandTrie, which can be advanced token by token
+
+    Keeps track of the longest name seen so far, so it can be used for
+    longest-match parsing while tokens are streaming in
+    """
+    __slots__ = ('_trie', 'node', 'depth', 'match', 'match_depth')
+
+    def __init__(self, trie: CommandTrie):
+        """Init
+
+        Args:
+            trie: the trie to walk
+        """
+        self._trie = trie
+        self.reset()
+
+    def reset(self):
+        """Move back to the root
+        """
+        self.node = ROOT_NODE
+        # number of tokens advanced through
+        self.depth = 0
+        # longest name passed through so far, and its depth
+        self.match: Optional[str] = None
+        self.match_depth = 0
+
+    def advance(self, token: str) -> bool:
+        """Advance the cursor by one token
+
+        Args:
+            token: the next token
+
+        Returns:
+            True if the trie had an edge for the token. If False, the cursor
+                hasn't moved
+        """
+        child = self._trie.child(self.node, token)
+        if child is None:
+            return False
+        self.node = child
+        self.depth += 1
+        name = self._trie.value(child)
+        if name is not None:
+            self.match = name
+            self.match_depth = self.depth
+        return True
+
+    @property
+    def value(self) -> Optional[str]:
+        """The name ending exactly at the cursor, if any
+        """
+        return self._trie.value(self.node)
@@ -1,19 +1,22 @@
 # pylint: disable=arguments-differ
 
 from __future__ import annotations
-from copy import copy, deepcopy
 import logging
-import time
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Sequence
 
 from pynput.keyboard import Controller, Key
 
-from backend.keystrokes import execute_modified_keystroke
-from backend.actions import Action, ActionHistory
-from ui.kb_controller import KBCntrlrWrapper
+from backend.keystrokes import compile_keys
+from backend.actions import Action, ActionHistory, UndoPlan
+from backend.casing import CASES, format_case
+from backend.command_trie import CommandTrie
+from backend.fuzzy_index import FuzzyCommandIndex
+from backend.plan import ResolvedCommand
+from backend.trace import get_tracer
+from ui.kb_controller import KBCntrlrWrapper, KBCntrlCommand
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+tracer = get_tracer('commands')
 
 
 # the separator used between separate keys within a hotkey, e.g. 'ctrl+a'
@@ -31,6 +34,11 @@ class CommandMultiplierParser:
     # all the different tokens that can be used for a multiplier post fix
     # note that the multiplier postfix is optional note.
     postfixes = ['*', 'times', 'times', 'x', 'X']
+    _postfixes_set = frozenset(postfixes)
+
+    # characters that an integer string can start with (int() also allows
+    # leading whitespace, but tokens never have any)
+    _integer_starts = frozenset('+-0123456789')
 
     # hard-coded conversions from tokens to numbers. Accounts for edge
     # cases we've seen
@@ -84,16 +92,26 @@ class CommandMultiplierParser:
             token: the token from the raw command
 
         Returns:
-            the converted multiplier, or None if it couldn't be converted
+            the converted multiplier, or None if it couldn't be converted, or
+                isn't a positive number
         """
 
-        # first see if it's an integer
+        # check the fixed conversions first, they're a cheap lookup
+        cmd_multiplier = CommandMultiplierParser.multiplier_fixed_conversions.get(token, None)
+        if cmd_multiplier is not None:
+            return cmd_multiplier
+
+        # then see if it's an integer. Don't bother trying if it doesn't
+        # start like one, raising and catching ValueError for every command
+        # is slow
+        if token[:1] not in CommandMultiplierParser._integer_starts:
+            return None
         try:
             cmd_multiplier = int(token)
-        # if we don't find a number here, then see if it's in the fixed
-        # conversions dictionary
         except ValueError:
-            cmd_multiplier = CommandMultiplierParser.multiplier_fixed_conversions.get(token, None)
+            return None
+        if cmd_multiplier < 1:
+            return None
         return cmd_multiplier
 
     @staticmethod
@@ -114,24 +132,39 @@ class CommandMultiplierParser:
                 multiplier string tokens
         """
 
-        tokens_used = 0
+        return CommandMultiplierParser.parse_multiplier_tokens(
+            multiplier_string.split())
 
-        tokens = multiplier_string.split()
+    @staticmethod
+    def parse_multiplier_tokens(
+            tokens: Sequence[str], start: int = 0) -> Tuple[int, int]:
+        """Determines the multiplier number from already split tokens
+
+        Args:
+            tokens: the tokens, which may continue on past the multiplier
+            start: the index of the token where the multiplier would start
+
+        Returns:
+            Tuple of:
+            - the multiplier number
+            - the number of tokens used from the tokens to parse the 
+                multiplier number. See parse_multiplier_string()
+        """
+        if start >= len(tokens):
+            return 1, 0
 
         ## look for the multiplier number
         cmd_multiplier = CommandMultiplierParser.convert_multiplier(
-            tokens[0])
+            tokens[start])
         # if a valid multiplier was not found, the multiplier is
         # implicitly 1
         if cmd_multiplier is None:
-            cmd_multiplier = 1
-            return cmd_multiplier, tokens_used
-        else:
-            tokens_used += 1
+            return 1, 0
+        tokens_used = 1
 
         ## look for the multiplier postfix
-
-        if tokens[1] in CommandMultiplierParser.postfixes:
+        if start + 1 < len(tokens) and \
+                tokens[start + 1] in CommandMultiplierParser._postfixes_set:
             tokens_used += 1
 
         return cmd_multiplier, tokens_used
@@ -142,11 +175,188 @@ class CommandRegistry:
     """see implementation below"""
     pass
 
-class CommandExecutor(Action):
+class CommandInvocation(Action):
+    """Record of one execution of a command, kept in the action history
+
+    Command executors are shared, immutable templates. Anything specific to
+    one execution (like the text that got typed, for undo) lives on one of
+    these small records instead.
+
+    The base record is for commands whose undo is a noop
+    """
+    __slots__ = ('executor',)
+
+    def __init__(self, executor: CommandExecutor):
+        """Init
+
+        Args:
+            executor: the executor that was executed
+        """
+        self.executor = executor
+
+    def undo(self) -> bool:
+        """Undo
+
+        Returns:
+            False, because this action is not considered "substantial". See
+                documentation for Action() for more information
+        """
+        # note that this is a noop
+        return False
+
+    def undo_into(self, plan: UndoPlan) -> bool:
+        """Undo, as part of a bigger undo
+
+        Args:
+            plan: see Action.undo_into()
+
+        Returns:
+            see undo()
+        """
+        # nothing to do, so no need to carry out the plan so far first
+        return self.undo()
+
+class TypedTextInvocation(CommandInvocation):
+    """Record of a command execution that typed out some text
+    """
+    __slots__ = ('text', 'word_jumps')
+
+    def __init__(self, executor: CommandExecutor, text: str,
+            word_jumps: bool = False):
+        """Init
+
+        Args:
+            executor: see superclass
+            text: the text typed by this execution
+            word_jumps: whether undo can delete whole words at a time, see 
+                UndoPlan
+        """
+        super().__init__(executor)
+        self.text = text
+        self.word_jumps = word_jumps
+
+    def undo(self) -> bool:
+        """Undo the text writing action
+
+        Deletes all the characters written
+
+        Returns:
+            True, because this action is "substantial". See
+                documentation for Action() for more information
+        """
+        return Action.undo(self)
+
+    def undo_into(self, plan: UndoPlan) -> bool:
+        """Undo the text writing action, as part of a bigger undo
+
+        Args:
+            plan: see Action.undo_into()
+
+        Returns:
+            see undo()
+        """
+        tracer.debug('undo_text', type(self.executor).__name__, self.text)
+        kb_controller = self.executor._kb_controller # pylint: disable=protected-access
+        plan.delete(self.text, kb_controller, self.word_jumps)
+        return True
+
+class ChainInvocation(CommandInvocation):
+    """Record of a chain command execution
+    """
+    __slots__ = ('actions',)
+
+    def __init__(self, executor: CommandExecutor, actions: List[Action]):
+        """Init
+
+        Args:
+            executor: see superclass
+            actions: the records of the chained commands, in order
+        """
+        super().__init__(executor)
+        self.actions = actions
+
+    def undo(self) -> bool:
+        """Undo
+
+        Returns:
+            True, if any of the actions in this chain are "substantial". See
+                documentation for Action() for more information
+        """
+        return Action.undo(self)
+
+    def undo_into(self, plan: UndoPlan) -> bool:
+        """Undo, as part of a bigger undo
+
+        Args:
+            plan: see Action.undo_into()
+
+        Returns:
+            see undo()
+        """
+        substantial = False
+        for action in reversed(self.actions):
+            # if any of the actions was considered substantial, the whole utterance is substantial
+            new_substantial = action.undo_into(plan)
+            substantial = substantial or new_substantial
+        return substantial
+
+class RepeatedInvocation(CommandInvocation):
+    """Record of a command executed several times in one go, e.g. "12 times dash"
+
+    Only for commands where every repetition does exactly the same thing
+    """
+    __slots__ = ('invocation', 'count')
+
+    def __init__(self, executor: CommandExecutor,
+            invocation: CommandInvocation, count: int):
+        """Init
+
+        Args:
+            executor: see superclass
+            invocation: the record of a single repetition
+            count: the number of repetitions
+        """
+        super().__init__(executor)
+        self.invocation = invocation
+        self.count = count
+
+    def undo(self) -> bool:
+        """Undo every repetition
+
+        Returns:
+            True, if the single repetition's undo is "substantial". See
+                documentation for Action() for more information
+        """
+        return Action.undo(self)
+
+    def undo_into(self, plan: UndoPlan) -> bool:
+        """Undo every repetition, as part of a bigger undo
+
+        Args:
+            plan: see Action.undo_into()
+
+        Returns:
+            see undo()
+        """
+        substantial = False
+        for _ in range(self.count):
+            substantial = self.invocation.undo_into(plan) or substantial
+        return substantial
+
+class CommandExecutor:
     """Executes a command
 
-    Meant to be subclassed for specific command types
+    Meant to be subclassed for specific command types. Executors are built
+    once per command when the registry loads, and shared by every execution
+    of the command, so they must not be changed in execute(). Each 
+    execution returns a CommandInvocation to record what it did.
     """
+
+    # extra time to wait (in seconds) after the command's keystrokes have been
+    # injected, before anything else gets typed. Set per command from the 
+    # optional 'settle_time' field in the command definition
+    settle_time = 0.0
+
     def __init__(self, cmd_reg: CommandRegistry):
         """Init
 
@@ -158,7 +368,7 @@ class CommandExecutor(Action):
     def execute(self,
             action_history: ActionHistory,
             cmd_execution_state: Dict[str, Any],
-            stt_args: Optional[str] = None,):
+            stt_args: Optional[str] = None,) -> CommandInvocation:
         """Execute the command, with given arguments
 
         should be overridden in subclasses
@@ -176,22 +386,32 @@ class CommandExecutor(Action):
         """
         raise NotImplementedError
 
-    def safe_deepcopy(self) -> CommandExecutor:
-        """Deep copy this object, without copying things that shouldn't be copied
+    def execute_repeated(self,
+            count: int,
+            action_history: ActionHistory,
+            cmd_execution_state: Dict[str, Any],
+            stt_args: Optional[str] = None,) -> CommandInvocation:
+        """Execute the command count times, for a spoken multiplier
+
+        By default this just calls execute() count times. Subclasses that can
+        send all the repetitions to the keyboard controller in one go should
+        override it.
+
+        Args:
+            count: the number of times to execute
+            action_history: see execute()
+            cmd_execution_state: see execute()
+            stt_args: see execute()
 
         Returns:
-            a new copy
+            a single action for action history, covering all the repetitions
         """
-        new_copy = copy(self)
-        for name, val in self.__dict__.items():
-            # skip cmd_reg, because it has a thread lock in it
-            if name in ['_kb_controller', 'cmd_reg']:
-                continue
-            # others, deepcopy, to make sure there's no crosstalk between instances
-            else:
-                self.__dict__[name] = deepcopy(val)
-        return new_copy
-
+        invocations = [
+            self.execute(action_history, cmd_execution_state, stt_args)
+            for _ in range(count)]
+        if len(invocations) == 1:
+            return invocations[0]
+        return ChainInvocation(self, invocations)
 
 
 class KeystrokeCmdExec(CommandExecutor):
@@ -225,6 +445,15 @@ class KeystrokeCmdExec(CommandExecutor):
 
         self.prepend_whitespace = prepend_whitespace_when_embedded
 
+        # the keyboard controller commands to send, worked out up front. Also
+        # catches broken key definitions at load time
+        self.program = compile_keys(keys, self.hotkey_separator)
+        # the program is kept by the keyboard controller, so running it is a 
+        # tiny message
+        self._macro_id: Optional[int] = None
+        if kb_controller is not None:
+            self._macro_id = kb_controller.define_macro(self.program)
+
     def execute(self,
             action_history: ActionHistory,
             cmd_execution_state: Dict[str, Any],
@@ -239,34 +468,44 @@ class KeystrokeCmdExec(CommandExecutor):
             cmd_execution_state: see superclass
             stt_args: see superclass
         """
-        logger.debug("KeystrokeCmdExec: typing keys: '{}'".format(self.keys))
+        return self.execute_repeated(1, action_history, cmd_execution_state,
+            stt_args)
+
+    def execute_repeated(self,
+            count: int,
+            action_history: ActionHistory,
+            cmd_execution_state: Dict[str, Any],
+            stt_args: Optional[str] = None):
+        """Execute command count times
+
+        The keystrokes are already in the keyboard controller (see 
+        KBCntrlrWrapper.define_macro()), so all the repetitions go over as a
+        single small message
+
+        Args:
+            count: see superclass
+            action_history: see superclass
+            cmd_execution_state: see superclass
+            stt_args: see superclass
+        """
+        tracer.debug('keystroke', self.keys, count)
 
         embedded_command = cmd_execution_state['embedded_command']
 
         # there should be no speech to text arguments for keystroke command
         assert stt_args is None
 
-        # type a space if desired
+        # type a space if desired (once per repetition, like before)
         if self.prepend_whitespace and embedded_command:
-            self._kb_controller.tap(Key.space)
-
-        for hotkey in self.keys:
-            # deal with delay
-            if hotkey.startswith('delay'):
-                delay_time = float(hotkey.split()[1])
-                time.sleep(delay_time)
-                continue
-
-            execute_modified_keystroke(self._kb_controller, hotkey, self.hotkey_separator)
-
-    # def undo(self) -> bool:
-    #     """Undo the action
+            self._kb_controller.send_batch([KBCntrlCommand('tap', Key.space),
+                KBCntrlCommand('macro', (self._macro_id, 1))] * count)
+        else:
+            self._kb_controller.run_macro(self._macro_id, count)
 
-    #     Returns:
-    #         True if this undo was "substantial". See documentation for
-    #             Action() for more information
-    #     """
-    #     return True
+        invocation = CommandInvocation(self)
+        if count == 1:
+            return invocation
+        return RepeatedInvocation(self, invocation, count)
 
 
 class TypeCmdExec(CommandExecutor):
@@ -304,31 +543,40 @@ class TypeCmdExec(CommandExecutor):
             cmd_execution_state: see superclass
             stt_args: see superclass
         """
+        return self.execute_repeated(1, action_history, cmd_execution_state,
+            stt_args)
+
+    def execute_repeated(self,
+            count: int,
+            action_history: ActionHistory,
+            cmd_execution_state: Dict[str, Any],
+            stt_args: Optional[str] = None):
+        """Execute command count times, typing all the repetitions at once
+
+        Args:
+            count: see superclass
+            action_history: see superclass
+            cmd_execution_state: see superclass
+            stt_args: see superclass
+        """
         embedded_command = cmd_execution_state['embedded_command']
 
+        the_text = self.text
         if self.prepend_whitespace and embedded_command:
-            self.text = ' ' + self.text
+            the_text = ' ' + the_text
 
-        logger.debug("TypeCmdExec: typing: '{}'".format(self.text))
+        tracer.debug('type', the_text, count)
 
         # there should be no speech to text arguments for keystroke command
         assert stt_args is None
 
-        self._kb_controller.type(self.text)
-
-    def undo(self) -> bool:
-        """Undo the text writing action
+        self._kb_controller.type(the_text * count)
 
-        Deletes all the characters written
-
-        Returns:
-            True, because this action is "substantial". See
-                documentation for Action() for more information
-        """
-        logger.debug('TypeCmdExec: undo, deleting text {}'.format(self.text))
-        for char in self.text: #pylint: disable=unused-variable
-            self._kb_controller.tap(Key.backspace)
-        return True
+        invocation = TypedTextInvocation(self, the_text,
+            cmd_execution_state.get('undo_word_jumps', False))
+        if count == 1:
+            return invocation
+        return RepeatedInvocation(self, invocation, count)
 
 class CaseCmdExec(CommandExecutor):
     """Executea case command, which formats the text arguments with a specific case, like snake case
@@ -347,18 +595,8 @@ class CaseCmdExec(CommandExecutor):
         camel: slimShady
     """
 
-    CASES = [
-        'upper',
-        'lower',
-        'title',
-        'snake',
-        'screaming snake',
-        'camel',
-        'pascal',
-        'lower letters',
-        'upper letters'
-        'name letters'
-    ]
+    # see backend.casing
+    CASES = CASES
 
     def __init__(self, cmd_reg: CommandRegistry,
             kb_controller: KBCntrlrWrapper,
@@ -400,109 +638,22 @@ class CaseCmdExec(CommandExecutor):
         embedded_command = cmd_execution_state['embedded_command']
 
         if not self.in_place:
-            the_text = CaseCmdExec.format_case(stt_args, self.case)
+            the_text = format_case(stt_args, self.case)
             if self.prepend_whitespace and embedded_command:
                 the_text = ' ' + the_text
             # if self.append_whitespace:
             #     the_text = the_text + ' '
-            logger.debug("CaseCmdExec: typing: '{}'".format(the_text))
-            self.text = the_text
+            tracer.debug('case', the_text)
             self._kb_controller.type(the_text)
+            return TypedTextInvocation(self, the_text,
+                cmd_execution_state.get('undo_word_jumps', False))
         else:
             # there should be no speech to text arguments for this case
             assert stt_args is None
+            return CommandInvocation(self)
 
-    def undo(self) -> bool:
-        """Undo the text writing action
-
-        Deletes all the characters written
-
-        Returns:
-            True, because this action is "substantial". See
-                documentation for Action() for more information
-        """
-        logger.debug('CaseCmdExec: undo, deleting text {}'.format(self.text))
-        for char in self.text: #pylint: disable=unused-variable
-            self._kb_controller.tap(Key.backspace)
-        return True
-
-    @staticmethod
-    def format_case(text: str, case: str) -> str: #pylint: disable=too-many-return-statements
-        """Format a list of string tokens in the given case
-
-        Args:
-            text: string of words separated by spaces
-            case: the case in which to format
-
-        Returns:
-            the formatted string
-        """
-        tokens = text.split()
-        # the raw tokens look like: 'bay laugh anguish hannover'
-        # returns 'BAY LAUGH ANGUISH HANNOVER'
-        if case == 'upper':
-            return ' '.join([token.upper() for token in tokens])
-
-        # the raw tokens look like: 'bay laugh anguish hannover'
-        # returns 'bay laugh anguish hannover'
-        elif case == 'lower':
-            return ' '.join([token.lower() for token in tokens])
-
-        # the raw tokens look like: 'bay laugh anguish hannover'
-        # returns 'Bay Laugh Anguish Hannover'
-        elif case == 'title':
-            return ' '.join([token.capitalize() for token in tokens])
-
-        # the raw tokens look like: 'bay laugh anguish hannover'
-        # returns 'BayLaughAnguishHannover'
-        elif case == 'pascal':
-            return ''.join([token.capitalize() for token in tokens])
-
-        # the raw tokens look like: 'bay laugh anguish hannover'
-        # returns 'bay_laugh_anguish_hannover'
-        elif case == 'snake':
-            return '_'.join(tokens)
-
-        # the raw tokens look like: 'bay laugh anguish hannover'
-        # returns 'BAY_LAUGH_ANGUISH_HANNOVER'
-        elif case == 'screaming snake':
-            return '_'.join([token.upper() for token in tokens])
-
-        # the raw tokens look like: 'bay laugh anguish hannover'
-        # returns 'bayLaughAnguishHannover'
-        elif case == 'camel':
-            return ''.join(
-                [tokens[0].lower()] + [token.capitalize() for token in tokens[1:]])
-
-        # the raw tokens look like: 'bay laugh anguish hannover'
-        # returns 'BLAH'
-        elif case == 'acronym':
-            first_letters = [token[0].upper() for token in tokens]
-            return ''.join(first_letters)
-
-        # the raw tokens look like: 'blah' or 'b l a h'
-        # returns 'blah'
-        elif case == 'lower letters':
-            joined = ''.join(tokens)
-            joined = joined.replace(' ','')
-            return joined.lower()
-
-        # the raw tokens look like: 'blah' or 'b l a h'
-        # returns 'BLAH'
-        elif case == 'upper letters':
-            joined = ''.join(tokens)
-            joined = joined.replace(' ','')
-            return joined.upper()
-
-        # the raw tokens look like: 'blah' or 'b l a h'
-        # returns 'Blah'
-        elif case == 'name letters':
-            joined = ''.join(tokens)
-            joined = joined.replace(' ','')
-            return joined.capitalize()
-
-        else:
-            raise NotImplementedError
+    # see backend.casing
+    format_case = staticmethod(format_case)
 
 class SublimeFindCmdExec(CommandExecutor):
     """Execute a sublime find command to move to desired text within the current file
@@ -526,6 +677,8 @@ class SublimeFindCmdExec(CommandExecutor):
         self._kb_controller = kb_controller
         self.hotkey_separator = HOTKEY_SEPARATOR
         self.find_hotkey = find_hotkey
+        self._find_program = compile_keys([find_hotkey],
+            self.hotkey_separator)
 
     def execute(self,
             action_history: ActionHistory,
@@ -540,7 +693,7 @@ class SublimeFindCmdExec(CommandExecutor):
         """
 
         if not stt_args:
-            logger.debug("SublimeFindCmdExec: found no string to search for")
+            tracer.debug('sublime_find_nothing')
 
         multiplier_separator_substr = ' pipe '
 
@@ -560,32 +713,25 @@ class SublimeFindCmdExec(CommandExecutor):
             content = stt_args
             num_tabs = 0
 
-        logger.debug("SublimeFindCmdExec: searching for '{}', tabbing {} times".format(content, num_tabs))
+        tracer.debug('sublime_find', content, num_tabs)
 
-        # enter the find dialog in sublime text
-        execute_modified_keystroke(self._kb_controller, self.find_hotkey, self.hotkey_separator)
+        with self._kb_controller.batch() as batch:
+            # enter the find dialog in sublime text
+            batch.extend(self._find_program)
 
-        #throw in a sleep, because if I try to use this in the browser not all the content gets captured
-        time.sleep(0.2)
+            #throw in a sleep, because if I try to use this in the browser not all the content gets captured
+            batch.delay(0.2)
 
-        # type the search string
-        self._kb_controller.type(content)
+            # type the search string
+            batch.type(content)
 
-        for icommand in range(num_tabs):
-            self._kb_controller.tap(Key.tab)
+            for icommand in range(num_tabs):
+                batch.tap(Key.tab)
 
-        # hit enter to drop the cursor to the left of the search string
-        self._kb_controller.tap(Key.enter)
+            # hit enter to drop the cursor to the left of the search string
+            batch.tap(Key.enter)
 
-    def undo(self) -> bool:
-        """Undo
-
-        Returns:
-            False, because this action is not considered "substantial". See
-                documentation for Action() for more information
-        """
-        # note that this is a noop
-        return False
+        return CommandInvocation(self)
 
 class UndoUtteranceCmdExec(CommandExecutor):
     """Undo the last utterance
@@ -617,28 +763,41 @@ class UndoUtteranceCmdExec(CommandExecutor):
             stt_args: see superclass
         """
 
-        assert stt_args is None
+        return self.execute_repeated(1, action_history, cmd_execution_state,
+            stt_args)
 
-        logger.debug("UndoUtteranceCmdExec: undoing last utterance")
+    def execute_repeated(self,
+            count: int,
+            action_history: ActionHistory,
+            cmd_execution_state: Dict[str, Any],
+            stt_args: Optional[str] = None):
+        """Undo the last count utterances, deleting any text in one go
 
-        # undo the utterance
-        substantial = action_history.undo_utterance()
-        # if the actions in an utterance are considered "not substantial", this
-        # will be False. In that case, we should proceed to continue undoing
-        # until we reach a substantial undo
-        while not substantial:
-            substantial = action_history.undo_utterance()
+        Args:
+            count: see superclass
+            action_history: see superclass
+            cmd_execution_state: see superclass
+            stt_args: see superclass
+        """
 
-    def undo(self) -> bool:
-        """Undo
+        assert stt_args is None
 
-        Returns:
-            False, because this action is not considered "substantial". See
-                documentation for Action() for more information
-        """
-        # note that this is a noop - we're not going to revert the undoing
-        # action
-        return False
+        tracer.debug('undo_utterances', count)
+
+        with UndoPlan() as plan:
+            for _ in range(count):
+                # undo the utterance
+                substantial = action_history.undo_utterance(plan)
+                # if the actions in an utterance are considered "not
+                # substantial", this will be False. In that case, we should
+                # proceed to continue undoing until we reach a substantial 
+                # undo
+                while not substantial:
+                    substantial = action_history.undo_utterance(plan)
+
+        # note that undoing this is a noop - we're not going to revert the
+        # undoing action
+        return CommandInvocation(self)
 
 class ChainCommandExec(CommandExecutor):
     """Execute a chain command, which is multiple commands strung together
@@ -658,7 +817,6 @@ class ChainCommandExec(CommandExecutor):
         """
         super().__init__(cmd_reg)
         self.commands = commands
-        self.executed_actions: List[Action] = []
 
     def execute(self,
             action_history: ActionHistory,
@@ -678,38 +836,52 @@ class ChainCommandExec(CommandExecutor):
         # there should be no speech to text arguments for chain command
         assert stt_args is None
 
+        executed_actions: List[Action] = []
         for icommand, cmd_name in enumerate(self.commands):
             executor = self.cmd_reg.get_command_executor(cmd_name)
-            # cmd_def_kwargs = self.cmd_reg.get_command_def_kwargs(cmd_name)
 
             # if we are in a chain, this should only be true for the first one
             if icommand > 0:
                 cmd_execution_state['embedded_command'] = False
 
-            self.executed_actions.append(
+            executed_actions.append(
                 executor.execute(action_history,
                     cmd_execution_state, stt_args=None))
 
-    def undo(self) -> bool:
-        """Undo
-
-        Returns:
-            True, if all the actions in this chain are "substantial". See
-                documentation for Action() for more information
-        """
-        substantial = False
-        for action in self.executed_actions:
-            # if any of the actions was considered substantial, the whole utterance is substantial
-            new_substantial = action.undo()
-            substantial = substantial or new_substantial
-        return substantial
+        return ChainInvocation(self, executed_actions)
 
 CommandDefinition = Dict[str, Any]
 CommandDefinitionKwargs = Dict[str, Any]
+CommandSettings = Dict[str, Any]
+
+def split_commands_file(
+        commands_file_def: Any) -> Tuple[List[CommandDefinition], CommandSettings]:
+    """Split the contents of a commands file into command definitions and settings
+
+    The commands file is either just a list of command definitions, or a 
+    mapping like:
+        settings:
+            fuzzy_match: ...
+        commands:
+        - name: ...
+
+    Args:
+        commands_file_def: the loaded yaml from the commands file
+
+    Returns:
+        Tuple of the command definitions and the settings
+    """
+    if isinstance(commands_file_def, list):
+        return commands_file_def, {}
+    return commands_file_def['commands'], commands_file_def.get('settings') or {}
 
 # disabling function redefined because we need this class defined for chain command exec
 class CommandRegistry: # pylint: disable=function-redefined
     """Maintains a registry of all the known commands
+
+    A registry is built once from a commands definition and treated as an
+    immutable snapshot from then on. To change the commands, build a new 
+    registry and swap it in (see Executor.reload_commands())
     """
 
     # nothing from string command type in the command definition to the class
@@ -722,12 +894,17 @@ class CommandRegistry: # pylint: disable=function-redefined
         'undo_utterance': UndoUtteranceCmdExec,
     }
 
-    def __init__(self, commands_def: List[CommandDefinition], kb_controller: KBCntrlrWrapper):
+    def __init__(self, commands_def: List[CommandDefinition], kb_controller: KBCntrlrWrapper,
+            settings: Optional[CommandSettings] = None):
         """Init
 
         Args:
             commands_def: the commands definition, loaded from file or elsewhere
+            settings: the 'settings' section of the commands file, see 
+                split_commands_file()
         """
+        if settings is None:
+            settings = {}
 
         # the mapping
         # dictionary mapping command name to command executor
@@ -739,7 +916,7 @@ class CommandRegistry: # pylint: disable=function-redefined
         # have to store this so it can be passed to all underlying commands
         self.kb_controller = kb_controller
 
-        # tree of nested dicts encoding a lookup table for command name tokens, like:
+        # trie of command name tokens, of any depth, like:
         # first word      second word      third word
         # do          ->  my           ->  homework
         #                              ->  chores
@@ -747,29 +924,35 @@ class CommandRegistry: # pylint: disable=function-redefined
         # watch       ->  tv           ->  (none)
         #             ->  netflix      ->  tonight
         #
-        # note this tree is kinda memory heavy, but whatevs. We only need one, and lookup is fast for Dicts
-        # real life test: for 42 commands this took up 2272 bytes
-        self._cmd_token_tree = {}
+        # see CommandTrie for how it's kept compact
+        self._cmd_trie = CommandTrie()
 
-        self.update_commands(commands_def)
+        # for resolving misheard command names, None if disabled
+        self._fuzzy_index: Optional[FuzzyCommandIndex] = None
 
-    def update_commands(self, commands_def: List[CommandDefinition]):
-        """Update the commands in the internal registry
+        self._load_commands(commands_def)
+        self._build_fuzzy_index(settings.get('fuzzy_match') or {})
+
+    def _load_commands(self, commands_def: List[CommandDefinition]):
+        """Load the commands into the internal registry
 
         Args:
             commands_def: the commands definition, loaded from file or elsewhere
         """
-        # clear all these first
-        self.commands = {}
-
         for icommand, command_def in enumerate(commands_def):
             kwargs = command_def['kwargs']
             all_names = [command_def['name']] + command_def.get('aliases', [])
             for name in all_names:
                 logger.debug('(%d) Loading command: %s', icommand, name)
-                self.commands[name] = \
-                    self.command_types[command_def['command_type']](
-                        self, kb_controller=self.kb_controller, **kwargs)
+                try:
+                    executor = self.command_types[command_def['command_type']](
+                            self, kb_controller=self.kb_controller, **kwargs)
+                except ValueError as e:
+                    raise ValueError(f'Bad definition for command "{name}": '
+                        f'{e}') from e
+                if 'settle_time' in command_def:
+                    executor.settle_time = float(command_def['settle_time'])
+                self.commands[name] = executor
 
         self._build_cmd_token_tree()
 
@@ -787,32 +970,37 @@ class CommandRegistry: # pylint: disable=function-redefined
         """
 
         # reset it
-        self._cmd_token_tree = {}
+        self._cmd_trie = CommandTrie()
 
         for cmd_name in self.cmd_names:
-            words = cmd_name.split()
-            first_word = words[0]
+            first_word = cmd_name.split()[0]
             # command names should have no conflicts with command multiplier tokens
             cmd_name_invalid = CommandMultiplierParser.check_valid_multiplier_token(first_word)
             if cmd_name_invalid:
                 raise ValueError(f'Token "{first_word}" is not a valid beginning of a command name. It could be interpreted as a command multiplier')
 
-            # todo: add support for more than 3 levels?
-            current_level = self._cmd_token_tree
-            current_level.setdefault(words[0], {})
-            current_level = self._cmd_token_tree[words[0]]
-            if len(words) > 1:
-                current_level.setdefault(words[1], {})
-                current_level = current_level[words[1]]
-            if len(words) > 2:
-                # IT ENDS HERE!
-                current_level.setdefault(words[2], {})
-            if len(words) > 3:
-                raise NotImplementedError
+            self._cmd_trie.add(cmd_name)
+
+    def _build_fuzzy_index(self, fuzzy_settings: Dict[str, Any]):
+        """Build the index for resolving misheard command names
+
+        Args:
+            fuzzy_settings: the 'fuzzy_match' settings from the commands file.
+                'enabled' (default True), and optionally 'max_distance' and
+                'min_confidence', see FuzzyCommandIndex
+        """
+        if not fuzzy_settings.get('enabled', True):
+            self._fuzzy_index = None
+            return
+        index_kwargs = {key: fuzzy_settings[key] 
+            for key in ['max_distance', 'min_confidence'] 
+            if key in fuzzy_settings}
+        self._fuzzy_index = FuzzyCommandIndex(self.cmd_names, **index_kwargs)
 
     def cmd_name_next_tokens(self, tokens_so_far: List[str]) -> List[str]:
         """Get the available tokens in the next slot for a command name
 
+        Meant for introspection, not parsing. See longest_match() for that.
 
         Args:
             tokens_so_far: list of tokens that have been parsed from the
@@ -820,22 +1008,70 @@ class CommandRegistry: # pylint: disable=function-redefined
                 homework", then ['do'] would return ['my'] (and
                 additional tokens, if other commands start with 'do')
 
+        Raises:
+            ValueError: if no command name starts with tokens_so_far
+
         Returns:
-            list of next available words for valid command names
-        """
-
-        current_level = self._cmd_token_tree
-        next_tokens = current_level.keys()
-        for token in tokens_so_far:
-            try:
-                current_level = current_level[token]
-                next_tokens = current_level.keys()
-            except KeyError:
-                #pylint: disable=raise-missing-from
-                raise ValueError(
-                    f'No command found with tokens {tokens_so_far}')
-                #pylint: enable=raise-missing-from
-        return list(next_tokens)
+            list of next available words for valid command names. Empty if
+                tokens_so_far is a whole command name that nothing follows
+        """
+        if self._cmd_trie.node_at(tokens_so_far) is None:
+            raise ValueError(
+                f'No command found with tokens {tokens_so_far}')
+        return self._cmd_trie.next_tokens(tokens_so_far)
+
+    def longest_match(self, tokens: List[str],
+            start: int = 0) -> Tuple[Optional[str], int]:
+        """Find the longest command name at the start of a list of tokens
+
+        Args:
+            tokens: the tokens, e.g. ['page', 'down', 'please']
+            start: index of the token to start at
+
+        Returns:
+            Tuple of the command name (None if there's no match) and the 
+                number of tokens in it
+        """
+        return self._cmd_trie.longest_match(tokens, start)
+
+    def fuzzy_match(self, tokens: List[str],
+            start: int = 0) -> Tuple[Optional[str], int]:
+        """Find a command name that the start of a list of tokens was likely meant to be
+
+        For when longest_match() comes up empty. Tries the longest spans of
+        tokens first.
+
+        Args:
+            tokens: see longest_match()
+            start: see longest_match()
+
+        Returns:
+            see longest_match()
+        """
+        if self._fuzzy_index is None:
+            return None, 0
+
+        max_span = min(self._cmd_trie.max_depth, len(tokens) - start)
+        for span in range(max_span, 0, -1):
+            phrase = ' '.join(tokens[start:start + span])
+            match = self._fuzzy_index.lookup(phrase)
+            if match is not None:
+                cmd_name, confidence = match
+                logger.info("Fuzzy matched '%s' to command '%s' (confidence %.2f)",
+                    phrase, cmd_name, confidence)
+                return cmd_name, span
+        return None, 0
+
+    def get_settle_time(self, cmd_name: str) -> float:
+        """Get the settle time for a given command name
+
+        Args:
+            cmd_name: the name of the command
+
+        Returns:
+            the settle time, in seconds. See CommandExecutor.settle_time
+        """
+        return self.commands[cmd_name].settle_time
 
     def get_command_executor(self, cmd_name: str) -> CommandExecutor:
         """Get the executor instance for a given command name
@@ -846,9 +1082,9 @@ class CommandRegistry: # pylint: disable=function-redefined
         Returns:
             executor instance
         """
-        # make a deep copy before returning, because each CommandExecutor keeps
-        # track of a single instance of executing a command
-        return self.commands[cmd_name].safe_deepcopy()
+        # executors are shared templates, anything specific to one execution
+        # goes on the CommandInvocation it returns
+        return self.commands[cmd_name]
 
 class CommandDispatcher:
     """Handles the execution of all single commands
@@ -866,6 +1102,31 @@ class CommandDispatcher:
         self.cmd_reg = cmd_reg
         self.action_history = action_history
 
+    def resolve(self, raw_command_text: str) -> Tuple[ResolvedCommand, ...]:
+        """Parse a given raw command text into fully resolved commands
+
+        Args:
+            raw_command_text: the raw string command text, as output by the
+                speech-to-text engine
+
+        Returns:
+            the resolved commands, in order
+        """
+        tracer.debug('resolve', raw_command_text)
+
+        # if there are multiple commands, we should split them out
+        commands = raw_command_text.split(MULTIPLE_COMMAND_DELIMITER)
+
+        resolved = []
+        for icommand, command in enumerate(commands):
+            cmd_name, cmd_mult, cmd_args = self.parse(command)
+
+            tracer.debug('resolved', icommand, command, cmd_name)
+
+            resolved.append(ResolvedCommand(cmd_name, cmd_mult, cmd_args))
+
+        return tuple(resolved)
+
     def dispatch(self, raw_command_text: str,
             cmd_execution_state: Dict[str, Any]) -> List[Action]:
         """Dispatch a given raw command text for execution
@@ -879,36 +1140,41 @@ class CommandDispatcher:
         Returns:
             the actions taken
         """
+        return self.dispatch_resolved(self.resolve(raw_command_text),
+            cmd_execution_state)
 
-        logger.debug("Raw command: '{}'".format(raw_command_text))
+    def dispatch_resolved(self, commands: Tuple[ResolvedCommand, ...],
+            cmd_execution_state: Dict[str, Any]) -> List[Action]:
+        """Dispatch already resolved commands for execution
 
-        # if there are multiple commands, we should split them out
-        commands = raw_command_text.split(MULTIPLE_COMMAND_DELIMITER)
+        Args:
+            commands: the commands, see resolve()
+            cmd_execution_state: dictionary of bespoke state to pass to
+                command executors
+
+        Returns:
+            the actions taken
+        """
 
         # the actions taken by the commands
         actions = []
 
-        for icommand, command in enumerate(commands):
-            cmd_name, cmd_mult, cmd_args = self.parse(command)
+        for command in commands:
+            tracer.info('dispatch', command.name, command.multiplier,
+                cmd_execution_state['embedded_command'])
 
-            logger.debug("  Raw command {}: '{}'".format(icommand, command))
-            logger.debug("  Command name: '{}'".format(cmd_name))
-            logger.debug("  embedded_command: {}".format(cmd_execution_state['embedded_command']))
+            executor = self.cmd_reg.get_command_executor(command.name)
 
-            executor = self.cmd_reg.get_command_executor(cmd_name)
-
-            # execute cmd_mult times
-            for _ in range(cmd_mult):
-                executor.execute(self.action_history,
-                    cmd_execution_state=cmd_execution_state,
-                    stt_args=cmd_args
-                    )
-                # here, the executor IS the action
-                actions.append(executor)
+            # execute cmd_mult times, as one action
+            actions.append(executor.execute_repeated(command.multiplier,
+                self.action_history,
+                cmd_execution_state=cmd_execution_state,
+                stt_args=command.args
+                ))
 
         return actions
 
-    def parse(self, command_text: str) -> Tuple[str, int, str]: #pylint: disable=too-many-branches
+    def parse(self, command_text: str) -> Tuple[str, int, str]:
         """Parse a command text
 
         Rurns a raw command string into arguments for actual execution
@@ -921,72 +1187,44 @@ class CommandDispatcher:
             Tuple the command name, the execution multiplier, and remaining argument text for
                 the command
         """
-        tokens = command_text.split(' ')
+        return self.parse_tokens(command_text.split(' '))
 
-        # extracted command characteristics
-        cmd_name_tokens = []
-        cmd_multiplier = None
-        cmd_args = None
+    def parse_tokens(self, tokens: Sequence[str],
+            start: int = 0) -> Tuple[str, int, Optional[str]]:
+        """Parse a command from already split tokens
+
+        Works in place on the token list: the multiplier and command name are
+        looked up with a single walk down the command trie, with no slicing 
+        or re-joining along the way.
+
+        Args:
+            tokens: the command tokens
+            start: index of the token the command starts at
 
+        Returns:
+            See parse()
+        """
         # first, let's try parsing the command multiplier at the beginning of the string
         # tokens_used tells us how many of the tokens were actually in the command multiplier. If there is no multiplier (implicit 1), then tokens used will be zero
-        cmd_multiplier, tokens_used = CommandMultiplierParser.parse_multiplier_string(' '.join(tokens[:2]))
-
-        tokens = tokens[tokens_used:]
-
-        # state machine for parsing the rest of the command name and the args
-        state = 'command_name_0'
-        itoken = 0
-        while state != 'done' and itoken < len(tokens):
-            token = tokens[itoken]
-            # first word in the command name
-            if state == 'command_name_0':
-                # see if the token is a known first word
-                if token in self.cmd_reg.cmd_name_next_tokens(cmd_name_tokens):
-                    cmd_name_tokens.append(token)
-                    state = 'command_name_1'
-                # there must be at least one expected word for it to be a real
-                # command
-                else:
-                    raise Exception(f"Expected a known command name, found {token}")
-            # second word in the command name (optional)
-            elif state == 'command_name_1':
-                # see if the token is a known second word
-                if token in self.cmd_reg.cmd_name_next_tokens(cmd_name_tokens):
-                    cmd_name_tokens.append(token)
-                    state = 'command_name_2'
-                # if there is no second word, we're in the command args now
-                else:
-                    state = 'args'
-                    # go back a token because we're actually at the args
-                    itoken -= 1
-            # third word in the command name (optional)
-            elif state == 'command_name_2':
-                # see if the token is a known third word
-                if token in self.cmd_reg.cmd_name_next_tokens(cmd_name_tokens):
-                    cmd_name_tokens.append(token)
-                    state = 'args'
-                # if there is no third word, we're in the command args
-                else:
-                    state = 'args'
-                    # go back a token because we're actually at the args now
-                    itoken -= 1
-            # args. there can be an arbitrary number
-            elif state == 'args':
-                if cmd_args is None:
-                    cmd_args = []
-                cmd_args.append(token)
-                state = 'args'
-
-            itoken += 1
-
-        # it should be a known command
-        cmd_name = ' '.join(cmd_name_tokens)
-        assert cmd_name in self.cmd_reg.cmd_names
-
-        if cmd_args:
+        cmd_multiplier, tokens_used = \
+            CommandMultiplierParser.parse_multiplier_tokens(tokens, start)
+        start += tokens_used
+
+        # the command name is the longest known name at the start of what's 
+        # left, and everything after it is args
+        cmd_name, name_len = self.cmd_reg.longest_match(tokens, start)
+        # maybe it was misheard
+        if cmd_name is None:
+            cmd_name, name_len = self.cmd_reg.fuzzy_match(tokens, start)
+        if cmd_name is None:
+            found = tokens[start] if start < len(tokens) else ''
+            raise Exception(f"Expected a known command name, found {found}")
+
+        args_start = start + name_len
+        cmd_args = None
+        if args_start < len(tokens):
             # join together the tokens and output as a full string
-            cmd_args = ' '.join(cmd_args)
+            cmd_args = ' '.join(tokens[args_start:])
 
         return cmd_name, cmd_multiplier, cmd_args
 
@@ -9,16 +9,20 @@ from queue import Queue, Empty
 import sys
 import time
 import traceback
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
-from backend.commands import CommandDispatcher, CommandRegistry
+from backend.commands import (CommandDispatcher, CommandRegistry,
+    split_commands_file)
 from backend.manager import app_mngr, event_mngr
 from backend.text import TextWriter
+from backend.trace import get_tracer
 from backend.actions import Action, ActionHistory
+from backend.plan import (CommandSegment, PlanCache, TextSegment,
+    UtterancePlan, normalize_utterance)
 from ui.kb_controller import KBCntrlrWrapper, KBCntrlrWrapperManager
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+tracer = get_tracer('executor')
 
 
 STOP_SUBSTRING = 'stop stop'
@@ -40,13 +44,25 @@ class Executor:
         # the history of actions taken
         self.history = ActionHistory() 
         
-        # lock to prevent updating the command registry in the middle of parsing
-        self._cmd_reg_lock = threading.Lock()
+        # compiled plans for utterances we've seen before. Plans hold
+        # resolved commands, so this has to be cleared whenever the 
+        # command registry changes
+        self._plan_cache = PlanCache()
 
         # these get created in setup()
+        # the command dispatcher, bound to the current command registry
+        # snapshot. Registries are never changed once published: reloading
+        # builds a new one off to the side, and swaps in a new dispatcher 
+        # with a single assignment. Each utterance holds on to the dispatcher
+        # it was compiled with (see UtterancePlan), so there's no locking 
+        # between reloading and parsing / executing.
         self.cmd_exec: CommandDispatcher = None
-        self.cmd_reg: CommandRegistry = None
         self.text_writer: TextWriter = None
+        self._kb_controller: KBCntrlrWrapper = None
+
+        # bumped on every abort (see abort()), so that plans prepared before
+        # it know to stop. Only the parse stage writes it
+        self.abort_generation = 0
 
         # a small sanity check that we do the set up step before any other stuff
         self._setup_done = False
@@ -66,14 +82,9 @@ class Executor:
             raise Exception('setup() should only be called once')
 
         kb_controller = kb_cntrl_mngr.get_kb_cntrl_wrapper()
+        self._kb_controller = kb_controller
 
-        with open(self.commands_file, 'r') as f:
-            commands_def = yaml.load(f, Loader=yaml.FullLoader)
-        self.cmd_reg = CommandRegistry(commands_def, kb_controller)
-
-        # make a command dispatcher.need to pass history to it because
-        # there are commands that do stuff with that history
-        self.cmd_exec = CommandDispatcher(self.cmd_reg, self.history)
+        self.cmd_exec = self._load_commands()
 
         # create the text writer
         self.text_writer = TextWriter(kb_controller)
@@ -81,41 +92,171 @@ class Executor:
         self._setup_done = True
 
 
+    @property
+    def cmd_reg(self) -> CommandRegistry:
+        """The current command registry snapshot
+        """
+        return self.cmd_exec.cmd_reg
+
+    def _load_commands(self) -> CommandDispatcher:
+        """Build a fresh command registry from the commands file
+
+        Returns:
+            a command dispatcher bound to the new registry
+        """
+        with open(self.commands_file, 'r') as f:
+            commands_def, settings = split_commands_file(
+                yaml.load(f, Loader=yaml.FullLoader))
+        cmd_reg = CommandRegistry(commands_def, self._kb_controller, settings)
+
+        # make a command dispatcher.need to pass history to it because
+        # there are commands that do stuff with that history
+        return CommandDispatcher(cmd_reg, self.history)
+
     def reload_commands(self):
         """Reload/update the commands in the command registry
+
+        The new registry is built without touching the current one, so 
+        dictation carries on while this runs, and a broken commands file 
+        leaves the current commands in place.
         """
         logger.info('Loading commands from file: %s', self.commands_file)
         try:
-            with open(self.commands_file, 'r') as f:
-                commands_def = yaml.load(f, Loader=yaml.FullLoader)
-            self._cmd_reg_lock.acquire()
-            self.cmd_reg.update_commands(commands_def)
-        except yaml.scanner.ScannerError:
-            logger.error('Error loading %s', self.commands_file)
-        finally:
-            self._cmd_reg_lock.release()
+            cmd_exec = self._load_commands()
+        except Exception: # pylint: disable=broad-except
+            logger.exception('Error loading %s', self.commands_file)
+            return
+
+        # publish the new snapshot. Plans compiled against the old one may
+        # still be in flight, and they'll finish with the old one
+        self.cmd_exec = cmd_exec
+        self._plan_cache.clear()
+
+    def _settle_after_command(self, settle_time: float):
+        """Wait until a dispatched command has taken effect
+
+        Blocks until the keyboard controller has actually injected the
+        command's keystrokes, then sleeps for the command's settle time (see 
+        'settle_time' in commands.yml), for things like window switching that
+        need the app to catch up.
 
-    def parse_and_execute(self, raw_utterance: str):
-        """Parse and take action upon the raw text output from an utterance
-        
         Args:
-            raw_utterance: the text directly out of the speech-to-text engine
+            settle_time: extra time to wait after injection, in seconds
         """
-        if not self._setup_done:
-            raise Exception('Need to call setup() first')
+        self._kb_controller.barrier()
+        if settle_time > 0:
+            tracer.debug('settle', settle_time)
+            time.sleep(settle_time)
 
-        text = raw_utterance
-        text = text.lower()
-        text = text.strip()
+    def compile_utterance(self, text: str) -> UtterancePlan:
+        """Compile a normalized utterance into a plan for execution
 
-        if STOP_SUBSTRING in text:
-            logger.info("Saw stop substring, not doing anything")
-            return
+        Splits the utterance on ESCAPE_WORD into text and command segments, 
+        and resolves all the commands against the current command registry
+        snapshot, which the plan then holds on to.
 
-        words = text.split()
-        first_word = words[0]
-        
-        self._cmd_reg_lock.acquire()
+        Args:
+            text: the normalized utterance, see normalize_utterance()
+
+        Returns:
+            the plan
+        """
+        # pin the snapshot, in case it gets swapped out while we're at it
+        cmd_exec = self.cmd_exec
+
+        segments = []
+        command_words = []
+        # text that we'll format and print out as straight speech to text
+        raw_text_words = []
+        in_command = False
+        for word in text.split():
+            # we are either building up raw text or command words
+            if word != self.ESCAPE_WORD:
+                if in_command:
+                    command_words.append(word)
+                else:
+                    raw_text_words.append(word)
+            else:
+                # end of command
+                if in_command:
+                    segments.append(
+                        self._compile_command(cmd_exec, command_words))
+                    command_words = []
+                # we're starting a command, so need to print out the raw text
+                elif len(raw_text_words) > 0:
+                    segments.append(TextSegment(' '.join(raw_text_words)))
+                    raw_text_words = []
+                in_command = not in_command
+
+        # handle the end
+        if in_command:
+            segments.append(self._compile_command(cmd_exec, command_words))
+        else:
+            segments.append(TextSegment(' '.join(raw_text_words)))
+
+        return UtterancePlan(text, tuple(segments), cmd_exec)
+
+    @staticmethod
+    def _compile_command(cmd_exec: CommandDispatcher,
+            command_words: List[str]) -> CommandSegment:
+        """Compile the words between escape words into a command segment
+
+        Args:
+            cmd_exec: the command dispatcher to resolve commands with
+            command_words: the command words
+
+        Returns:
+            the command segment
+        """
+        commands = cmd_exec.resolve(' '.join(command_words))
+        settle_time = max(
+            [cmd_exec.cmd_reg.get_settle_time(command.name) 
+                for command in commands],
+            default=0.0)
+        return CommandSegment(commands, settle_time)
+
+    def get_plan(self, text: str) -> UtterancePlan:
+        """Get the plan for a normalized utterance, compiling it if it isn't cached
+
+        Args:
+            text: the normalized utterance, see normalize_utterance()
+
+        Returns:
+            the plan
+        """
+        plan = self._plan_cache.get(text)
+        # a plan compiled against an older registry can sneak into the cache 
+        # if it raced with a reload
+        if plan is None or plan.cmd_exec is not self.cmd_exec:
+            plan = self.compile_utterance(text)
+            self._plan_cache.put(plan)
+        return plan
+
+    def execute_plan(self, plan: UtterancePlan,
+            abort_generation: Optional[int] = None):
+        """Take action on a compiled utterance plan
+
+        This is where text gets formatted and typed, and commands executed.
+        Note that formatting happens here rather than at compile time,
+        because the formatter depends on what the user did (clicks, key
+        presses) since the last text was typed out.
+
+        If there's an abort (see abort()) while the plan is being carried
+        out, or since it was prepared, the rest of it is dropped. Nothing of
+        it goes into the action history then: the abort threw away whatever
+        of it was still waiting to be typed, so there's no telling what 
+        undoing it would have to remove.
+
+        Args:
+            plan: the plan, see prepare()
+            abort_generation: abort_generation when the plan was prepared. 
+                Defaults to the current one
+        """
+        if not self._setup_done:
+            raise Exception('Need to call setup() first')
+
+        if abort_generation is None:
+            abort_generation = self.abort_generation
 
         # the actions for this utterance
         actions: List[Action] = []
@@ -124,81 +265,165 @@ class Executor:
         # pretty bespoke, but *shrug*
         cmd_execution_state: Dict[str, Any] = {
             # command is executed after pure dictation text writing
-            "embedded_command": False
+            "embedded_command": False,
+            # whether text typed by commands can be undone a word at a time
+            "undo_word_jumps": self.text_writer.pacing_profile.word_jumps,
         }
 
-        try:
-            # if the utterance starts with the ISLAND_COMMAND_WORD, it's an
-            # "island", or stand-alone command. Dispatch that for execution
-            # immediately
-            # if first_word == self.ISLAND_COMMAND_WORD:
-            #     logger.info("Executor: island command")
-            #     self.cmd_exec.dispatch(' '.join(words[1:]))
-
-            # not an island, there's mixed stt and (potentially) commands
-            if True:
-                idispatch = 0
-                command_words = []
-                # text that we'll format and print out as straight speech to text
-                raw_text_words = []
-                in_command = False
-                # did we see ESCAPE_WORD on the last iteration?
-                # last_iter_was_escape = False
-                for word in words:
-                    # we are either building up raw text or command words
-                    if word != self.ESCAPE_WORD:
-                        if in_command:
-                            command_words.append(word)
-                        else:
-                            raw_text_words.append(word)
-                    else:
-                        # end of command, need to execute it
-                        if in_command:
-                            logger.info("Executor: dispatch command ({})".format(idispatch))
-                            actions += self.cmd_exec.dispatch(
-                                ' '.join(command_words), cmd_execution_state)
-                            # need to have a wait in here, or hot keys from a command can get confused with text to be typed afterwards
-                            sleep_time = 0.5
-                            logger.info("Executor: sleeping for %f", sleep_time)
-                            time.sleep(sleep_time)
-                            command_words = []
-                            idispatch += 1
-                        # we're starting a command, so need to print out the raw text
-                        elif len(raw_text_words) > 0:
-                            logger.info("Executor: dispatch text ({})".format(idispatch))
-                            actions.append(self.text_writer.dispatch(
-                                ' '.join(raw_text_words)))
-                            cmd_execution_state['embedded_command'] = True
-                            raw_text_words = []
-                            idispatch += 1
-                        in_command = not in_command
-
-                # handle the end
-                if in_command:
-                    logger.info("Executor: dispatch command ({})".format(idispatch))
-                    actions += self.cmd_exec.dispatch(
-                        ' '.join(command_words), cmd_execution_state)
-                else:
-                    logger.info("Executor: dispatch text ({})".format(idispatch))
-                    actions.append(self.text_writer.dispatch(
-                        ' '.join(raw_text_words)))
+        last_isegment = len(plan.segments) - 1
+        for isegment, segment in enumerate(plan.segments):
+            if self.abort_generation != abort_generation:
+                tracer.info('aborted', isegment)
+                return
+            if isinstance(segment, CommandSegment):
+                tracer.info('command_segment', isegment)
+                # use the snapshot the plan was compiled against
+                actions += plan.cmd_exec.dispatch_resolved(
+                    segment.commands, cmd_execution_state)
+                # need to have a wait in here, or hot keys from a command can
+                # get confused with text to be typed afterwards
+                if isegment < last_isegment:
+                    self._settle_after_command(segment.settle_time)
+            else:
+                tracer.info('text_segment', isegment)
+                actions.append(self.text_writer.dispatch(segment.text))
+                # text in the middle of an utterance is always followed by 
+                # a command
+                if isegment < last_isegment:
+                    cmd_execution_state['embedded_command'] = True
+
+        self.history.add_utterance_actions(actions)
+
+    def prepare(self, raw_utterance: str) -> Optional[UtterancePlan]:
+        """Parse the raw text output from an utterance into a plan
+        
+        Args:
+            raw_utterance: the text directly out of the speech-to-text engine
 
-            self.history.add_utterance_actions(actions)
+        Returns:
+            the plan, or None if there's nothing to be done for the utterance
+        """
+        if not self._setup_done:
+            raise Exception('Need to call setup() first')
+
+        text = normalize_utterance(raw_utterance)
+
+        if STOP_SUBSTRING in text:
+            logger.info("Saw stop substring, stopping any typing")
+            self.abort()
+            return None
+
+        return self.get_plan(text)
 
-        # No except here, so any exceptions pass up the stack 
+    def abort(self):
+        """Stop typing, and throw away everything queued up to be typed
 
-        finally:
-            self._cmd_reg_lock.release()
+        Including the rest of any plan being carried out, see execute_plan()
+        """
+        self.abort_generation += 1
+        self._kb_controller.abort()
+
+    def parse_and_execute(self, raw_utterance: str):
+        """Parse and take action upon the raw text output from an utterance
+        
+        Args:
+            raw_utterance: the text directly out of the speech-to-text engine
+        """
+        plan = self.prepare(raw_utterance)
+        if plan is not None:
+            self.execute_plan(plan)
         
 executor_inst = Executor()
 
+# max number of utterances that can be waiting between pipeline stages
+PIPELINE_QUEUE_SIZE = 8
+
+# passed down the pipeline to tell each stage to finish up
+_PIPELINE_DONE = None
+
+def _print_exception():
+    """Print the exception currently being handled, without dying
+    """
+    exc_type, exc_value, exc_traceback = sys.exc_info()
+    traceback.print_exception(exc_type, exc_value, exc_traceback)
+
+def _do_parse_stage(parse_q: Queue, emit_q: Queue):
+    """ Pipeline stage thread that parses raw utterances into plans
+
+    Args:
+        parse_q: raw utterances from the ingest stage
+        emit_q: plans along with the abort generation they were prepared 
+            in, for the emit stage
+    """
+    while True:
+        raw_utterance = parse_q.get()
+        if raw_utterance is _PIPELINE_DONE:
+            emit_q.put(_PIPELINE_DONE)
+            break
+
+        try:
+            plan = executor_inst.prepare(raw_utterance)
+        except Exception: # pylint: disable=broad-except
+            _print_exception()
+            continue
+
+        if plan is not None:
+            # along with when it was prepared, in case of an abort before
+            # the emit stage gets to it
+            emit_q.put((plan, executor_inst.abort_generation))
+        else:
+            # stopped: whatever hasn't been typed yet shouldn't be
+            _discard_pending_plans(emit_q)
+
+def _discard_pending_plans(emit_q: Queue):
+    """Throw away the plans waiting for the emit stage
+
+    Args:
+        emit_q: plans from the parse stage. Only the parse stage puts on it,
+            so this can't throw away _PIPELINE_DONE
+    """
+    while True:
+        try:
+            emit_q.get_nowait()
+        except Empty:
+            return
+
+def _do_emit_stage(emit_q: Queue):
+    """ Pipeline stage thread that formats and types out plans, in order
+
+    Args:
+        emit_q: (plan, abort generation) from the parse stage
+    """
+    while True:
+        item = emit_q.get()
+        if item is _PIPELINE_DONE:
+            break
+
+        try:
+            executor_inst.execute_plan(*item)
+        except Exception: # pylint: disable=broad-except
+            _print_exception()
+
 def do_executor(raw_stt_output_q: Queue):
     """ Execution thread for parsing and acting output from inference
+
+    Runs the executor as a pipeline, so that later utterances get parsed
+    while earlier ones are still being typed out:
+        ingest (this thread) -> parse -> emit
+    Each stage is a single thread, and the queues between them are bounded 
+    and FIFO, so utterances are always acted on in the order they were said.
     
     Args:
         raw_stt_output_q: contains output string text from the text to speech
             engine.
     """
+    parse_q: Queue = Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    emit_q: Queue = Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    parse_thread = threading.Thread(target=_do_parse_stage,
+        args=(parse_q, emit_q))
+    emit_thread = threading.Thread(target=_do_emit_stage, args=(emit_q,))
+    parse_thread.start()
+    emit_thread.start()
 
     logger.info("Parser thread ready")
     # the main thread loop. Go forever.
@@ -208,20 +433,20 @@ def do_executor(raw_stt_output_q: Queue):
             raw_utterance: str = raw_stt_output_q.get(
                 block=True, timeout=0.1)
 
-            logger.debug("Got: '{}'".format(raw_utterance))
-            
-            try:
-                executor_inst.parse_and_execute(raw_utterance)
-            except Exception as e:
-                exc_type, exc_value, exc_traceback = sys.exc_info()
-                traceback.print_exception(exc_type, exc_value, exc_traceback)
-                # logger.info("Parsing error: {}".format(str(e)))
+            tracer.info('got', raw_utterance)
+
+            parse_q.put(raw_utterance)
             
         # queue was empty up to timeout
         except Empty:
             # check if it's time to close shop
             if app_mngr.quitting: 
                 break
+
+    # let the later stages finish what they have, then shut them down
+    parse_q.put(_PIPELINE_DONE)
+    parse_thread.join()
+    emit_thread.join()
             
 # if __name__ == "__main__":
 #     import time
@@ -0,0 +1,194 @@
+"""Replacing a table of fixed text patterns, without a str.replace() each
+
+The patterns in replace_patterns.yml get applied in order: the result has to
+be the same as running the_text.replace(orig, replace) for every entry, one
+after the other, so that the first listed pattern wins when two overlap, and
+a replacement can make text that a later pattern then matches.
+
+Most utterances contain hardly any of the patterns, though, so instead:
+- at load, all the patterns get compiled into an Aho-Corasick automaton, and
+  for each pattern, we work out which later patterns its replacement text
+  could possibly create (see _may_create)
+- per utterance, one left-to-right scan through the automaton finds every
+  pattern that's in the text
+- then just those get replaced, in table order. Whenever a replacement
+  changes the text, the later patterns it could have created get checked too
+"""
+
+import heapq
+from typing import Dict, List, Set, Tuple
+
+
+def _split_replacement(orig: str, replacement: str) -> Tuple[str, str, str]:
+    """Split a replacement into what's the same as in orig, and what changed
+
+    e.g. ' i ' -> ' I ' only really changes the 'i' to an 'I', with a space
+    either side of it that was there already.
+
+    Args:
+        orig: the pattern being replaced
+        replacement: what it's being replaced with
+
+    Returns:
+        the start of the replacement that's the same as the start of orig,
+        the changed part, and the end that's the same as the end of orig
+    """
+    start = 0
+    while start < min(len(orig), len(replacement)) and \
+            orig[start] == replacement[start]:
+        start += 1
+    end = 0
+    while end < min(len(orig), len(replacement)) - start and \
+            orig[-end - 1] == replacement[-end - 1]:
+        end += 1
+    return (replacement[:start], replacement[start:len(replacement) - end],
+        replacement[len(replacement) - end:])
+
+
+def _may_create(orig: str, replacement: str, pattern: str) -> bool:
+    """Whether replacing orig with replacement could create pattern
+
+    i.e. whether there's text where pattern isn't found before the
+    replacement, but is after. Anything found that doesn't overlap the
+    changed part of the replacement was there before, so the pattern has to
+    overlap that. Or if nothing changed, just some text got taken out, it has
+    to straddle the spot where it was taken out.
+
+    Args:
+        orig: the pattern being replaced
+        replacement: what it's being replaced with
+        pattern: the pattern that might get created
+
+    Returns:
+        False if it definitely can't
+    """
+    before, changed, after = _split_replacement(orig, replacement)
+    if not changed:
+        # the pattern's split across the join, and each side has to fit
+        # with the text we know is there
+        for length in range(1, len(pattern)):
+            left, right = pattern[:length], pattern[length:]
+            if (left.endswith(before) or before.endswith(left)) and \
+                    (right.startswith(after) or after.startswith(right)):
+                return True
+        return False
+    if changed in pattern or pattern in changed:
+        return True
+    # the pattern starts before the changed part and ends inside it, or
+    # starts inside it and ends after
+    for length in range(1, min(len(pattern), len(changed))):
+        if pattern.endswith(changed[:length]) or \
+                pattern.startswith(changed[-length:]):
+            return True
+    return False
+
+
+class FixedPatternReplacer:
+    """Replaces fixed text patterns, as if one after the other, in table order
+
+    Args:
+        patterns: pattern to replace -> what to replace it with, in the order
+            they should be applied
+    """
+
+    def __init__(self, patterns: Dict[str, str]):
+        self._patterns: List[Tuple[str, str]] = list(patterns.items())
+        for orig, _ in self._patterns:
+            if not orig:
+                raise ValueError('Fixed patterns can\'t be empty')
+
+        # the automaton: for each state, next state for each char (anything
+        # not in there goes back to the start), and which patterns end there
+        self._transitions: List[Dict[str, int]] = []
+        self._matches: List[Tuple[int, ...]] = []
+        self._build_automaton()
+
+        # for each pattern, the later patterns its replacement could create
+        self._triggers: List[Tuple[int, ...]] = [
+            tuple(later for later in range(index + 1, len(self._patterns))
+                if _may_create(orig, replace, self._patterns[later][0]))
+            for index, (orig, replace) in enumerate(self._patterns)]
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def _build_automaton(self):
+        """Build the Aho-Corasick automaton for all the patterns
+
+        Builds the trie, then fills in the fallbacks breadth first, so each
+        state ends up with a full transition table and never needs to follow
+        failure links while scanning.
+        """
+        children: List[Dict[str, int]] = [{}]
+        matches: List[List[int]] = [[]]
+        for index, (orig, _) in enumerate(self._patterns):
+            state = 0
+            for char in orig:
+                if char not in children[state]:
+                    children[state][char] = len(children)
+                    children.append({})
+                    matches.append([])
+                state = children[state][char]
+            matches[state].append(index)
+
+        transitions: List[Dict[str, int]] = [{}] * len(children)
+        transitions[0] = dict(children[0])
+        # (state, the state its longest proper suffix gets to)
+        to_visit = [(child, 0) for child in children[0].values()]
+        while to_visit:
+            next_to_visit = []
+            for state, fallback in to_visit:
+                matches[state].extend(matches[fallback])
+                transitions[state] = {**transitions[fallback],
+                    **children[state]}
+                for char, child in children[state].items():
+                    next_to_visit.append(
+                        (child, transitions[fallback].get(char, 0)))
+            to_visit = next_to_visit
+
+        self._transitions = transitions
+        self._matches = [tuple(state_matches) for state_matches in matches]
+
+    def find(self, the_text: str) -> Set[int]:
+        """Find which patterns are in some text, in one scan
+
+        Args:
+            the_text: the text to look in
+
+        Returns:
+            the indices of the patterns found
+        """
+        transitions = self._transitions
+        matches = self._matches
+        found = set()
+        state = 0
+        for char in the_text:
+            state = transitions[state].get(char, 0)
+            if matches[state]:
+                found.update(matches[state])
+        return found
+
+    def replace(self, the_text: str) -> str:
+        """Replace all the patterns in some text
+
+        Args:
+            the_text: the text to replace patterns in
+
+        Returns:
+            the text with the patterns replaced
+        """
+        to_check = list(self.find(the_text))
+        heapq.heapify(to_check)
+        last_checked = -1
+        while to_check:
+            index = heapq.heappop(to_check)
+            if index <= last_checked:
+                continue
+            last_checked = index
+            orig, replace = self._patterns[index]
+            # an earlier replacement may have taken it out again
+            if orig in the_text:
+                the_text = the_text.replace(orig, replace)
+                for later in self._triggers[index]:
+                    heapq.heappush(to_check, later)
+        return the_text
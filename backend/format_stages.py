@@ -0,0 +1,265 @@
+"""Stages of formatting dictated plaintext, run over the utterance's tokens
+
+PlainTextFormatter splits an utterance into tokens once, hands the tokens
+down a chain of stages, then joins them back up once. Each stage is an object
+that takes the tokens and returns new ones, so stages can keep state and can
+be reordered or left out from config (see PLAINTEXT_STAGES, and
+plaintext_format_stages in config.yaml).
+"""
+
+import time
+from typing import Dict, List, Optional
+
+class FormatContext:
+    """What the stages know about the utterance being formatted, besides its
+    tokens
+
+    Stages can change it for the stages after them, and for the formatter
+    """
+    __slots__ = ('capitalize', 'explicit_space_add')
+
+    def __init__(self, capitalize: bool = False):
+        """Init
+
+        Args:
+            capitalize: whether the utterance starts a new sentence
+        """
+        self.capitalize = capitalize
+        # whether to add a leading space no matter what
+        self.explicit_space_add = False
+
+class FormatStage:
+    """A stage of formatting, see module docs
+
+    Subclasses set name, which is how config refers to them, and implement
+    run()
+    """
+    name: str = ''
+
+    def run(self, tokens: List[str], context: FormatContext) -> List[str]:
+        """Run the stage
+
+        Args:
+            tokens: the utterance so far, split on whitespace
+            context: see FormatContext
+
+        Returns:
+            the new tokens. Can be the same list, changed in place
+        """
+        raise NotImplementedError
+
+class ExplicitSpaceStage(FormatStage):
+    """A leading "space bar" means add a space before the text, even if it'd
+    otherwise go without one
+    """
+    name = 'explicit_space'
+
+    def run(self, tokens: List[str], context: FormatContext) -> List[str]:
+        """See superclass docs"""
+        # only if there's something after it
+        if tokens[:2] == ['space', 'bar'] and len(tokens) > 2:
+            tokens = tokens[2:]
+            context.explicit_space_add = True
+        if tokens[:1] == ['spacebar'] and len(tokens) > 1:
+            tokens = tokens[1:]
+            context.explicit_space_add = True
+        return tokens
+
+class AMStage(FormatStage):
+    """Speech to text hears "a m" as "a.m.", so change it back
+
+    very hacky, the hijacking of "a m" as "a.m." bothers me
+    """
+    name = 'a_m'
+
+    def run(self, tokens: List[str], context: FormatContext) -> List[str]:
+        """See superclass docs"""
+        if not any('a.m.' in token for token in tokens):
+            return tokens
+        out_tokens = []
+        for token in tokens:
+            out_tokens.extend(token.replace('a.m.', 'a m').split())
+        return out_tokens
+
+class CompressLettersStage(FormatStage):
+    """Compress repeated single letters into a single token (so that
+    multiple letters can be dictated easily for an acronym)
+
+    e.g. "n a s a" -> "nasa"
+    """
+    name = 'compress_letters'
+
+    def run(self, tokens: List[str], context: FormatContext) -> List[str]:
+        """See superclass docs"""
+        out_tokens = []
+        current_token = ""
+        for token in tokens:
+            if len(token) == 1 and (token.isdigit() or token.isalpha()):
+                # build up token from partials
+                current_token += token
+            else:
+                # if we were previously building up a token from partials,
+                # now we're stopping. We should add it.
+                if len(current_token) > 0:
+                    out_tokens.append(current_token)
+                    current_token = ""
+                out_tokens.append(token)
+        # handle the case where we were building up from partials until
+        # the end of text
+        if len(current_token) > 0:
+            out_tokens.append(current_token)
+        return out_tokens
+
+class CapitalWordsStage(FormatStage):
+    """Handle triggered capitalization
+
+    e.g. "capital bob" -> "Bob", "all caps nasa" -> "NASA"
+    """
+    name = 'capital_words'
+
+    def run(self, tokens: List[str], context: FormatContext) -> List[str]:
+        """See superclass docs"""
+        out_tokens = []
+        next_capitalize = False
+        next_all_caps = False
+        skip_caps = False
+        for itoken, token in enumerate(tokens):
+            if skip_caps:
+                # the rest of "all caps"
+                skip_caps = False
+                continue
+            # note the below are escape words and can't be used regularly
+            if token in ['capital','capitol']:
+                next_capitalize = True
+            elif token == 'allcaps' or (token == 'all' and
+                    tokens[itoken + 1:itoken + 2] == ['caps']):
+                next_all_caps = True
+                skip_caps = token == 'all'
+            elif next_capitalize:
+                out_tokens.append(token.capitalize())
+                next_capitalize = False
+            elif next_all_caps:
+                out_tokens.append(token.upper())
+                next_all_caps = False
+            else:
+                out_tokens.append(token)
+        return out_tokens
+
+class CamelCaseStage(FormatStage):
+    """Handle triggered camel/pascal case
+
+    e.g. "new chimney variable chimney name" -> "newVariableName"
+    """
+    name = 'camel_case'
+
+    def run(self, tokens: List[str], context: FormatContext) -> List[str]:
+        """See superclass docs"""
+        out_tokens = []
+        next_camel = False
+        for token in tokens:
+            # note the below are escape words and can't be used regularly
+            if token in ['chimney', 'jimmy', 'timmy']:
+                next_camel = True
+            elif next_camel:
+                # append capitalized token onto the last token
+                if len(out_tokens) > 0:
+                    out_tokens[-1] += token.capitalize()
+                else:
+                    out_tokens.append(token.capitalize())
+                next_camel = False
+            else:
+                out_tokens.append(token)
+        return out_tokens
+
+class AutoCapitalizeStage(FormatStage):
+    """Capitalize the start of a sentence
+
+    Only if the last utterance ended one, or we're told to (see
+    FormatContext.capitalize). Like str.capitalize() on the whole text, so
+    everything after the first letter ends up lower case.
+    """
+    name = 'auto_capitalize'
+
+    def run(self, tokens: List[str], context: FormatContext) -> List[str]:
+        """See superclass docs"""
+        if not context.capitalize or not tokens:
+            return tokens
+        return [tokens[0].capitalize()] + [token.lower() for token in tokens[1:]]
+
+# all the stages, by name
+PLAINTEXT_STAGES = {stage_cls.name: stage_cls for stage_cls in [
+    ExplicitSpaceStage, AMStage, CompressLettersStage, CapitalWordsStage,
+    CamelCaseStage, AutoCapitalizeStage]}
+
+# the stages PlainTextFormatter runs, in order, unless config says otherwise
+# todo: a stage to capitalize second, third, fourth ... sentences. Should only
+# be on in long-form text mode though, it tramples on dot notation in python
+DEFAULT_PLAINTEXT_STAGES = ['explicit_space', 'a_m', 'compress_letters',
+    'capital_words', 'camel_case', 'auto_capitalize']
+
+def make_stages(stage_names: Optional[List[str]] = None) -> List[FormatStage]:
+    """Make the stages to format with
+
+    Args:
+        stage_names: names of the stages, in the order to run them. If None,
+            DEFAULT_PLAINTEXT_STAGES
+
+    Raises:
+        ValueError: if there's no such stage
+
+    Returns:
+        the stages
+    """
+    if stage_names is None:
+        stage_names = DEFAULT_PLAINTEXT_STAGES
+    stages = []
+    for stage_name in stage_names:
+        if stage_name not in PLAINTEXT_STAGES:
+            raise ValueError(f'Unknown format stage "{stage_name}", should be '
+                f'one of {list(PLAINTEXT_STAGES)}')
+        stages.append(PLAINTEXT_STAGES[stage_name]())
+    return stages
+
+class StageTimings:
+    """How long each stage of formatting takes, over all the utterances
+    """
+
+    def __init__(self):
+        # stage name -> [number of runs, total time, max time], in seconds
+        self._timings: Dict[str, List[float]] = {}
+
+    def record(self, name: str, start: float) -> float:
+        """Record a run of a stage that just finished
+
+        Args:
+            name: the stage's name
+            start: time.perf_counter() when it started
+
+        Returns:
+            time.perf_counter() now, to start timing the next stage from
+        """
+        now = time.perf_counter()
+        elapsed = now - start
+        timing = self._timings.get(name)
+        if timing is None:
+            self._timings[name] = [1, elapsed, elapsed]
+        else:
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+        return now
+
+    def stats(self) -> Dict[str, dict]:
+        """The timings so far
+
+        Returns:
+            for each stage name, number of runs ('runs'), and total and max
+                time in seconds ('total_s', 'max_s')
+        """
+        return {name: {'runs': int(runs), 'total_s': total_s, 'max_s': max_s}
+            for name, (runs, total_s, max_s) in self._timings.items()}
+
+    def reset(self):
+        """Start again from nothing
+        """
+        self._timings.clear()
@@ -0,0 +1,251 @@
+"""Fuzzy lookup of command names, for when speech to text mishears them
+
+e.g. "tabatha" when the command is "tabitha". Built once per command
+registry, from all the command names and aliases, so a lookup is just:
+- an exact lookup by phonetic key (sounds the same, spelled differently)
+- failing that, a BK-tree search for names within a small edit distance,
+  among the names with the same number of words
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+# soundex digit for each consonant. Letters that aren't here (vowels, plus
+# h, w and y) don't get a digit
+_SOUNDEX_CODES = {}
+for _letters, _digit in [('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'),
+        ('l', '4'), ('mn', '5'), ('r', '6')]:
+    for _letter in _letters:
+        _SOUNDEX_CODES[_letter] = _digit
+
+
+def soundex(word: str) -> str:
+    """Soundex code for a single word, e.g. 'tabitha' -> 'T130'
+
+    Words that don't start with a letter (like numbers) are returned as-is
+
+    Args:
+        word: the word
+
+    Returns:
+        the code
+    """
+    if not word or not word[0].isalpha():
+        return word
+    word = word.lower()
+
+    code = [word[0].upper()]
+    last_digit = _SOUNDEX_CODES.get(word[0])
+    for char in word[1:]:
+        digit = _SOUNDEX_CODES.get(char)
+        if digit is not None and digit != last_digit:
+            code.append(digit)
+            if len(code) == 4:
+                break
+        # h and w don't separate letters with the same code, vowels do
+        if char not in 'hw':
+            last_digit = digit
+    return ''.join(code).ljust(4, '0')
+
+
+def phonetic_key(phrase: str) -> str:
+    """Phonetic key for a phrase: the soundex code of each word
+
+    Args:
+        phrase: the phrase, as space separated words
+
+    Returns:
+        the key
+    """
+    return ' '.join(soundex(word) for word in phrase.split())
+
+
+def levenshtein(a: str, b: str) -> int:
+    """Edit distance between two strings
+
+    Args:
+        a: one string
+        b: the other string
+
+    Returns:
+        the minimum number of single character insertions, deletions and
+            substitutions to get from a to b
+    """
+    # Myers' bit-parallel algorithm: one column of the usual dynamic
+    # programming table is kept as bit vectors of +1/-1 vertical deltas
+    # (pos_v, neg_v), one bit per char of a, and updated a whole column at a
+    # time per char of b. Much faster than the table in pure python, since
+    # python ints are arbitrarily wide
+    if not a:
+        return len(b)
+    if not b:
+        return len(a)
+
+    # for each char, the bit mask of where it appears in a
+    char_masks: Dict[str, int] = {}
+    for i, char in enumerate(a):
+        char_masks[char] = char_masks.get(char, 0) | (1 << i)
+
+    all_bits = (1 << len(a)) - 1
+    last_bit = 1 << (len(a) - 1)
+    pos_v = all_bits
+    neg_v = 0
+    distance = len(a)
+    for char in b:
+        eq = char_masks.get(char, 0)
+        x_v = eq | neg_v
+        x_h = ((((eq & pos_v) + pos_v) & all_bits) ^ pos_v) | eq
+        pos_h = neg_v | (~(x_h | pos_v) & all_bits)
+        neg_h = pos_v & x_h
+        if pos_h & last_bit:
+            distance += 1
+        elif neg_h & last_bit:
+            distance -= 1
+        pos_h = ((pos_h << 1) | 1) & all_bits
+        neg_h = (neg_h << 1) & all_bits
+        pos_v = neg_h | (~(x_v | pos_h) & all_bits)
+        neg_v = pos_h & x_v
+    return distance
+
+
+class BKTree:
+    """Burkhard-Keller tree, for finding strings within an edit distance
+
+    Each node keeps its children keyed by their distance to it. By the
+    triangle inequality, a search within distance k of a query only needs to
+    descend into children whose key is within k of the node's own distance
+    to the query.
+    """
+
+    def __init__(self, words: List[str]):
+        """Init
+
+        Args:
+            words: the strings to put in the tree
+        """
+        # node: (word, {distance: child node})
+        self._root: Optional[Tuple[str, Dict[int, tuple]]] = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str):
+        """Add a string to the tree
+
+        Args:
+            word: the string
+        """
+        if self._root is None:
+            self._root = (word, {})
+            return
+
+        node = self._root
+        while True:
+            node_word, children = node
+            distance = levenshtein(word, node_word)
+            if distance == 0:
+                return
+            child = children.get(distance)
+            if child is None:
+                children[distance] = (word, {})
+                return
+            node = child
+
+    def search(self, query: str, max_distance: int) -> List[Tuple[int, str]]:
+        """Find all the strings within max_distance of the query
+
+        Args:
+            query: the string to search for
+            max_distance: max edit distance
+
+        Returns:
+            list of (distance, string), closest first
+        """
+        if self._root is None:
+            return []
+
+        found = []
+        to_visit = [self._root]
+        while to_visit:
+            node_word, children = to_visit.pop()
+            distance = levenshtein(query, node_word)
+            if distance <= max_distance:
+                found.append((distance, node_word))
+            for child_distance, child in children.items():
+                if abs(child_distance - distance) <= max_distance:
+                    to_visit.append(child)
+        found.sort()
+        return found
+
+
+class FuzzyCommandIndex:
+    """Index for resolving misheard command names to known ones
+    """
+
+    def __init__(self, names: List[str],
+            max_distance: int = 2,
+            min_confidence: float = 0.75):
+        """Init
+
+        Args:
+            names: all the known command names (including aliases)
+            max_distance: max edit distance between a misheard phrase and a
+                command name
+            min_confidence: min confidence (see confidence()) for a match to
+                be accepted
+        """
+        self.max_distance = max_distance
+        self.min_confidence = min_confidence
+
+        # phonetic key -> names with that key
+        self._by_phonetic_key: Dict[str, List[str]] = {}
+        # number of tokens -> tree of the names with that many tokens. A
+        # misheard word is still one word, so a phrase only gets compared
+        # against names with the same number of tokens. Keeps the trees
+        # small, and stops e.g. "snake foo" matching "snake"
+        names_by_num_tokens: Dict[int, List[str]] = {}
+        for name in names:
+            self._by_phonetic_key.setdefault(phonetic_key(name), []).append(name)
+            names_by_num_tokens.setdefault(len(name.split()), []).append(name)
+        self._bk_trees = {num_tokens: BKTree(names_of_length)
+            for num_tokens, names_of_length in names_by_num_tokens.items()}
+
+    @staticmethod
+    def confidence(phrase: str, name: str, distance: int) -> float:
+        """Confidence that a phrase was meant to be a name
+
+        Args:
+            phrase: the misheard phrase
+            name: the command name
+            distance: edit distance between the two
+
+        Returns:
+            1 for an exact match, down to 0 for nothing in common
+        """
+        return 1.0 - distance / max(len(phrase), len(name))
+
+    def lookup(self, phrase: str) -> Optional[Tuple[str, float]]:
+        """Find the command name a phrase was most likely meant to be
+
+        Args:
+            phrase: the phrase, as space separated tokens
+
+        Returns:
+            Tuple of the command name and the confidence of the match, or
+                None if nothing is close enough
+        """
+        # sounds-alike names first, these are cheap to find
+        candidates = [(levenshtein(phrase, name), name)
+            for name in self._by_phonetic_key.get(phonetic_key(phrase), [])]
+        candidates = [candidate for candidate in candidates
+            if candidate[0] <= self.max_distance]
+        if not candidates:
+            bk_tree = self._bk_trees.get(len(phrase.split()))
+            if bk_tree is not None:
+                candidates = bk_tree.search(phrase, self.max_distance)
+
+        best = None
+        for distance, name in candidates:
+            confidence = self.confidence(phrase, name, distance)
+            if confidence >= self.min_confidence and \
+                    (best is None or confidence > best[1]):
+                best = (name, confidence)
+        return best
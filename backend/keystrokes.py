@@ -71,40 +71,50 @@ def parse_hotkey(
             - a flag indicating if the key was a "special operand", i.e. one 
                 of the pyinput keys we have to explicitly map. This has
                 implications for later handling.
-    """
-    # todo: lru cache parse_hotkey()? kinda innefficient to run every time...
 
+    Raises:
+        ValueError: if the hotkey doesn't make sense
+    """
     hotkey_keys = hotkey.split(hotkey_separator)
     # modifiers should be at the front
     modifiers = hotkey_keys[:-1]
     operand_key = hotkey_keys[-1]
     
     # make sure they're all unique. we could end up with tricky bugs otherwise
-    assert(len(modifiers)) == len(set(modifiers))
+    if len(modifiers) != len(set(modifiers)):
+        raise ValueError(f'Repeated modifier in hotkey "{hotkey}"')
+    unknown = [mod for mod in modifiers if mod not in MODIFIERS_MAP]
+    if unknown:
+        raise ValueError(f'Unknown modifier "{unknown[0]}" in hotkey "{hotkey}"')
     modifiers_obj = [MODIFIERS_MAP[mod] for mod in modifiers]
 
-    assert operand_key not in MODIFIERS_MAP
+    if operand_key in MODIFIERS_MAP:
+        raise ValueError(f'Hotkey "{hotkey}" has no key besides modifiers')
     # if there is a mapping in special operand keys, get it. otherwise
     # default to it
     if operand_key in SPECIAL_OPERAND_KEYS.keys():
         operand_key_mapped = SPECIAL_OPERAND_KEYS[operand_key]
         was_special_operand = True
-    else:
+    elif len(operand_key) == 1:
         operand_key_mapped = operand_key
         was_special_operand = False
+    else:
+        raise ValueError(f'Unknown key "{operand_key}" in hotkey "{hotkey}"')
     return modifiers_obj, operand_key_mapped, was_special_operand
 
-def execute_modified_keystroke(
-        kb_controller: KBCntrlrWrapper, hotkey, hotkey_separator: str = '+'):
-    """Execute a keystroke with modifiers
-    
+def hotkey_commands(
+        hotkey: str, hotkey_separator: str = '+') -> List[KBCntrlCommand]:
+    """Turn a hotkey into the sequence of keyboard controller commands that types it
+
     We need special handling with modifiers, because there's
     idiosyncratic behavior for pynput when using sticky keys under linux
     
     Args:
         hotkey: see documentation for parse_hotkey()
-        kb_controller: the keyboard controller to use to type the keystrokes
         hotkey_separator: see documentation for parse_hotkey()
+
+    Returns:
+        the keyboard controller commands, in order
     """
 
     modifiers, operand_key, was_special_operand = parse_hotkey(hotkey, hotkey_separator)
@@ -116,11 +126,15 @@ def execute_modified_keystroke(
     # keys. Sometimes the modifiers are left engaged, other times not.
     # Behaviour is weird too with multiple modifier keys.
     
-    if len(modifiers) > 0:
-        last_modifier = modifiers[-1]
-    with kb_controller.pressed(*modifiers):
-        kb_controller.press(operand_key)
-        kb_controller.release(operand_key)
+    # equivalent to:
+    # with kb_controller.pressed(*modifiers):
+    #     kb_controller.press(operand_key)
+    #     kb_controller.release(operand_key)
+    commands = [KBCntrlCommand('press', modifier) for modifier in modifiers]
+    commands.append(KBCntrlCommand('press', operand_key))
+    commands.append(KBCntrlCommand('release', operand_key))
+    commands += [KBCntrlCommand('release', modifier) 
+        for modifier in reversed(modifiers)]
 
     if IS_LINUX and USING_STICKY_KEYS:
         ## Special handling for sticky keys...
@@ -131,10 +145,77 @@ def execute_modified_keystroke(
         # operand_key. for whatever reason, the last modifier in the modifiers 
         # list won't be cleared.  we do that explicitly here.
         if len(modifiers) > 0 and not was_special_operand:
+            last_modifier = modifiers[-1]
             # we start out in sticky "single press" mode...cycle to 
             # sticky latched
-            kb_controller.press(KBCntrlCommand('press', last_modifier))
-            kb_controller.release(KBCntrlCommand('release', last_modifier))
+            commands.append(KBCntrlCommand('press', last_modifier))
+            commands.append(KBCntrlCommand('release', last_modifier))
             # now cycle to "unstuck"
-            kb_controller.press(KBCntrlCommand('press', last_modifier))
-            kb_controller.release(KBCntrlCommand('release', last_modifier))
+            commands.append(KBCntrlCommand('press', last_modifier))
+            commands.append(KBCntrlCommand('release', last_modifier))
+
+    return commands
+
+def parse_delay(delay: str) -> float:
+    """Parse a delay in a list of keys, e.g. 'delay 0.25'
+
+    Args:
+        delay: the delay string
+
+    Returns:
+        the delay time, in seconds
+
+    Raises:
+        ValueError: if the delay doesn't make sense
+    """
+    parts = delay.split()
+    try:
+        if len(parts) != 2 or parts[0] != 'delay':
+            raise ValueError
+        delay_time = float(parts[1])
+    except ValueError:
+        raise ValueError(f'Expected "delay <seconds>", got "{delay}"') from None
+    if delay_time < 0:
+        raise ValueError(f'Negative delay "{delay}"')
+    return delay_time
+
+def compile_keys(keys: List[str], 
+        hotkey_separator: str = '+') -> Tuple[KBCntrlCommand, ...]:
+    """Compile a list of keys into the keyboard controller commands that type them
+
+    Done once, when a command is loaded, so that running the command is just
+    a matter of sending the commands over. Any sticky keys handling (see 
+    hotkey_commands()) is baked in, per config.yaml.
+
+    Args:
+        keys: sequential hotkeys (see parse_hotkey()), and delays (see 
+            parse_delay()), e.g. ['ctrl+c', 'delay 0.25', 'alt+v']
+        hotkey_separator: see documentation for parse_hotkey()
+
+    Returns:
+        the keyboard controller commands, in order
+
+    Raises:
+        ValueError: if any of the keys don't make sense
+    """
+    program: List[KBCntrlCommand] = []
+    for hotkey in keys:
+        if hotkey.startswith('delay'):
+            program.append(KBCntrlCommand('delay', parse_delay(hotkey)))
+        else:
+            program += hotkey_commands(hotkey, hotkey_separator)
+    return tuple(program)
+
+def execute_modified_keystroke(
+        kb_controller: KBCntrlrWrapper, hotkey, hotkey_separator: str = '+'):
+    """Execute a keystroke with modifiers
+
+    See hotkey_commands(). The keystroke goes to the keyboard controller as
+    one batch
+    
+    Args:
+        hotkey: see documentation for parse_hotkey()
+        kb_controller: the keyboard controller to use to type the keystrokes
+        hotkey_separator: see documentation for parse_hotkey()
+    """
+    kb_controller.send_batch(hotkey_commands(hotkey, hotkey_separator))
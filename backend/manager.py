@@ -5,7 +5,6 @@ import time
 from typing import Dict
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 # sleep_event: threading.Event(),
 
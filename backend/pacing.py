@@ -0,0 +1,99 @@
+"""Pacing of typed text, for apps that reformat text as it's typed
+
+See pacing.yml. A profile is compiled into the delays of the keyboard 
+controller batch that types the text, so the pauses are carried out by the
+keyboard controller and the executor carries straight on.
+"""
+
+from collections import namedtuple
+from os import path
+import re
+from typing import Dict, List
+
+import yaml
+
+from ui.kb_controller import KBCntrlBatch
+
+# the profile used if config.yaml doesn't say
+DEFAULT_PACING_PROFILE = 'confluence'
+
+# hard-code the pacing profiles file for now
+pacing_profiles_file = path.join(path.dirname(__file__), 'pacing.yml')
+
+# a pacing profile
+# - name: the name of the profile
+# - delays_after: mapping from character to the time (in seconds) to pause 
+#     after typing it, before the next character
+# - word_jumps: whether undo can delete a word at a time in the app (see 
+#     backend.actions.UndoPlan)
+PacingProfile = namedtuple('PacingProfile', 'name, delays_after, word_jumps',
+    defaults=(False,))
+
+
+def load_pacing_profiles(file_path: str = pacing_profiles_file
+        ) -> Dict[str, PacingProfile]:
+    """Load the pacing profiles
+
+    Args:
+        file_path: the profiles file
+
+    Returns:
+        mapping from profile name to profile
+    """
+    with open(file_path, 'r') as f:
+        profiles_def = yaml.safe_load(f)
+    profiles = {}
+    for name, profile_def in profiles_def.items():
+        profile_def = profile_def or {}
+        delays = profile_def.get('delays_after') or {}
+        profiles[name] = PacingProfile(name, 
+            {str(char): float(delay) for char, delay in delays.items()},
+            bool(profile_def.get('word_jumps', False)))
+    return profiles
+
+
+def plan_typing(text: str, profile: PacingProfile) -> List[str]:
+    """Split text up into runs of plain characters and special characters
+
+    Special characters are the ones the profile pauses after. Each run of 
+    plain characters in between can go over to the keyboard controller as a 
+    single 'type', rather than a tap per character.
+
+    Args:
+        text: the text to type
+        profile: the pacing profile
+
+    Returns:
+        alternating plain runs and special characters, starting and ending
+        with a plain run. Plain runs can be empty
+    """
+    if not profile.delays_after:
+        return [text]
+    specials = ''.join(profile.delays_after)
+    # re caches the compiled pattern, so this is cheap for a profile in use
+    return re.split(f'([{re.escape(specials)}])', text)
+
+
+def add_paced_text(batch: KBCntrlBatch, text: str, profile: PacingProfile):
+    """Add some text to a batch, with pauses per a pacing profile
+
+    Plain runs of characters are typed in one go, special characters are
+    tapped on their own, with their pause before anything that comes after.
+
+    Args:
+        batch: the batch to add to
+        text: the text to type
+        profile: the pacing profile
+    """
+    delays_after = profile.delays_after
+    # the pause owed to the last special character, before whatever's next
+    delay = 0.0
+    for irun, run in enumerate(plan_typing(text, profile)):
+        if irun % 2:
+            batch.delay(delay)
+            batch.tap(run)
+            delay = delays_after[run]
+        elif run:
+            batch.delay(delay)
+            batch.type(run)
+            delay = 0.0
@@ -0,0 +1,114 @@
+"""Compiled utterance plans, and a cache for them
+
+An utterance like "hello there dog page down dog" is compiled once into a
+plan: an immutable sequence of text segments (to be formatted and typed) and
+command segments (with every command already resolved to its name,
+multiplier and args). Executing a plan doesn't need any further parsing, and
+since the same phrases get said over and over, plans are kept in an LRU cache
+keyed by the normalized utterance.
+"""
+
+from collections import OrderedDict, namedtuple
+import threading
+from typing import Optional
+
+# default max number of plans to keep around
+PLAN_CACHE_SIZE = 512
+
+# a run of dictated text, to be handed off to the text writer as-is
+TextSegment = namedtuple('TextSegment', 'text')
+
+# a command that has been fully parsed:
+# - name: the command name, as found in the command registry
+# - multiplier: number of times to execute it
+# - args: the remaining speech to text arguments for the command, or None
+ResolvedCommand = namedtuple('ResolvedCommand', 'name, multiplier, args')
+
+# a run of command words between escape words. Can hold multiple commands
+# (see MULTIPLE_COMMAND_DELIMITER).
+# - commands: tuple of ResolvedCommand
+# - settle_time: the largest settle time of the commands, see
+#     CommandExecutor.settle_time
+CommandSegment = namedtuple('CommandSegment', 'commands, settle_time')
+
+# the whole compiled utterance
+# - utterance: the normalized utterance text the plan was compiled from
+# - segments: tuple of TextSegment and CommandSegment, in order
+# - cmd_exec: the command dispatcher (and so the command registry snapshot) 
+#     the commands were resolved against, and must be executed with
+UtterancePlan = namedtuple('UtterancePlan', 'utterance, segments, cmd_exec')
+
+
+def normalize_utterance(raw_utterance: str) -> str:
+    """Normalize raw speech to text output, for parsing and as a cache key
+
+    Lower cases, and collapses all whitespace into single spaces
+
+    Args:
+        raw_utterance: the text directly out of the speech-to-text engine
+
+    Returns:
+        the normalized utterance
+    """
+    return ' '.join(raw_utterance.lower().split())
+
+
+class PlanCache:
+    """Bounded LRU cache of compiled utterance plans
+
+    Thread safe, because the cache gets cleared from whichever thread
+    reloads the commands.
+    """
+
+    def __init__(self, maxsize: int = PLAN_CACHE_SIZE):
+        """Init
+
+        Args:
+            maxsize: max number of plans to hold on to
+        """
+        self.maxsize = maxsize
+        self._plans: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        # counters, for the curious
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._plans)
+
+    def get(self, utterance: str) -> Optional[UtterancePlan]:
+        """Look up the plan for an utterance
+
+        Args:
+            utterance: the normalized utterance
+
+        Returns:
+            the plan, or None if it's not in the cache
+        """
+        with self._lock:
+            plan = self._plans.get(utterance)
+            if plan is None:
+                self.misses += 1
+                return None
+            self._plans.move_to_end(utterance)
+            self.hits += 1
+            return plan
+
+    def put(self, plan: UtterancePlan):
+        """Add a plan to the cache, evicting the least recently used if full
+
+        Args:
+            plan: the plan to add. Keyed on its utterance
+        """
+        with self._lock:
+            self._plans[plan.utterance] = plan
+            self._plans.move_to_end(plan.utterance)
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+
+    def clear(self):
+        """Drop all plans, e.g. because the commands they resolved changed
+        """
+        with self._lock:
+            self._plans.clear()
@@ -0,0 +1,69 @@
+import unittest
+
+from pynput.keyboard import Key
+
+from backend.actions import (WORD_JUMP_KEY, ActionHistory, UndoPlan,
+    plan_deletion)
+from backend.text import TextWriteAction
+from ui.kb_controller import KBCntrlrWrapperManager
+
+class TestPlanDeletion(unittest.TestCase):
+    """Test working out the keystrokes to delete typed text"""
+
+    def test_backspaces(self):
+        """Test plain backspacing, without word jumps"""
+        self.assertEqual(plan_deletion('hello there'), [('backspace', 11)])
+        self.assertEqual(plan_deletion(''), [])
+
+    def test_word_jumps(self):
+        """Test jumping over whole words, only where it's known to stop"""
+        # the first word might carry on into what was there already
+        self.assertEqual(plan_deletion(' hello there', True), 
+            [('word', 2), ('backspace', 1)])
+        self.assertEqual(plan_deletion('hello there ', True),
+            [('word', 1), ('backspace', 6)])
+        # punctuation isn't trusted to a word jump
+        self.assertEqual(plan_deletion(' a (bc) dog.', True),
+            [('backspace', 1), ('word', 1), ('backspace', 5), ('word', 1),
+            ('backspace', 1)])
+
+
+class TestUndoPlan(unittest.TestCase):
+    """Test undoing text in one go"""
+
+    def setUp(self):
+        self.kb_cntrl_mngr = KBCntrlrWrapperManager(backend='recording')
+        self.kb_cntrl_wrapper = self.kb_cntrl_mngr.get_kb_cntrl_wrapper()
+        self.events = self.kb_cntrl_mngr.controller.events
+
+    def test_utterances_merge(self):
+        """Test that undoing several utterances is a single batch"""
+        action_history = ActionHistory()
+        action_history.add_utterance_actions(
+            [TextWriteAction('hello', self.kb_cntrl_wrapper)])
+        action_history.add_utterance_actions(
+            [TextWriteAction(' there', self.kb_cntrl_wrapper)])
+        with UndoPlan() as plan:
+            self.assertTrue(action_history.undo_utterance(plan))
+            self.assertTrue(action_history.undo_utterance(plan))
+            self.assertEqual(self.events, [])
+        self.assertEqual(self.kb_cntrl_wrapper.messages_sent, 1)
+        self.assertEqual(self.events, [('tap', Key.backspace)] * 11)
+
+    def test_word_jumps(self):
+        """Test that a word jump is only used if all the text allows it"""
+        TextWriteAction(' hello there', self.kb_cntrl_wrapper, True).undo()
+        self.assertEqual(self.events, [('press', WORD_JUMP_KEY), 
+            ('tap', Key.backspace), ('tap', Key.backspace),
+            ('release', WORD_JUMP_KEY), ('tap', Key.backspace)])
+
+        self.kb_cntrl_mngr.controller.clear()
+        with UndoPlan() as plan:
+            TextWriteAction(' hello', self.kb_cntrl_wrapper, False
+                ).undo_into(plan)
+            TextWriteAction(' there', self.kb_cntrl_wrapper, True
+                ).undo_into(plan)
+        self.assertEqual(len(self.events), 12)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import random
+import re
+import unittest
+
+from backend.closures import ClosureFixer
+
+def fix_closures_by_index_list(input_text, remove_space_before_open_paren,
+        remove_space_after_close_paren):
+    """The way TextFormatter.fix_closures used to do it, for comparison"""
+    opens = {'`': True, '"': True, "'": True}
+    remove_whitespace_indcs = []
+    for ichar, char in enumerate(input_text):
+        if char in opens:
+            remove_whitespace_indcs.append(
+                ichar + 1 if opens[char] else ichar - 1)
+            opens[char] = not opens[char]
+        if char == '(':
+            if remove_space_before_open_paren:
+                remove_whitespace_indcs.append(ichar - 1)
+            remove_whitespace_indcs.append(ichar + 1)
+        if char == ')':
+            remove_whitespace_indcs.append(ichar - 1)
+            if remove_space_after_close_paren:
+                remove_whitespace_indcs.append(ichar + 1)
+    return ''.join(char for ichar, char in enumerate(input_text)
+        if ichar not in remove_whitespace_indcs or char != ' ')
+
+class TestClosureFixer(unittest.TestCase):
+    """Test fixing the whitespace around closures"""
+
+    def setUp(self):
+        self.fixer = ClosureFixer()
+
+    def test_same_as_before(self):
+        """Test random text against the old way of doing it"""
+        rng = random.Random(23)
+        for _ in range(2000):
+            the_text = ''.join(rng.choices('ab `"\'()', k=rng.randint(0, 30)))
+            if re.search(r"\w'\w", the_text):
+                # apostrophes in words didn't used to be left alone
+                continue
+            for before, after in [(False, False), (True, True)]:
+                self.fixer.reset()
+                self.assertEqual(self.fixer.fix(the_text, before, after),
+                    fix_closures_by_index_list(the_text, before, after),
+                    repr(the_text))
+
+    def test_nested(self):
+        """Test closures of different kinds inside each other"""
+        self.assertEqual(self.fixer.fix(
+            ' ( " it is ` here ` and \' there \' " )', True, True),
+            '("it is `here` and \'there\'")')
+
+    def test_escaped_and_apostrophes(self):
+        """Test that escaped quotes and apostrophes in words are left alone"""
+        self.assertEqual(self.fixer.fix('say \\" don\'t \' go \' " ok " '),
+            'say \\" don\'t \'go\' "ok" ')
+
+    def test_across_utterances(self):
+        """Test that a closure opened in one utterance closes in the next"""
+        self.assertEqual(self.fixer.fix(' he said "'), ' he said "')
+        self.assertEqual(self.fixer.fix(' hello there " ok'),
+            'hello there" ok')
+        self.fixer.fix(' " ')
+        self.fixer.reset()
+        self.assertEqual(self.fixer.fix(' " hi " '), ' "hi" ')
+        self.fixer.reset()
+        self.assertEqual(self.fixer.fix(' ('), ' (')
+        self.assertEqual(self.fixer.fix(' see '), 'see ')
+
+    def test_close_paren_at_end(self):
+        """Test that a ) ending one utterance leaves the next one alone"""
+        self.assertEqual(self.fixer.fix(' see ( figure one )', False, True),
+            ' see (figure one)')
+        self.assertEqual(self.fixer.fix(' for details', False, True),
+            ' for details')
+        self.assertEqual(self.fixer.fix(' he said " hi "'), ' he said "hi"')
+        self.assertEqual(self.fixer.fix(' ok'), ' ok')
+
+if __name__ == '__main__':
+    unittest.main()
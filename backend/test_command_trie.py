@@ -0,0 +1,61 @@
+import unittest
+
+from backend.command_trie import CommandTrie
+
+class TestCommandTrie(unittest.TestCase):
+    """Test the command name trie"""
+
+    def setUp(self):
+        self.trie = CommandTrie()
+        for name in ['page', 'page down', 'git add all',
+                'open the pod bay doors hal']:
+            self.trie.add(name)
+
+    def test_add_duplicate(self):
+        """Test that adding the same name twice is a no-op"""
+        self.assertFalse(self.trie.add('page down'))
+        self.assertEqual(len(self.trie), 4)
+
+    def test_longest_match(self):
+        """Test that the longest name wins"""
+        tokens = 'page down please'.split()
+        self.assertEqual(self.trie.longest_match(tokens), ('page down', 2))
+
+    def test_longest_match_backs_off(self):
+        """Test backing off to a shorter name when a longer one is incomplete"""
+        tokens = 'git add some'.split()
+        self.assertEqual(self.trie.longest_match(tokens), (None, 0))
+        tokens = 'page up'.split()
+        self.assertEqual(self.trie.longest_match(tokens), ('page', 1))
+
+    def test_deep_name(self):
+        """Test names deeper than three tokens"""
+        tokens = 'x open the pod bay doors hal now'.split()
+        self.assertEqual(self.trie.longest_match(tokens, start=1),
+            ('open the pod bay doors hal', 6))
+        self.assertEqual(self.trie.max_depth, 6)
+
+    def test_cursor(self):
+        """Test walking the trie with a cursor"""
+        cursor = self.trie.cursor()
+        self.assertTrue(cursor.advance('git'))
+        self.assertIsNone(cursor.value)
+        self.assertFalse(cursor.advance('commit'))
+        self.assertTrue(cursor.advance('add'))
+        self.assertTrue(cursor.advance('all'))
+        self.assertEqual(cursor.value, 'git add all')
+        self.assertEqual((cursor.match, cursor.match_depth), ('git add all', 3))
+        cursor.reset()
+        self.assertEqual(cursor.depth, 0)
+
+    def test_next_tokens(self):
+        """Test listing the tokens that can follow a prefix"""
+        self.assertEqual(sorted(self.trie.next_tokens([])),
+            ['git', 'open', 'page'])
+        self.assertEqual(self.trie.next_tokens(['page']), ['down'])
+        self.assertEqual(self.trie.next_tokens(['nope']), [])
+        self.assertEqual(self.trie.node_at(['nope']), None)
+        self.assertEqual(self.trie.node_at([]), 0)
+
+if __name__ == '__main__':
+    unittest.main()
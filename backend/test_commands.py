@@ -1,6 +1,9 @@
 import unittest
 
-from backend.commands import CaseCmdExec
+from backend.actions import ActionHistory
+from backend.casing import CASES, format_case
+from backend.commands import (CaseCmdExec, CommandDispatcher,
+    CommandMultiplierParser, CommandRegistry)
 
 class TestCaseCmdFormatCase(unittest.TestCase):
     """Test basic case formatting"""
@@ -46,6 +49,64 @@ class TestCaseCmdFormatCase(unittest.TestCase):
         out_expect = "slimShadyFoo"
         out = CaseCmdExec.format_case(the_text, 'camel')
         self.assertEqual(out, out_expect)
+
+    def test_all_cases(self):
+        """Test that every listed case can be formatted"""
+        self.assertEqual(len(CASES), len(set(CASES)))
+        self.assertIn('name letters', CASES)
+        for case in CASES:
+            with self.subTest(case=case):
+                self.assertTrue(format_case("slim shady foo", case))
     
+class TestCommandDispatcherParse(unittest.TestCase):
+    """Test parsing command text"""
+
+    def setUp(self):
+        commands_def = [
+            {'name': 'page', 'command_type': 'keystroke',
+                'kwargs': {'keys': ['a']}},
+            {'name': 'page down', 'command_type': 'keystroke',
+                'kwargs': {'keys': ['page_down']}},
+            {'name': 'snake', 'command_type': 'case',
+                'kwargs': {'case': 'snake', 'in_place': False}},
+        ]
+        self.dispatcher = CommandDispatcher(
+            CommandRegistry(commands_def, None), ActionHistory())
+
+    def test_multiplier(self):
+        """Test a command with a multiplier"""
+        self.assertEqual(self.dispatcher.parse('12 times page down'),
+            ('page down', 12, None))
+        self.assertEqual(self.dispatcher.parse('triple page'),
+            ('page', 3, None))
+        # not multipliers
+        self.assertEqual(CommandMultiplierParser.convert_multiplier('-2'), None)
+        self.assertEqual(CommandMultiplierParser.convert_multiplier('0'), None)
+
+    def test_args(self):
+        """Test a command with args"""
+        self.assertEqual(self.dispatcher.parse('snake slim shady'),
+            ('snake', 1, 'slim shady'))
+
+    def test_parse_tokens_start(self):
+        """Test parsing tokens from an offset"""
+        tokens = ['ignored', '2', 'page', 'up']
+        self.assertEqual(self.dispatcher.parse_tokens(tokens, start=1),
+            ('page', 2, 'up'))
+
+    def test_next_tokens(self):
+        """Test listing the tokens that can follow part of a command name"""
+        cmd_reg = self.dispatcher.cmd_reg
+        self.assertEqual(cmd_reg.cmd_name_next_tokens(['page']), ['down'])
+        # a whole name, that nothing follows
+        self.assertEqual(cmd_reg.cmd_name_next_tokens(['page', 'down']), [])
+        with self.assertRaises(ValueError):
+            cmd_reg.cmd_name_next_tokens(['nope'])
+
+    def test_unknown(self):
+        """Test that an unknown command raises"""
+        with self.assertRaises(Exception):
+            self.dispatcher.parse('3 times nope')
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
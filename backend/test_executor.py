@@ -0,0 +1,78 @@
+import unittest
+
+from backend.executor import Executor
+from ui.kb_controller import KBCntrlrWrapperManager
+
+class TestHeadlessExecutor(unittest.TestCase):
+    """Test running the executor against a headless keyboard controller"""
+
+    def setUp(self):
+        self.kb_cntrl_mngr = KBCntrlrWrapperManager(backend='recording')
+        self.kb_cntrl_mngr.start()
+        self.executor = Executor()
+        self.executor.setup(self.kb_cntrl_mngr)
+        self.events = self.kb_cntrl_mngr.controller.events
+
+    def tearDown(self):
+        self.kb_cntrl_mngr.terminate()
+
+    def test_text(self):
+        """Test that dictated text gets typed out"""
+        self.executor.parse_and_execute('hello there')
+        typed = ''.join(payload for name, payload in self.events
+            if name in ('tap', 'type'))
+        self.assertTrue(typed.endswith('there'))
+
+    def test_command(self):
+        """Test that commands get sent, and barriers go straight through"""
+        self.executor.parse_and_execute('dog git status dog')
+        # types the text, then hits enter
+        self.assertEqual(self.events[0], ('type', 'git status'))
+        self.assertIn('press', [name for name, _ in self.events[1:]])
+        self.assertTrue(self.executor._kb_controller.barrier(timeout=0.1)) # pylint: disable=protected-access
+
+    def test_stop(self):
+        """Test that "stop stop" aborts typing, and typing carries on after"""
+        self.executor.parse_and_execute('stop stop')
+        self.assertEqual(self.events, [])
+        self.assertEqual(self.kb_cntrl_mngr._abort_generation.value, 1) # pylint: disable=protected-access
+        self.executor.parse_and_execute('hello there')
+        self.assertTrue(self.events)
+
+    def test_stop_in_flight(self):
+        """Test that "stop stop" drops the rest of a plan already prepared,
+        and leaves it out of the history"""
+        plan = self.executor.prepare('hello there dog git status dog more')
+        abort_generation = self.executor.abort_generation
+        self.executor.prepare('stop stop')
+        self.executor.execute_plan(plan, abort_generation)
+        self.assertEqual(self.events, [])
+
+        # heard part way through typing it out
+        dispatch = self.executor.text_writer.dispatch
+        def dispatch_then_stop(raw):
+            action = dispatch(raw)
+            self.executor.prepare('stop stop')
+            return action
+        self.executor.text_writer.dispatch = dispatch_then_stop
+        self.executor.execute_plan(plan)
+        typed = ''.join(payload for name, payload in self.events
+            if name in ('tap', 'type'))
+        self.assertTrue(typed.endswith('there'))
+        self.assertEqual(self.executor.history.utterance_history, [])
+
+    def test_null(self):
+        """Test that the null backend drops everything"""
+        kb_cntrl_mngr = KBCntrlrWrapperManager(backend='null')
+        kb_cntrl_wrapper = kb_cntrl_mngr.get_kb_cntrl_wrapper()
+        kb_cntrl_wrapper.type('hello')
+        self.assertTrue(kb_cntrl_wrapper.barrier(timeout=0.1))
+        self.assertFalse(hasattr(kb_cntrl_mngr.controller, 'events'))
+
+    def test_unknown_backend(self):
+        """Test that unknown backends are rejected"""
+        with self.assertRaises(ValueError):
+            KBCntrlrWrapperManager(backend='carrier pigeon')
+
+if __name__ == '__main__':
+    unittest.main()
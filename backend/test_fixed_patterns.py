@@ -0,0 +1,71 @@
+import random
+import unittest
+
+from backend.fixed_patterns import FixedPatternReplacer
+from backend.text_formatter import PlainTextFormatter
+
+def replace_one_by_one(patterns, the_text):
+    """The plain way: a str.replace() for each pattern, in order"""
+    for orig, replace in patterns.items():
+        the_text = the_text.replace(orig, replace)
+    return the_text
+
+class TestFixedPatternReplacer(unittest.TestCase):
+    """Test that the automaton gives the same result as replacing one by one"""
+
+    def assertSameAsOneByOne(self, patterns, replacer, the_text):
+        self.assertEqual(replacer.replace(the_text),
+            replace_one_by_one(patterns, the_text), repr(the_text))
+
+    def test_priority(self):
+        """Test that the first listed pattern wins when they overlap"""
+        patterns = {' donkey ': '-', 'donkey ': '-', 'donkey': '-',
+            'key': 'lock'}
+        replacer = FixedPatternReplacer(patterns)
+        self.assertEqual(replacer.replace('a donkey b donkey, key'),
+            'a-b -, lock')
+        self.assertEqual(replacer.find('monkey'), {3})
+
+    def test_cascades(self):
+        """Test replacements that create or destroy later patterns"""
+        patterns = {'ab': 'c', 'cd': 'x', 'xx': 'y', 'q': '', 'pr': 'z',
+            'zz': 'd', 'ca': 'nope'}
+        replacer = FixedPatternReplacer(patterns)
+        for the_text in ['abd', 'abdcd', 'pqr', 'pqrpqr', 'cab', 'caab',
+                'abab', 'qqq', '']:
+            self.assertSameAsOneByOne(patterns, replacer, the_text)
+        with self.assertRaises(ValueError):
+            FixedPatternReplacer({'': 'x'})
+
+    def test_random_tables(self):
+        """Test random pattern tables over a tiny alphabet, where lots
+        overlap"""
+        rng = random.Random(21)
+        for _ in range(300):
+            patterns = {}
+            for _ in range(rng.randint(1, 8)):
+                orig = ''.join(rng.choices('ab c', k=rng.randint(1, 3)))
+                patterns[orig] = ''.join(rng.choices('ab c',
+                    k=rng.randint(0, 3)))
+            replacer = FixedPatternReplacer(patterns)
+            for _ in range(20):
+                the_text = ''.join(rng.choices('ab c', k=rng.randint(0, 12)))
+                self.assertSameAsOneByOne(patterns, replacer, the_text)
+
+    def test_replace_patterns_file(self):
+        """Test the real table, on phrases made out of its own patterns"""
+        formatter = PlainTextFormatter()
+        patterns = formatter._fixed_replace_patterns # pylint: disable=protected-access
+        replacer = FixedPatternReplacer(patterns)
+        self.assertEqual(len(replacer), len(patterns))
+        pieces = list(patterns) + list(patterns.values()) + [' ', 'i',
+            'the', 'hello there', 'and']
+        rng = random.Random(110)
+        for _ in range(3000):
+            the_text = ''.join(rng.choices(pieces, k=rng.randint(1, 6)))
+            self.assertSameAsOneByOne(patterns, replacer, the_text)
+            self.assertSameAsOneByOne(patterns, replacer,
+                ' '.join(rng.choices(pieces, k=rng.randint(1, 6))))
+
+if __name__ == '__main__':
+    unittest.main()
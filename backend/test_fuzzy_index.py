@@ -0,0 +1,70 @@
+import unittest
+
+from backend.commands import CommandDispatcher, CommandRegistry
+from backend.actions import ActionHistory
+from backend.fuzzy_index import (BKTree, FuzzyCommandIndex, levenshtein,
+    soundex)
+
+names = ['tabitha', 'page down', 'page up', 'scroll down', 'snake', 'pasta']
+
+class TestFuzzyHelpers(unittest.TestCase):
+    """Test the phonetic and edit distance helpers"""
+
+    def test_soundex(self):
+        """Test soundex codes"""
+        self.assertEqual(soundex('tabitha'), 'T130')
+        self.assertEqual(soundex('tabatha'), 'T130')
+        self.assertEqual(soundex('robert'), 'R163')
+        self.assertEqual(soundex('ashcraft'), 'A261')
+        self.assertEqual(soundex('3'), '3')
+
+    def test_levenshtein(self):
+        """Test edit distances"""
+        self.assertEqual(levenshtein('', 'abc'), 3)
+        self.assertEqual(levenshtein('kitten', 'sitting'), 3)
+        self.assertEqual(levenshtein('sitting', 'kitten'), 3)
+        self.assertEqual(levenshtein('page down', 'page dawn'), 1)
+        self.assertEqual(levenshtein('flaw', 'lawn'), 2)
+
+    def test_bk_tree(self):
+        """Test BK-tree search against a plain scan"""
+        tree = BKTree(names)
+        for query in ['tabatha', 'page', 'scrol down', 'xylophone']:
+            expected = sorted((levenshtein(query, name), name)
+                for name in names if levenshtein(query, name) <= 2)
+            self.assertEqual(tree.search(query, 2), expected)
+
+
+class TestFuzzyCommandIndex(unittest.TestCase):
+    """Test resolving misheard command names"""
+
+    def setUp(self):
+        self.index = FuzzyCommandIndex(names)
+
+    def test_near_misses(self):
+        """Test that near misses resolve to the right name"""
+        self.assertEqual(self.index.lookup('tabatha')[0], 'tabitha')
+        self.assertEqual(self.index.lookup('page dawn')[0], 'page down')
+        self.assertEqual(self.index.lookup('scrol down')[0], 'scroll down')
+
+    def test_rejects(self):
+        """Test that things too far from any name don't match"""
+        self.assertIsNone(self.index.lookup('xylophone'))
+        # close in edit distance, but too short to be confident
+        self.assertIsNone(self.index.lookup('pa'))
+        # different number of words
+        self.assertIsNone(self.index.lookup('snake foo'))
+
+    def test_parse_fallback(self):
+        """Test that parsing falls back to fuzzy matching"""
+        commands_def = [{'name': name, 'command_type': 'keystroke',
+            'kwargs': {'keys': ['enter']}} for name in names]
+        dispatcher = CommandDispatcher(
+            CommandRegistry(commands_def, None), ActionHistory())
+        self.assertEqual(dispatcher.parse('3 times tabatha'),
+            ('tabitha', 3, None))
+        with self.assertRaises(Exception):
+            dispatcher.parse('xylophone')
+
+if __name__ == '__main__':
+    unittest.main()
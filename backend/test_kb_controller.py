@@ -0,0 +1,324 @@
+import multiprocessing
+import os
+import platform
+import signal
+from queue import Empty, Queue
+import threading
+import time
+import unittest
+
+from pynput.keyboard import Key
+
+from ui import kb_controller
+from ui.kb_controller import (COMMAND_QUEUE_SIZE, DequeCommandQueue,
+    KBCntrlCommand, KBCntrlrWrapper, KBCntrlrWrapperManager, KBCommandRunner,
+    MAX_MACRO_COUNT, QueueLag, TRANSPORTS, RecordingController,
+    choose_backend, pynp_kb_cntrl_job)
+
+class TestKBCntrlBatch(unittest.TestCase):
+    """Test building batches of keyboard operations"""
+
+    def setUp(self):
+        self.kb_cntrl_mngr = KBCntrlrWrapperManager(backend='recording')
+        self.kb_cntrl_wrapper = self.kb_cntrl_mngr.get_kb_cntrl_wrapper()
+        self.events = self.kb_cntrl_mngr.controller.events
+
+    def test_single_message(self):
+        """Test that a batch goes over as one message, in order"""
+        with self.kb_cntrl_wrapper.batch() as batch:
+            batch.press(Key.ctrl).tap('a').release(Key.ctrl)
+            batch.delay(0.1)
+            batch.type('hello')
+        self.assertEqual(self.kb_cntrl_wrapper.messages_sent, 1)
+        self.assertEqual(self.events, [('press', Key.ctrl), ('tap', 'a'),
+            ('release', Key.ctrl), ('delay', 0.1), ('type', 'hello')])
+
+    def test_merging(self):
+        """Test that consecutive types and delays get merged"""
+        with self.kb_cntrl_wrapper.batch() as batch:
+            batch.type('hello').type(' there').type('')
+            batch.delay(0.1).delay(0.2).delay(0)
+            self.assertEqual(len(batch), 2)
+        self.assertEqual(self.events[0], ('type', 'hello there'))
+        self.assertAlmostEqual(self.events[1][1], 0.3)
+
+    def test_chunking(self):
+        """Test that long batches get sent in chunks"""
+        with self.kb_cntrl_wrapper.batch(max_ops=4) as batch:
+            for char in 'abcdefghij':
+                batch.tap(char)
+        self.assertEqual(self.kb_cntrl_wrapper.messages_sent, 3)
+        self.assertEqual(''.join(payload for _, payload in self.events),
+            'abcdefghij')
+
+    def test_macro(self):
+        """Test defining a sequence once, and running it by id"""
+        macro_id = self.kb_cntrl_wrapper.define_macro(
+            [KBCntrlCommand('tap', 'a'), KBCntrlCommand('tap', 'b')])
+        self.assertEqual(self.kb_cntrl_wrapper.define_macro(
+            (KBCntrlCommand('tap', 'a'), KBCntrlCommand('tap', 'b'))), 
+            macro_id)
+        self.kb_cntrl_wrapper.run_macro(macro_id, 2)
+        self.assertEqual(self.kb_cntrl_wrapper.messages_sent, 2)
+        self.assertEqual(''.join(payload for _, payload in self.events),
+            'abab')
+
+    def test_macro_big_count(self):
+        """Test that running a macro more times than fit in one message still
+        runs it that many times"""
+        macro_id = self.kb_cntrl_wrapper.define_macro(
+            [KBCntrlCommand('tap', 'a')])
+        self.kb_cntrl_wrapper.run_macro(macro_id, MAX_MACRO_COUNT + 2)
+        # the definition, then two runs
+        self.assertEqual(self.kb_cntrl_wrapper.messages_sent, 3)
+        self.assertEqual(len(self.events), MAX_MACRO_COUNT + 2)
+
+    def test_exception(self):
+        """Test that half built batches don't get sent"""
+        with self.assertRaises(RuntimeError):
+            with self.kb_cntrl_wrapper.batch() as batch:
+                batch.tap('a')
+                raise RuntimeError
+        self.assertEqual(self.events, [])
+
+
+class TestThreadBackend(unittest.TestCase):
+    """Test the in-process keyboard controller thread"""
+
+    def test_deque_queue(self):
+        """Test handing commands over through the deque, in order"""
+        command_queue = DequeCommandQueue(QueueLag())
+        command_queue.put(KBCntrlCommand('tap', 'a'))
+        command_queue.put(KBCntrlCommand('tap', 'b'))
+        self.assertEqual(command_queue.get().payload, 'a')
+        self.assertEqual(command_queue.get(timeout=0.1).payload, 'b')
+        with self.assertRaises(Empty):
+            command_queue.get(timeout=0.01)
+
+    def test_barrier_and_terminate(self):
+        """Test that the thread acknowledges barriers and shuts down"""
+        kb_cntrl_mngr = KBCntrlrWrapperManager(backend='thread')
+        kb_cntrl_mngr.start()
+        self.assertTrue(kb_cntrl_mngr.get_kb_cntrl_wrapper().barrier(
+            timeout=1.0))
+        kb_cntrl_mngr.terminate()
+
+    def test_choose_backend(self):
+        """Test picking the backend from the config"""
+        expected = 'process' if platform.system() == 'Darwin' else 'thread'
+        self.assertEqual(choose_backend('auto'), expected)
+        self.assertEqual(choose_backend('process'), 'process')
+        with self.assertRaises(ValueError):
+            choose_backend('carrier pigeon')
+
+
+class WaitingController:
+    """Ignores events, but actually waits on delays, like pynput's does"""
+
+    def tap(self, key):
+        pass
+
+    def release(self, key):
+        pass
+
+class TestAbort(unittest.TestCase):
+    """Test throwing away queued keyboard commands"""
+
+    def setUp(self):
+        self.abort_generation = multiprocessing.Value('Q', 0)
+        self.ack_queue = Queue()
+
+    def test_runner_skips_until_resume(self):
+        """Test that an abort skips the rest of a batch, but not barriers"""
+        kb_cntrl = RecordingController()
+        runner = KBCommandRunner(kb_cntrl, self.ack_queue,
+            self.abort_generation)
+        runner.run(KBCntrlCommand('press', Key.ctrl))
+        self.abort_generation.value += 1
+        runner.run(KBCntrlCommand('batch', [
+            KBCntrlCommand('tap', 'a'),
+            KBCntrlCommand('sync', 3),
+            KBCntrlCommand('type', 'bc'),
+        ]))
+        self.assertTrue(runner.aborting)
+        # the held down key got let go of
+        self.assertEqual(kb_cntrl.events, [('press', Key.ctrl),
+            ('release', Key.ctrl)])
+        self.assertEqual(self.ack_queue.get_nowait(), 3)
+
+        # markers from earlier aborts don't count
+        runner.run(KBCntrlCommand('resume', 0))
+        self.assertTrue(runner.aborting)
+        runner.run(KBCntrlCommand('resume', 1))
+        self.assertFalse(runner.aborting)
+        runner.run(KBCntrlCommand('tap', 'd'))
+        self.assertEqual(kb_cntrl.events[-1], ('tap', 'd'))
+
+    def test_standby_takes_over_abort_state(self):
+        """Test that a standby runner carries on from where the one that died
+        left off, aborting only if that one was part way through an abort"""
+        resumed_generation = multiprocessing.Value('Q', 0, lock=False)
+        runner = KBCommandRunner(RecordingController(), self.ack_queue,
+            self.abort_generation, resumed_generation=resumed_generation)
+        kb_cntrl = RecordingController()
+        standby = KBCommandRunner(kb_cntrl, self.ack_queue,
+            self.abort_generation, resumed_generation=resumed_generation)
+
+        # an abort the one that died got all the way through
+        self.abort_generation.value += 1
+        runner.run(KBCntrlCommand('resume', 1))
+        self.assertFalse(standby.aborting)
+        standby.run(KBCntrlCommand('type', 'hello'))
+        self.assertEqual(kb_cntrl.events, [('type', 'hello')])
+
+        # one it died part way through, so the marker gets replayed
+        self.abort_generation.value += 1
+        standby.run(KBCntrlCommand('type', 'thrown away'))
+        standby.run(KBCntrlCommand('resume', 2))
+        standby.run(KBCntrlCommand('type', 'there'))
+        self.assertEqual(kb_cntrl.events, [('type', 'hello'),
+            ('type', 'there')])
+
+    def test_abort_cuts_delays_short(self):
+        """Test that an abort stops a long batch of delays straight away"""
+        command_queue = DequeCommandQueue(QueueLag())
+        kb_cntrl_wrapper = KBCntrlrWrapper(command_queue, self.ack_queue,
+            self.abort_generation)
+        job = threading.Thread(target=pynp_kb_cntrl_job, args=(command_queue,
+            self.ack_queue, self.abort_generation, WaitingController))
+        job.start()
+        try:
+            with kb_cntrl_wrapper.batch() as batch:
+                for char in 'abcdefghij':
+                    batch.tap(char).delay(0.5)
+            time.sleep(0.05)
+            start = time.monotonic()
+            kb_cntrl_wrapper.abort()
+            kb_cntrl_wrapper.tap('z')
+            self.assertTrue(kb_cntrl_wrapper.drain(timeout=1.0))
+            self.assertLess(time.monotonic() - start, 0.25)
+        finally:
+            command_queue.put(KBCntrlCommand('terminate', None))
+            job.join()
+
+    def test_drain_and_terminate(self):
+        """Test draining, and that terminating twice is fine"""
+        kb_cntrl_mngr = KBCntrlrWrapperManager(backend='null_process')
+        kb_cntrl_mngr.start()
+        kb_cntrl_wrapper = kb_cntrl_mngr.get_kb_cntrl_wrapper()
+        kb_cntrl_wrapper.type('hello')
+        self.assertTrue(kb_cntrl_wrapper.drain(timeout=5.0))
+        stats = kb_cntrl_mngr.command_queue_stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertGreaterEqual(stats['max_lag_s'], stats['lag_s'])
+        kb_cntrl_mngr.terminate()
+        kb_cntrl_mngr.terminate()
+
+class TestSupervision(unittest.TestCase):
+    """Test replacing the keyboard controller process when it dies"""
+
+    def test_killed(self):
+        """Test that the standby takes over from a killed process"""
+        for transport in ['ring', 'queue']:
+            with self.subTest(transport=transport):
+                kb_cntrl_mngr = KBCntrlrWrapperManager(
+                    backend='null_process', transport=transport)
+                kb_cntrl_mngr.start()
+                self.addCleanup(kb_cntrl_mngr.terminate)
+                kb_cntrl_wrapper = kb_cntrl_mngr.get_kb_cntrl_wrapper()
+                macro_id = kb_cntrl_wrapper.define_macro(
+                    [KBCntrlCommand('tap', 'a')])
+                self.assertTrue(kb_cntrl_wrapper.barrier(timeout=5.0))
+                kb_cntrl_mngr._job.kill() # pylint: disable=protected-access
+                kb_cntrl_wrapper.type('hello')
+                # the replacement knows the macro too
+                kb_cntrl_wrapper.run_macro(macro_id)
+                self.assertTrue(kb_cntrl_wrapper.barrier(timeout=5.0))
+                self.assertEqual(
+                    kb_cntrl_mngr.command_queue_stats()['restarts'], 1)
+
+    def test_killed_after_abort(self):
+        """Test that the standby doesn't take over still aborting, after the
+        one that died got through an abort"""
+        for transport in TRANSPORTS:
+            with self.subTest(transport=transport):
+                kb_cntrl_mngr = KBCntrlrWrapperManager(
+                    backend='null_process', transport=transport)
+                kb_cntrl_mngr.start()
+                self.addCleanup(kb_cntrl_mngr.terminate)
+                kb_cntrl_wrapper = kb_cntrl_mngr.get_kb_cntrl_wrapper()
+                kb_cntrl_wrapper.type('hello')
+                kb_cntrl_wrapper.abort()
+                self.assertTrue(kb_cntrl_wrapper.barrier(timeout=5.0))
+                kb_cntrl_mngr._job.kill() # pylint: disable=protected-access
+                kb_cntrl_wrapper.type('there')
+                self.assertTrue(kb_cntrl_wrapper.barrier(timeout=5.0))
+                self.assertEqual(
+                    kb_cntrl_mngr.command_queue_stats()['restarts'], 1)
+                self.assertEqual(
+                    kb_cntrl_mngr._resumed_generation.value, # pylint: disable=protected-access
+                    kb_cntrl_mngr._abort_generation.value) # pylint: disable=protected-access
+
+    @unittest.skipUnless(hasattr(signal, 'SIGSTOP'), 'needs SIGSTOP')
+    def test_hung_with_full_queue(self):
+        """Test replacing a hung process with its queue full, and something
+        waiting to put more on it"""
+        self.addCleanup(setattr, kb_controller, 'HEARTBEAT_TIMEOUT_S',
+            kb_controller.HEARTBEAT_TIMEOUT_S)
+        kb_controller.HEARTBEAT_TIMEOUT_S = 1.0
+        kb_cntrl_mngr = KBCntrlrWrapperManager(backend='null_process',
+            transport='queue')
+        kb_cntrl_mngr.start()
+        self.addCleanup(kb_cntrl_mngr.terminate)
+        kb_cntrl_wrapper = kb_cntrl_mngr.get_kb_cntrl_wrapper()
+        self.assertTrue(kb_cntrl_wrapper.barrier(timeout=5.0))
+        os.kill(kb_cntrl_mngr._job._job.pid, signal.SIGSTOP) # pylint: disable=protected-access
+
+        messages_sent = kb_cntrl_wrapper.messages_sent
+        num_taps = COMMAND_QUEUE_SIZE + 100
+        def tap_lots():
+            for _ in range(num_taps):
+                kb_cntrl_wrapper.tap('a')
+        tapper = threading.Thread(target=tap_lots, daemon=True)
+        tapper.start()
+        tapper.join(timeout=10.0)
+        self.assertFalse(tapper.is_alive())
+        self.assertEqual(kb_cntrl_wrapper.messages_sent,
+            messages_sent + num_taps)
+        self.assertTrue(kb_cntrl_wrapper.barrier(timeout=5.0))
+        stats = kb_cntrl_mngr.command_queue_stats()
+        self.assertEqual(stats['restarts'], 1)
+        self.assertGreaterEqual(stats['replayed'], COMMAND_QUEUE_SIZE)
+
+    def test_bad_command(self):
+        """Test that a command that kills the process gets reported"""
+        kb_cntrl_mngr = KBCntrlrWrapperManager(backend='null_process',
+            transport='queue')
+        kb_cntrl_mngr.start()
+        self.addCleanup(kb_cntrl_mngr.terminate)
+        kb_cntrl_wrapper = kb_cntrl_mngr.get_kb_cntrl_wrapper()
+        kb_cntrl_wrapper._put(KBCntrlCommand('carrier pigeon', None)) # pylint: disable=protected-access
+        kb_cntrl_wrapper.type('hello')
+        self.assertTrue(kb_cntrl_wrapper.barrier(timeout=5.0))
+        stats = kb_cntrl_mngr.command_queue_stats()
+        self.assertEqual(stats['restarts'], 1)
+        self.assertEqual(stats['interrupted'], 1)
+
+    def test_spawn(self):
+        """Test starting the process when processes get spawned rather than
+        forked, as on macOS"""
+        self.addCleanup(multiprocessing.set_start_method,
+            multiprocessing.get_start_method(), force=True)
+        multiprocessing.set_start_method('spawn', force=True)
+        for transport in TRANSPORTS:
+            with self.subTest(transport=transport):
+                kb_cntrl_mngr = KBCntrlrWrapperManager(
+                    backend='null_process', transport=transport)
+                kb_cntrl_mngr.start()
+                self.addCleanup(kb_cntrl_mngr.terminate)
+                kb_cntrl_wrapper = kb_cntrl_mngr.get_kb_cntrl_wrapper()
+                kb_cntrl_wrapper.type('hello')
+                self.assertTrue(kb_cntrl_wrapper.barrier(timeout=10.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+from queue import Empty
+
+from pynput.keyboard import Key
+
+from ui import kb_ring
+from ui.kb_controller import KBCntrlCommand
+from ui.kb_ring import (KBCommandRing, decode_key, decode_records,
+    encode_commands, encode_key)
+
+class TestEncoding(unittest.TestCase):
+    """Test the binary record encoding of keyboard commands"""
+
+    def test_keys(self):
+        """Test encoding characters and pynput Keys"""
+        for key in ['a', '}', 'é', Key.space, Key.backspace]:
+            self.assertEqual(decode_key(encode_key(key)), key)
+        with self.assertRaises(ValueError):
+            encode_key('ab')
+
+    def test_round_trip(self):
+        """Test that commands survive encoding, delays and batches included"""
+        commands = [
+            KBCntrlCommand('press', Key.ctrl),
+            KBCntrlCommand('tap', 'a'),
+            KBCntrlCommand('release', Key.ctrl),
+            KBCntrlCommand('delay', 0.5),
+            KBCntrlCommand('batch', [
+                KBCntrlCommand('type', 'hi'),
+                KBCntrlCommand('type', ' there'),
+            ]),
+            KBCntrlCommand('sync', 7),
+            KBCntrlCommand('delay', 0.25),
+            KBCntrlCommand('resume', 2),
+            KBCntrlCommand('define', (3, [KBCntrlCommand('tap', 'x'),
+                KBCntrlCommand('delay', 0.5)])),
+            KBCntrlCommand('macro', (3, 15)),
+        ]
+        self.assertEqual(decode_records(encode_commands(commands)), [
+            KBCntrlCommand('press', Key.ctrl),
+            KBCntrlCommand('tap', 'a'),
+            KBCntrlCommand('release', Key.ctrl),
+            KBCntrlCommand('delay', 0.5),
+            KBCntrlCommand('type', 'hi there'),
+            KBCntrlCommand('sync', 7),
+            KBCntrlCommand('delay', 0.25),
+            KBCntrlCommand('resume', 2),
+            KBCntrlCommand('define', (3, [KBCntrlCommand('tap', 'x'),
+                KBCntrlCommand('delay', 0.5)])),
+            KBCntrlCommand('macro', (3, 15)),
+        ])
+
+
+class TestKBCommandRing(unittest.TestCase):
+    """Test the shared memory ring, with both ends in this process"""
+
+    def setUp(self):
+        self.ring = KBCommandRing(capacity=8)
+
+    def tearDown(self):
+        self.ring.close(unlink=True)
+
+    def test_put_get(self):
+        """Test that everything put in comes out, in one go"""
+        self.ring.put(KBCntrlCommand('tap', 'a'))
+        self.ring.put(KBCntrlCommand('type', 'bc'))
+        self.assertEqual(self.ring.depth, 3)
+        self.assertEqual(self.ring.get(), KBCntrlCommand('batch', [
+            KBCntrlCommand('tap', 'a'), KBCntrlCommand('type', 'bc')]))
+        self.assertEqual(self.ring.depth, 0)
+        self.assertEqual(self.ring.stats()['max_depth'], 3)
+
+    def test_wraparound(self):
+        """Test going round the ring a few times"""
+        for char in 'abcdefghijklmnopqrstuvwxyz':
+            self.ring.put(KBCntrlCommand('type', char * 5))
+            self.assertEqual(self.ring.get(), KBCntrlCommand('type', char * 5))
+
+    def test_terminate_on_its_own(self):
+        """Test that terminate comes out separately from what's before it"""
+        self.ring.put(KBCntrlCommand('tap', 'a'))
+        self.ring.put(KBCntrlCommand('terminate', None))
+        self.assertEqual(self.ring.get(), KBCntrlCommand('tap', 'a'))
+        self.assertEqual(self.ring.get(), KBCntrlCommand('terminate', None))
+
+    def test_stuck_index_lock(self):
+        """Test that a consumer dying while holding the index lock doesn't
+        wedge the producer"""
+        self.addCleanup(setattr, kb_ring, 'INDEX_LOCK_TIMEOUT_S',
+            kb_ring.INDEX_LOCK_TIMEOUT_S)
+        kb_ring.INDEX_LOCK_TIMEOUT_S = 0.01
+        self.ring._index_lock.acquire() # pylint: disable=protected-access
+        self.ring.put(KBCntrlCommand('tap', 'a'))
+        self.assertEqual(self.ring.get(), KBCntrlCommand('tap', 'a'))
+
+    def test_empty(self):
+        """Test timing out on an empty ring"""
+        with self.assertRaises(Empty):
+            self.ring.get(timeout=0.01)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from pynput.keyboard import Key
+
+from backend.commands import CommandRegistry
+from backend.keystrokes import compile_keys, hotkey_commands
+from ui.kb_controller import KBCntrlCommand
+
+class TestCompileKeys(unittest.TestCase):
+    """Test compiling keystroke commands up front"""
+
+    def test_program(self):
+        """Test hotkeys and delays compiled in order"""
+        program = compile_keys(['ctrl+shift+left', 'delay 0.25', 'enter'])
+        self.assertEqual(program, tuple(hotkey_commands('ctrl+shift+left') +
+            [KBCntrlCommand('delay', 0.25)] + hotkey_commands('enter')))
+        self.assertEqual(program[-2:], (KBCntrlCommand('press', Key.enter),
+            KBCntrlCommand('release', Key.enter)))
+
+    def test_broken(self):
+        """Test that broken key definitions are rejected"""
+        for keys in [['ctrl+ctrl+a'], ['hyper+a'], ['ctrl+shift'],
+                ['ctrl+pgdn'], ['delay'], ['delay soon'], ['delay -1']]:
+            with self.subTest(keys=keys):
+                with self.assertRaises(ValueError):
+                    compile_keys(keys)
+
+    def test_load(self):
+        """Test that a broken definition is rejected when commands load"""
+        commands_def = [{'name': 'page down', 'command_type': 'keystroke',
+            'kwargs': {'keys': ['page_dn']}}]
+        with self.assertRaisesRegex(ValueError, 'page down'):
+            CommandRegistry(commands_def, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+
+from backend.pacing import (PacingProfile, add_paced_text,
+    load_pacing_profiles, plan_typing)
+from backend.manager import event_mngr
+from backend.text import TextWriter
+from ui.kb_controller import InjectionWindow, KBCntrlrWrapperManager
+from ui.keyboard import KeyboardManager
+
+class LaggingCommandQueue:
+    """Command queue for a keyboard controller that's running behind
+
+    Holds on to commands until a barrier comes in, then runs them all, with
+    the keyboard listener seeing each key as it gets typed.
+
+    Args:
+        command_queue: the queue of the controller that runs them
+        listener: the keyboard listener
+    """
+
+    depth = 0
+
+    def __init__(self, command_queue, listener: KeyboardManager):
+        self._command_queue = command_queue
+        self._listener = listener
+        self._held = []
+
+    def put(self, command):
+        self._held.append(command)
+        if command.name != 'sync':
+            return
+        for held in self._held:
+            self._command_queue.put(held)
+            if held.name != 'sync':
+                self._listener.on_press(None)
+        self._held.clear()
+
+class TestPacing(unittest.TestCase):
+    """Test pacing profiles compiled into keyboard batches"""
+
+    def setUp(self):
+        self.kb_cntrl_mngr = KBCntrlrWrapperManager(backend='recording')
+        self.kb_cntrl_wrapper = self.kb_cntrl_mngr.get_kb_cntrl_wrapper()
+        self.events = self.kb_cntrl_mngr.controller.events
+
+    def test_profiles_file(self):
+        """Test that the shipped profiles load"""
+        profiles = load_pacing_profiles()
+        self.assertEqual(profiles['none'].delays_after, {})
+        self.assertEqual(profiles['confluence'].delays_after['`'], 0.2)
+
+    def test_pauses(self):
+        """Test that pauses go after the special characters only"""
+        profile = PacingProfile('test', {'`': 0.2})
+        with self.kb_cntrl_wrapper.batch() as batch:
+            add_paced_text(batch, '``ab`', profile)
+        self.assertEqual(self.events, [('tap', '`'), ('delay', 0.2),
+            ('tap', '`'), ('delay', 0.2), ('type', 'ab'), ('tap', '`')])
+
+    def test_full_speed(self):
+        """Test that plain text goes without any pauses"""
+        profile = PacingProfile('test', {'`': 0.2})
+        with self.kb_cntrl_wrapper.batch() as batch:
+            add_paced_text(batch, 'plain text', profile)
+        self.assertEqual(self.events, [('type', 'plain text')])
+
+    def test_plan(self):
+        """Test splitting text into plain runs and special characters"""
+        profile = PacingProfile('test', {'`': 0.2, ']': 0.1})
+        self.assertEqual(plan_typing('a `b` [c]', profile),
+            ['a ', '`', 'b', '`', ' [c', ']', ''])
+        self.assertEqual(plan_typing('a `b`', PacingProfile('none', {})),
+            ['a `b`'])
+
+    def test_text_writer(self):
+        """Test that the text writer types with its profile, in one batch"""
+        text_writer = TextWriter(self.kb_cntrl_wrapper, 
+            pacing_profile='slack')
+        text_writer.dispatch('backslider code backslider')
+        self.assertEqual(self.kb_cntrl_wrapper.messages_sent, 1)
+        self.assertIn(('delay', 0.1), self.events)
+        with self.assertRaises(ValueError):
+            text_writer.set_pacing_profile('carrier pigeon')
+
+    def test_own_keys_not_user_action(self):
+        """Test that keys the text writer types itself don't count as the user
+        pressing keys, for the next utterance, however long after they were
+        sent they get typed"""
+        event_mngr.key_pressed.clear()
+        self.addCleanup(event_mngr.key_pressed.clear)
+        listener = KeyboardManager()
+        listener.injection_window = self.kb_cntrl_mngr.injection_window
+        self.kb_cntrl_wrapper._command_queue = LaggingCommandQueue( # pylint: disable=protected-access
+            self.kb_cntrl_wrapper._command_queue, listener) # pylint: disable=protected-access
+        text_writer = TextWriter(self.kb_cntrl_wrapper, pacing_profile='none')
+        text_writer.dispatch('hello there')
+        # by now it's all been typed
+        self.kb_cntrl_wrapper.barrier()
+        self.assertFalse(event_mngr.key_pressed.is_set())
+        action = text_writer.dispatch('and more')
+        self.assertEqual(action.text, ' and more')
+
+        # but the user's keys still count
+        listener.injection_window = InjectionWindow()
+        listener.on_press(None)
+        self.assertTrue(event_mngr.key_pressed.is_set())
+
+if __name__ == '__main__':
+    unittest.main()
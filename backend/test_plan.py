@@ -0,0 +1,96 @@
+import unittest
+
+from backend.commands import CommandDispatcher, CommandRegistry
+from backend.executor import Executor
+from backend.actions import ActionHistory
+from backend.plan import (CommandSegment, PlanCache, ResolvedCommand,
+    TextSegment, UtterancePlan, normalize_utterance)
+
+commands_def = [
+    {'name': 'pasta', 'command_type': 'keystroke',
+        'kwargs': {'keys': ['super+v']}},
+    {'name': 'page down', 'command_type': 'keystroke', 'settle_time': 0.1,
+        'kwargs': {'keys': ['page_down']}},
+    {'name': 'snake', 'command_type': 'case',
+        'kwargs': {'case': 'snake', 'in_place': False}},
+]
+
+class TestCompileUtterance(unittest.TestCase):
+    """Test compiling utterances into plans"""
+
+    def setUp(self):
+        self.executor = Executor()
+        self.executor.cmd_exec = CommandDispatcher(
+            CommandRegistry(commands_def, None), ActionHistory())
+
+    def test_normalize(self):
+        """Test utterance normalization"""
+        self.assertEqual(normalize_utterance('  Dog  Pasta\tdog '),
+            'dog pasta dog')
+
+    def test_text_only(self):
+        """Test plain dictation"""
+        plan = self.executor.compile_utterance('hello there')
+        self.assertEqual(plan.segments, (TextSegment('hello there'),))
+
+    def test_mixed(self):
+        """Test text, then a command, then more text"""
+        plan = self.executor.compile_utterance(
+            'hello dog 3 times page down dog there')
+        self.assertEqual(plan.segments, (
+            TextSegment('hello'),
+            CommandSegment((ResolvedCommand('page down', 3, None),), 0.1),
+            TextSegment('there'),
+        ))
+
+    def test_multiple_commands(self):
+        """Test multiple commands in one command segment, with args"""
+        plan = self.executor.compile_utterance(
+            'dog pasta, snake foo bar')
+        self.assertEqual(plan.segments, (
+            CommandSegment((
+                ResolvedCommand('pasta', 1, None),
+                ResolvedCommand('snake', 1, 'foo bar'),
+            ), 0.0),
+        ))
+
+    def test_get_plan_cached(self):
+        """Test that repeated utterances reuse the same plan"""
+        plan = self.executor.get_plan('dog pasta dog')
+        self.assertIs(self.executor.get_plan('dog pasta dog'), plan)
+
+    def test_get_plan_new_snapshot(self):
+        """Test that plans from an old registry snapshot aren't reused"""
+        plan = self.executor.get_plan('dog pasta dog')
+        self.executor.cmd_exec = CommandDispatcher(
+            CommandRegistry(commands_def, None), ActionHistory())
+        new_plan = self.executor.get_plan('dog pasta dog')
+        self.assertIsNot(new_plan, plan)
+        self.assertIs(new_plan.cmd_exec, self.executor.cmd_exec)
+
+
+class TestPlanCache(unittest.TestCase):
+    """Test the LRU plan cache"""
+
+    def test_eviction(self):
+        """Test that the least recently used plan is evicted"""
+        cache = PlanCache(maxsize=2)
+        for utterance in ['a', 'b']:
+            cache.put(UtterancePlan(utterance, (), None))
+        # touch 'a' so 'b' becomes the oldest
+        cache.get('a')
+        cache.put(UtterancePlan('c', (), None))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_clear(self):
+        """Test clearing the cache"""
+        cache = PlanCache()
+        cache.put(UtterancePlan('a', (), None))
+        cache.clear()
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
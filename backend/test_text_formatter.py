@@ -1,6 +1,8 @@
 import unittest
 
+from backend.text import TextWriter
 from backend.text_formatter import PlainTextFormatter, CodeTextFormatter
+from ui.kb_controller import KBCntrlrWrapperManager
 
 class TestPlainTextFormatter(unittest.TestCase):
     """Test basic text formatter stuff"""
@@ -16,12 +18,62 @@ class TestPlainTextFormatter(unittest.TestCase):
         out = self.formatter.format(the_text)
         self.assertEqual(out, out_expect)
 
+    def test_stages(self):
+        """Test the token stages, and that they get timed"""
+        the_text = 'spacebar n a s a all caps rocks capital bob new ' \
+            'chimney variable chimney name'
+        out_expect = ' nasa ROCKS Bob newVariableName'
+        out = self.formatter.format(the_text)
+        self.assertEqual(out, out_expect)
+        stats = self.formatter.stage_timings.stats()
+        self.assertEqual(stats['camel_case']['runs'], 1)
+        self.assertIn('closures', stats)
+
+    def test_close_paren_ends_utterance(self):
+        """Test that a ) at the end doesn't eat the next utterance's space"""
+        self.assertEqual(self.formatter.format('see (figure one)'),
+            ' see(figure one)')
+        self.assertEqual(self.formatter.format('for details'), ' for details')
+
+    def test_stage_config(self):
+        """Test leaving out and reordering stages"""
+        formatter = PlainTextFormatter(['camel_case', 'compress_letters'])
+        self.assertEqual(formatter.format('a chimney b c'), ' aB c')
+        formatter = PlainTextFormatter(['compress_letters', 'camel_case'])
+        self.assertEqual(formatter.format('a chimney b c'), ' aBc')
+        with self.assertRaises(ValueError):
+            PlainTextFormatter(['carrier pigeon'])
+
 class TestCodeTextFormatter(unittest.TestCase):
     """Test basic text formatter stuff"""
 
     def setUp(self):
         self.formatter = CodeTextFormatter()
 
+    def test_format_python(self):
+        """Test symbols, keywords and identifier casing"""
+        self.assertEqual(self.formatter.format('define get thing open paren '
+            'self comma item count close paren colon'),
+            'def get_thing(self, item_count):')
+        self.assertEqual(self.formatter.format('else if pascal my widget '
+            'not equals none'), ' elif MyWidget != None')
+
+    def test_format_javascript(self):
+        """Test another language's tables on top of the common ones"""
+        self.formatter.set_language('javascript')
+        self.assertEqual(self.formatter.format('const total count equals '
+            'not is done and x triple equals null semicolon'),
+            'const totalCount = !isDone && x === null;')
+        with self.assertRaises(ValueError):
+            self.formatter.set_language('cobol')
+
+    def test_strings(self):
+        """Test that words in strings are typed as they are, even across
+        utterances"""
+        self.assertEqual(self.formatter.format('x equals quote hello define'),
+            'x = "hello define')
+        self.assertEqual(self.formatter.format('world quote'), ' world"')
+
     def test_fix_closures_double_quote(self):
         """Test closures with double quotes"""
         the_text = 'what " the blah " hey donkey " blood "'
@@ -49,6 +101,24 @@ class TestCodeTextFormatter(unittest.TestCase):
         out_expect = "what(the blah(hey donkey)blood)"
         out = self.formatter.fix_closures(the_text)
         self.assertEqual(out, out_expect)
-    
+
+class TestTextWriterMode(unittest.TestCase):
+    """Test switching which formatter the text writer uses"""
+
+    def setUp(self):
+        self.kb_cntrl_mngr = KBCntrlrWrapperManager(backend='recording')
+        self.kb_cntrl_wrapper = self.kb_cntrl_mngr.get_kb_cntrl_wrapper()
+
+    def test_code_mode(self):
+        """Test switching the text writer over to code"""
+        text_writer = TextWriter(self.kb_cntrl_wrapper, pacing_profile='none')
+        text_writer.set_mode('code')
+        action = text_writer.dispatch('my list dot append open paren 3 '
+            'close paren')
+        self.assertEqual(action.text, 'my_list.append(3)')
+        text_writer.set_mode('plaintext')
+        with self.assertRaises(ValueError):
+            text_writer.set_mode('carrier pigeon')
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from backend.trace import (TraceRing, Tracer, dump_trace, get_tracer,
+    parse_level, set_trace_levels, trace_ring)
+
+class TestTrace(unittest.TestCase):
+    """Test recording trace events into the ring"""
+
+    def test_ring_wraps(self):
+        """Test that the ring keeps the latest events, oldest first"""
+        ring = TraceRing(size=4)
+        tracer = Tracer('test', ring, parse_level('debug'))
+        for index in range(6):
+            tracer.debug('event', index)
+        self.assertEqual([event[-1] for event in ring.events()],
+            [(2,), (3,), (4,), (5,)])
+        ring.clear()
+        self.assertEqual(ring.events(), [])
+
+    def test_levels(self):
+        """Test that events below a subsystem's level aren't recorded"""
+        ring = TraceRing(size=4)
+        tracer = Tracer('test', ring, parse_level('INFO'))
+        tracer.debug('hidden')
+        tracer.info('shown', 'hello')
+        tracer.level = parse_level('off')
+        tracer.info('hidden')
+        self.assertEqual([event[4] for event in ring.events()], ['shown'])
+        with self.assertRaises(ValueError):
+            parse_level('carrier pigeon')
+
+    def test_set_levels_and_dump(self):
+        """Test setting levels from config, and dumping the ring to a file"""
+        self.addCleanup(set_trace_levels)
+        tracer = get_tracer('test dump')
+        set_trace_levels({'test dump': 'debug'})
+        self.assertIs(get_tracer('test dump'), tracer)
+        tracer.debug('dumped', 'some text', 3)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = dump_trace(os.path.join(temp_dir, 'trace.log'))
+            with open(file_path) as f:
+                lines = f.read().splitlines()
+        self.assertEqual(len(lines), len(trace_ring.events()))
+        self.assertIn("DEBUG test dump  dumped 'some text' 3", lines[-1])
+
+if __name__ == '__main__':
+    unittest.main()
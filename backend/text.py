@@ -1,47 +1,66 @@
 import logging
-import time
 
-from pynput.keyboard import Controller, Key
+from pynput.keyboard import Controller
 
+from backend.file_utils import unyaml_thing
 from backend.manager import event_mngr
-from backend.text_formatter import PlainTextFormatter, CodeTextFormatter
-from backend.actions import Action
+from backend.pacing import (DEFAULT_PACING_PROFILE, PacingProfile, 
+    add_paced_text, load_pacing_profiles)
+from backend.text_formatter import (DEFAULT_CODE_LANGUAGE,
+    PlainTextFormatter, CodeTextFormatter)
+from backend.actions import Action, UndoPlan
+from backend.trace import get_tracer
 from ui.kb_controller import KBCntrlrWrapper
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+tracer = get_tracer('text')
+
+config = unyaml_thing('config.yaml')
+
+# the pacing profile to type with, see pacing.yml
+PACING_PROFILE = config.get('pacing_profile', DEFAULT_PACING_PROFILE)
 
 # formatters four different modes of the text writer
 formatters = {
-    'plaintext': PlainTextFormatter(),
-    'code': CodeTextFormatter()
+    'plaintext': PlainTextFormatter(config.get('plaintext_format_stages')),
+    # the language's tables only get loaded once something's dictated in it
+    'code': CodeTextFormatter(config.get('code_language', 
+        DEFAULT_CODE_LANGUAGE))
 }
 
 class TextWriteAction(Action):
     """Action for writing text
     """
+    __slots__ = ('text', '_kb_controller', 'word_jumps')
 
-    def __init__(self, text: str, kb_controller: KBCntrlrWrapper):
+    def __init__(self, text: str, kb_controller: KBCntrlrWrapper,
+            word_jumps: bool = False):
         """Init
 
         Args:
             text: the text written by this action
+            kb_controller: the keyboard controller it was written with
+            word_jumps: whether undo can delete whole words at a time, see 
+                UndoPlan
         """
         self.text = text
         self._kb_controller = kb_controller
+        self.word_jumps = word_jumps
 
-    def undo(self) -> bool:
+    def undo_into(self, plan: UndoPlan) -> bool:
         """Undo the text writing action
 
         Deletes all the characters written
 
+        Args:
+            plan: see Action.undo_into()
+
         Returns:
             True, because this action is "substantial". See
                 documentation for Action() for more information
         """
-        logger.debug('TextWriteAction: undo, deleting text {}'.format(self.text))
-        for char in self.text: #pylint: disable=unused-variable
-            self._kb_controller.tap(Key.backspace)
+        tracer.debug('undo_text', self.text)
+        plan.delete(self.text, self._kb_controller, self.word_jumps)
         return True
 
 class TextWriter:
@@ -50,11 +69,44 @@ class TextWriter:
     # the different text formatting modes
     MODES = ['code', 'plaintext']
 
-    def __init__(self, kb_controller: KBCntrlrWrapper):
+    def __init__(self, kb_controller: KBCntrlrWrapper, 
+            pacing_profile: str = PACING_PROFILE):
+        """Init
+
+        Args:
+            kb_controller: the keyboard controller to type with
+            pacing_profile: name of the pacing profile to type with, see 
+                pacing.yml
+        """
         self._kb_controller = kb_controller
         # start in plain text mode
         self.mode = 'plaintext'
 
+        self._pacing_profiles = load_pacing_profiles()
+        self.pacing_profile: PacingProfile = None
+        self.set_pacing_profile(pacing_profile)
+
+    def set_mode(self, mode: str):
+        """Switch to a different text formatting mode
+
+        Args:
+            mode: one of MODES
+        """
+        if mode not in self.MODES:
+            raise ValueError(f'Unknown text mode "{mode}", should be one of '
+                f'{self.MODES}')
+        self.mode = mode
+
+    def set_pacing_profile(self, name: str):
+        """Switch to a different pacing profile, e.g. for a different app
+
+        Args:
+            name: the profile name, see pacing.yml
+        """
+        if name not in self._pacing_profiles:
+            raise ValueError(f'Unknown pacing profile "{name}"')
+        self.pacing_profile = self._pacing_profiles[name]
+
     def dispatch(self, raw: str) -> Action:
         """write some text out
 
@@ -65,35 +117,27 @@ class TextWriter:
         Returns:
             an action
         """
-        logger.debug("Raw text: '%s'", raw)
 
         curr_formatter = formatters[self.mode]
         formatted = curr_formatter.format(raw)
 
-        # special format characters that need some sleep time added in
-        special_format_chars = ['`', '}']
-
-        logger.debug("Typing: '%s'", formatted)
-        next_iter_do_sleep = False
-        for char in formatted:
-            # insert some sleep so we can trigger the application in which the typing is being done to format correctly
-            # for example, if we just spit out all the text at once, in slack
-            # we could end up with the literal "`blah`" instead of "<blah
-            # formatted as code>"
-            if next_iter_do_sleep:
-                # time.sleep(0.1) # this is sufficient for slack
-                time.sleep(0.2) # but need this for atlassian confluence
-                next_iter_do_sleep = False
-            if char in special_format_chars:
-                next_iter_do_sleep = True
-            self._kb_controller.tap(char)
+        tracer.info('type', raw, formatted, self.mode)
+        # the whole lot goes over to the keyboard controller in one go (or a
+        # few, for really long text), rather than a message per character. 
+        # Any pauses the app needs (see pacing.yml) are part of the batch, so
+        # we don't wait on them here
+        with self._kb_controller.batch() as batch:
+            add_paced_text(batch, formatted, self.pacing_profile)
 
         ## clear user action state
-        # note we need to do this after typing out anything with the
-        # keyboard controller!
+        # note we need to do this after sending anything to the keyboard
+        # controller! It may well not have typed it yet, but the keyboard
+        # listener knows not to take the keys it types for the user's (see
+        # InjectionWindow)
         event_mngr.mouse_clicked.clear()
         event_mngr.mouse_doubleclicked.clear()
         event_mngr.key_pressed.clear()
         event_mngr.saw_manual_sentence_end.clear()
 
-        return TextWriteAction(formatted, self._kb_controller)
+        return TextWriteAction(formatted, self._kb_controller,
+            self.pacing_profile.word_jumps)
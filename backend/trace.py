@@ -0,0 +1,233 @@
+"""Structured tracing into an in-memory ring buffer, for the hot paths
+
+Logging every word to stderr at DEBUG costs string formatting and I/O on
+every utterance. Instead, the formatter, executor and commands record trace
+events: a timestamp, the subsystem, an event name and the raw arguments, put
+into a slot of a preallocated ring buffer. Nothing gets formatted until the
+ring is dumped (see dump_trace(), e.g. from the tray menu), and a subsystem
+traced below its level costs one comparison.
+
+Each subsystem has its own level (see set_trace_levels(), and trace_levels in
+config.yaml), as does each logger (see set_log_levels(), and log_levels).
+
+    tracer = get_tracer('executor')
+    tracer.debug('got', raw_utterance)
+"""
+
+from datetime import datetime
+import itertools
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# number of trace events kept, the oldest get overwritten
+TRACE_RING_SIZE = 4096
+
+# level names for config -> levels, the same as logging's
+LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+    # record nothing
+    'off': logging.CRITICAL + 1,
+}
+
+# what gets traced for subsystems that config doesn't mention
+DEFAULT_TRACE_LEVEL = 'info'
+
+# logger name -> level, for loggers that config doesn't mention. Loggers
+# below these (e.g. backend.executor) go by them too
+DEFAULT_LOG_LEVELS = {
+    '__main__': 'info',
+    'backend': 'info',
+    'ui': 'info',
+}
+
+# a trace event: time.time(), sequence number, subsystem, level, event name,
+# and the arguments, unformatted
+TraceEvent = Tuple[float, int, str, int, str, Tuple[Any, ...]]
+
+def parse_level(level: str) -> int:
+    """Get the level for a level name from config
+
+    Args:
+        level: one of LEVELS, any case
+
+    Raises:
+        ValueError: if there's no such level
+
+    Returns:
+        the level
+    """
+    try:
+        return LEVELS[str(level).lower()]
+    except KeyError as e:
+        raise ValueError(f'Unknown level "{level}", should be one of '
+            f'{list(LEVELS)}') from e
+
+class TraceRing:
+    """Fixed size buffer of the latest trace events
+
+    Safe to record into from any thread: the sequence number comes from an
+    itertools.count, and storing into a list slot is atomic.
+
+    Args:
+        size: number of events kept
+    """
+
+    def __init__(self, size: int = TRACE_RING_SIZE):
+        self._size = size
+        self._slots: List[Optional[TraceEvent]] = [None] * size
+        self._sequence = itertools.count()
+
+    def record(self, subsystem: str, level: int, event: str,
+            args: Tuple[Any, ...]):
+        """Record an event, overwriting the oldest one if the ring's full
+
+        Args:
+            subsystem: what it's from
+            level: how important it is
+            event: what happened
+            args: anything that goes with it. Kept as is, so shouldn't be
+                changed afterwards
+        """
+        sequence = next(self._sequence)
+        self._slots[sequence % self._size] = (time.time(), sequence,
+            subsystem, level, event, args)
+
+    def events(self) -> List[TraceEvent]:
+        """The events in the ring
+
+        Returns:
+            the events, oldest first
+        """
+        return sorted((slot for slot in self._slots if slot is not None),
+            key=lambda slot: slot[1])
+
+    def clear(self):
+        """Throw away all the events
+        """
+        self._slots = [None] * self._size
+
+class Tracer:
+    """Records trace events for one subsystem, see module docs
+
+    Args:
+        subsystem: the subsystem's name
+        ring: where to record to
+        level: events below this level aren't recorded
+    """
+    __slots__ = ('subsystem', 'level', '_ring')
+
+    def __init__(self, subsystem: str, ring: TraceRing, level: int):
+        self.subsystem = subsystem
+        self.level = level
+        self._ring = ring
+
+    def debug(self, event: str, *args: Any):
+        """Record a debug level event
+
+        Args:
+            event: what happened
+            args: anything that goes with it
+        """
+        if self.level <= logging.DEBUG:
+            self._ring.record(self.subsystem, logging.DEBUG, event, args)
+
+    def info(self, event: str, *args: Any):
+        """Record an info level event
+
+        Args:
+            event: what happened
+            args: anything that goes with it
+        """
+        if self.level <= logging.INFO:
+            self._ring.record(self.subsystem, logging.INFO, event, args)
+
+# the trace ring everything records to
+trace_ring = TraceRing()
+# subsystem name -> its tracer
+_tracers: Dict[str, Tracer] = {}
+# subsystem name -> level, from config
+_trace_levels: Dict[str, int] = {}
+
+def get_tracer(subsystem: str) -> Tracer:
+    """Get the tracer for a subsystem
+
+    Args:
+        subsystem: the subsystem's name, e.g. 'executor'
+
+    Returns:
+        the tracer. The same one every time, so it's fine to keep
+    """
+    tracer = _tracers.get(subsystem)
+    if tracer is None:
+        tracer = Tracer(subsystem, trace_ring, _trace_levels.get(subsystem,
+            parse_level(DEFAULT_TRACE_LEVEL)))
+        _tracers[subsystem] = tracer
+    return tracer
+
+def set_trace_levels(levels: Optional[Dict[str, str]] = None):
+    """Set the level each subsystem gets traced at
+
+    Args:
+        levels: subsystem name -> level name (see LEVELS). Subsystems not in
+            here go back to DEFAULT_TRACE_LEVEL
+
+    Raises:
+        ValueError: if there's no such level
+    """
+    _trace_levels.clear()
+    for subsystem, level in (levels or {}).items():
+        _trace_levels[subsystem] = parse_level(level)
+    for subsystem, tracer in _tracers.items():
+        tracer.level = _trace_levels.get(subsystem,
+            parse_level(DEFAULT_TRACE_LEVEL))
+
+def set_log_levels(levels: Optional[Dict[str, str]] = None):
+    """Set the level of each logger, rather than all of them being at DEBUG
+
+    Args:
+        levels: logger name (e.g. 'backend.executor') -> level name (see
+            LEVELS), on top of DEFAULT_LOG_LEVELS
+
+    Raises:
+        ValueError: if there's no such level
+    """
+    for name, level in {**DEFAULT_LOG_LEVELS, **(levels or {})}.items():
+        logging.getLogger(name).setLevel(parse_level(level))
+
+def format_trace_event(trace_event: TraceEvent) -> str:
+    """Format a trace event as a line of text
+
+    Args:
+        trace_event: the event
+
+    Returns:
+        the line, without a newline
+    """
+    timestamp, sequence, subsystem, level, event, args = trace_event
+    when = datetime.fromtimestamp(timestamp).strftime('%H:%M:%S.%f')[:-3]
+    return f'{when} {sequence:>8} {logging.getLevelName(level):<5} ' \
+        f'{subsystem:<10} {event} {" ".join(repr(arg) for arg in args)}'
+
+def dump_trace(file_path: Optional[str] = None) -> str:
+    """Write out everything in the trace ring, oldest first
+
+    Args:
+        file_path: where to write it. If None, a new file in the current
+            directory, named for the time
+
+    Returns:
+        the path written to
+    """
+    if file_path is None:
+        file_path = datetime.now().strftime('trace-%Y%m%d-%H%M%S.log')
+    with open(file_path, 'w') as f:
+        for trace_event in trace_ring.events():
+            f.write(format_trace_event(trace_event) + '\n')
+    logger.info('Dumped trace to %s', file_path)
+    return file_path
@@ -9,7 +9,6 @@ import websockets
 from backend.manager import app_mngr
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 def do_webspeech(
         raw_stt_output_q: Queue,
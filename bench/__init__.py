@@ -0,0 +1 @@
+# benchmarks, run from the repo root like: python -m bench.bench_parse
@@ -0,0 +1,85 @@
+"""Benchmark for fixing the whitespace around closures in long passages
+
+Run from the repo root:
+    python -m bench.bench_closures
+
+Makes dictated passages of a few kilobytes, full of quotes, backticks and
+parentheses, and times fixing them:
+- index list: the way TextFormatter.fix_closures used to, checking each char
+  against a list of indices to remove, so quadratic in the length
+- fixer: ClosureFixer, which should be linear
+"""
+
+import random
+import timeit
+
+from backend.closures import ClosureFixer
+
+# passage lengths to try, in characters
+LENGTHS = [1000, 4000, 16000]
+
+WORDS = ['the', 'quick', 'brown', 'fox', 'jumps', 'over', 'lazy', 'dog',
+    '"', "'", '`', '(', ')']
+
+
+def fix_by_index_list(input_text: str) -> str:
+    """The way TextFormatter.fix_closures used to do it"""
+    opens = {'`': True, '"': True, "'": True}
+    remove_whitespace_indcs = []
+    for ichar, char in enumerate(input_text):
+        if char in opens:
+            remove_whitespace_indcs.append(
+                ichar + 1 if opens[char] else ichar - 1)
+            opens[char] = not opens[char]
+        if char == '(':
+            remove_whitespace_indcs.append(ichar + 1)
+        if char == ')':
+            remove_whitespace_indcs.append(ichar - 1)
+    return ''.join(char for ichar, char in enumerate(input_text)
+        if ichar not in remove_whitespace_indcs or char != ' ')
+
+
+def make_passage(length: int, rng: random.Random) -> str:
+    """Make a passage of dictated text, with closures, of about the given
+    length
+
+    Args:
+        length: number of characters
+        rng: random number generator
+
+    Returns:
+        the text
+    """
+    words = []
+    num_chars = 0
+    while num_chars < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        num_chars += len(word) + 1
+    return ' '.join(words)
+
+
+def main():
+    rng = random.Random(0)
+    fixer = ClosureFixer()
+
+    def fix(passage):
+        fixer.reset()
+        return fixer.fix(passage)
+
+    print(f'{"chars":>6} {"closures":>9} {"method":>10} {"ms / passage":>13}')
+    for length in LENGTHS:
+        passage = make_passage(length, rng)
+        num_closures = sum(passage.count(char) for char in '"\'`()')
+        assert fix(passage) == fix_by_index_list(passage)
+        for name, method in [('index list', fix_by_index_list),
+                ('fixer', fix)]:
+            number = 3 if method is fix_by_index_list else 100
+            best = min(timeit.repeat(lambda: method(passage), number=number, # pylint: disable=cell-var-from-loop
+                repeat=3))
+            print(f'{length:>6} {num_closures:>9} {name:>10} '
+                f'{best / number * 1e3:>13.3f}')
+
+
+if __name__ == '__main__':
+    main()
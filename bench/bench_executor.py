@@ -0,0 +1,115 @@
+"""Throughput benchmark for the whole utterance path, without a keyboard
+
+Run from the repo root:
+    python -m bench.bench_executor [--backend null|recording] [--number N]
+
+Sets up the executor against a headless keyboard controller (see
+KBCntrlrWrapperManager) with the real commands file, then pushes a mix of
+dictation, commands and both through Executor.parse_and_execute(). Reports
+overall throughput, and the time spent in each stage:
+- parse: normalizing and compiling the utterance into a plan, with the plan
+    cache cleared every time
+- parse (cached): the same, but with the plan cache warm
+- execute: formatting and typing the text, and executing the commands
+"""
+
+import argparse
+import logging
+import time
+
+from backend.executor import Executor
+from ui.kb_controller import KBCntrlrWrapperManager
+
+# default number of utterances to push through
+NUMBER = 20000
+
+# a mix of what gets said. Nothing in here that settles (e.g. 'tabitha') or
+# waits on the app, since that's just sleeping
+UTTERANCES = [
+    'hello there how are you doing today',
+    'this is a longer bit of dictation, with a comma and a full stop period',
+    'dog page down dog',
+    'dog 3 times page down dog',
+    'dog snake foo bar baz dog',
+    'some text dog enter dog more text after the command',
+    'dog git status dog',
+    'dog pasta, right, left dog',
+    'dog title the quick brown fox dog',
+    'ok',
+]
+
+
+def time_stage(stage, utterances, number):
+    """Time one stage over the utterances
+
+    Args:
+        stage: callable taking a raw utterance
+        utterances: the raw utterances, cycled through
+        number: total number of calls to make
+
+    Returns:
+        total time taken, in seconds
+    """
+    num_utterances = len(utterances)
+    start = time.perf_counter()
+    for i in range(number):
+        stage(utterances[i % num_utterances])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', default='null',
+        choices=['null', 'recording'])
+    parser.add_argument('--number', type=int, default=NUMBER,
+        help='number of utterances per stage')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    kb_cntrl_mngr = KBCntrlrWrapperManager(backend=args.backend)
+    kb_cntrl_mngr.start()
+    executor = Executor()
+    executor.setup(kb_cntrl_mngr)
+
+    # pylint: disable=protected-access
+    def parse_cold(raw_utterance):
+        executor._plan_cache.clear()
+        executor.prepare(raw_utterance)
+
+    plans = [executor.prepare(utterance) for utterance in UTTERANCES]
+
+    def execute(plan):
+        executor.execute_plan(plan)
+        # don't let the history grow without bound
+        executor.history.utterance_history.clear()
+
+    def parse_and_execute(raw_utterance):
+        executor.parse_and_execute(raw_utterance)
+        executor.history.utterance_history.clear()
+
+    stages = [
+        ('parse', parse_cold, UTTERANCES),
+        ('parse (cached)', executor.prepare, UTTERANCES),
+        ('execute', execute, plans),
+        ('parse_and_execute', parse_and_execute, UTTERANCES),
+    ]
+    print(f'{args.number} utterances per stage, {args.backend} backend')
+    print(f'{"stage":>18} {"us / utterance":>15} {"utterances / s":>15}')
+    for name, stage, inputs in stages:
+        if kb_cntrl_mngr.backend == 'recording':
+            kb_cntrl_mngr.controller.clear()
+        elapsed = time_stage(stage, inputs, args.number)
+        print(f'{name:>18} {elapsed / args.number * 1e6:>15.1f} '
+            f'{args.number / elapsed:>15.0f}')
+
+    if kb_cntrl_mngr.backend == 'recording':
+        num_events = len(kb_cntrl_mngr.controller.events)
+        print(f'keyboard events per utterance: {num_events / args.number:.1f}')
+
+    kb_cntrl_mngr.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Micro-benchmark for replacing fixed text patterns as the table grows
+
+Run from the repo root:
+    python -m bench.bench_format
+
+Takes the patterns from replace_patterns.yml, plus however many synthetic
+ones, and times replacing them in a fixed set of utterances:
+- one by one: a str.replace() per pattern, the way TextFormatter used to
+- automaton: FixedPatternReplacer, which should stay flat no matter how many
+  patterns there are
+Then formats the utterances with PlainTextFormatter, and shows how long each
+stage of that takes (see PlainTextFormatter.stage_timings).
+"""
+
+import logging
+import random
+import timeit
+
+from backend.fixed_patterns import FixedPatternReplacer
+from backend.text_formatter import PlainTextFormatter
+
+# numbers of synthetic patterns to add to the real ones
+EXTRA_PATTERNS = [0, 100, 1000]
+
+# number of utterances replaced per timing run
+NUMBER = 20000
+
+UTTERANCES = [
+    ' hello there',
+    ' i think that we should go to the store and buy some milk',
+    ' open paren hello donkey world close paren quote hi quote',
+    ' the quick brown fox jumps over the lazy dog and then some more '
+        'stuff happens to the fox and the dog, i think',
+]
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa',
+    'qui', 'bel', 'dor', 'fen', 'gur', 'hox']
+
+
+def replace_one_by_one(patterns, the_text):
+    """A str.replace() for each pattern, in order"""
+    for orig, replace in patterns.items():
+        the_text = the_text.replace(orig, replace)
+    return the_text
+
+
+def make_patterns(base, num_extra: int, rng: random.Random):
+    """Add synthetic patterns to the end of a pattern table
+
+    Args:
+        base: the real pattern table
+        num_extra: number of patterns to add
+        rng: random number generator
+
+    Returns:
+        the bigger table
+    """
+    patterns = dict(base)
+    while len(patterns) < len(base) + num_extra:
+        orig = ' '.join(
+            ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))
+            for _ in range(rng.randint(1, 3)))
+        patterns.setdefault(orig, orig.upper())
+    return patterns
+
+
+def main():
+    logging.disable(logging.INFO)
+    rng = random.Random(0)
+    base = PlainTextFormatter()._fixed_replace_patterns # pylint: disable=protected-access
+
+    print(f'{"patterns":>8} {"method":>11} {"us / utt":>9}')
+    for num_extra in EXTRA_PATTERNS:
+        patterns = make_patterns(base, num_extra, rng)
+        replacer = FixedPatternReplacer(patterns)
+        methods = [
+            ('one by one', lambda text: replace_one_by_one(patterns, text)), # pylint: disable=cell-var-from-loop
+            ('automaton', replacer.replace),
+        ]
+        for name, method in methods:
+            def replace_all():
+                for utterance in UTTERANCES:
+                    method(utterance) # pylint: disable=cell-var-from-loop
+
+            best = min(timeit.repeat(replace_all,
+                number=NUMBER // len(UTTERANCES), repeat=5))
+            print(f'{len(patterns):>8} {name:>11} '
+                f'{best / NUMBER * 1e6:>9.2f}')
+
+    formatter = PlainTextFormatter()
+    for _ in range(NUMBER // len(UTTERANCES)):
+        for utterance in UTTERANCES:
+            formatter.format(utterance)
+    print()
+    print(f'{"stage":>16} {"us / utt":>9} {"max us":>9}')
+    for name, stats in formatter.stage_timings.stats().items():
+        print(f'{name:>16} {stats["total_s"] / stats["runs"] * 1e6:>9.2f} '
+            f'{stats["max_s"] * 1e6:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
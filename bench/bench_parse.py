@@ -0,0 +1,94 @@
+"""Micro-benchmark for command parsing as the command registry grows
+
+Run from the repo root:
+    python -m bench.bench_parse
+
+Builds registries of synthetic multi-word command names (plus a handful of
+real ones) and times CommandDispatcher.parse() on a fixed set of commands.
+Parse cost should stay flat no matter how many names are registered.
+"""
+
+import logging
+import random
+import timeit
+
+from backend.actions import ActionHistory
+from backend.commands import CommandDispatcher, CommandRegistry
+
+# registry sizes to try
+REGISTRY_SIZES = [50, 500, 5000, 50000]
+
+# number of parse() calls per timing run
+NUMBER = 20000
+
+# commands to parse, all of which are in every registry
+COMMAND_TEXTS = [
+    'page down',
+    '12 times page down',
+    'snake slim shady foo',
+    'git add all',
+    'three x open the pod bay doors',
+]
+
+REAL_COMMANDS = [
+    {'name': 'page down', 'command_type': 'keystroke',
+        'kwargs': {'keys': ['page_down']}},
+    {'name': 'git add all', 'command_type': 'type',
+        'kwargs': {'content': 'git add --all'}},
+    {'name': 'open the pod bay doors', 'command_type': 'type',
+        'kwargs': {'content': "I'm afraid I can't do that"}},
+    {'name': 'snake', 'command_type': 'case',
+        'kwargs': {'case': 'snake', 'in_place': False}},
+]
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa',
+    'qui', 'bel', 'dor', 'fen', 'gur', 'hox']
+
+
+def make_commands_def(num_names: int, rng: random.Random):
+    """Make a commands definition with num_names names in it
+
+    Args:
+        num_names: total number of command names
+        rng: random number generator
+
+    Returns:
+        the commands definition
+    """
+    commands_def = list(REAL_COMMANDS)
+    names = set(command['name'] for command in commands_def)
+    while len(names) < num_names:
+        num_words = rng.randint(1, 5)
+        name = ' '.join(
+            ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))
+            for _ in range(num_words))
+        if name in names:
+            continue
+        names.add(name)
+        commands_def.append({'name': name, 'command_type': 'keystroke',
+            'kwargs': {'keys': ['a']}})
+    return commands_def
+
+
+def main():
+    logging.disable(logging.INFO)
+    rng = random.Random(0)
+
+    print(f'{"names":>8} {"trie nodes":>11} {"us / parse":>11}')
+    for num_names in REGISTRY_SIZES:
+        cmd_reg = CommandRegistry(make_commands_def(num_names, rng), None)
+        dispatcher = CommandDispatcher(cmd_reg, ActionHistory())
+
+        def parse_all():
+            for command_text in COMMAND_TEXTS:
+                dispatcher.parse(command_text)
+
+        best = min(timeit.repeat(parse_all, number=NUMBER // len(COMMAND_TEXTS),
+            repeat=5))
+        us_per_parse = best / NUMBER * 1e6
+        print(f'{num_names:>8} {cmd_reg._cmd_trie.num_nodes:>11} ' # pylint: disable=protected-access
+            f'{us_per_parse:>11.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Benchmark for getting typed text over to the keyboard controller process
+
+Run from the repo root:
+    python -m bench.bench_typing
+
+Types paragraphs of a few lengths through a keyboard controller process
+running the null controller (see KBCntrlrWrapperManager), so what's measured
+is the cost of pickling and piping commands across, not of injecting them.
+Compares:
+- per char: a tap() message per character, the way TextWriter used to
+- batched: TextWriter.dispatch(), which sends batches (see KBCntrlBatch)
+over both transports: a multiprocessing.Queue, and the shared memory ring
+(see ui.kb_ring).
+End-to-end time is until the controller process has acknowledged a barrier
+sent after the text.
+"""
+
+import logging
+import time
+
+from backend.text import TextWriter
+from ui.kb_controller import TRANSPORTS, KBCntrlrWrapperManager
+
+# paragraph lengths to try, in characters
+LENGTHS = [30, 300, 3000]
+
+# number of paragraphs typed per timing run
+NUMBER = 20
+
+WORDS = ['the', 'quick', 'brown', 'fox', 'jumps', 'over', 'lazy', 'dog',
+    'and', 'then', 'some']
+
+
+def make_paragraph(length: int) -> str:
+    """Make some plain dictated text of about the given length
+
+    Args:
+        length: number of characters
+
+    Returns:
+        the text
+    """
+    words = []
+    num_chars = 0
+    while num_chars < length:
+        word = WORDS[len(words) % len(WORDS)]
+        words.append(word)
+        num_chars += len(word) + 1
+    return ' '.join(words)
+
+
+def main():
+    logging.disable(logging.INFO)
+
+    print(f'{"transport":>9} {"chars":>6} {"method":>9} {"msgs / utt":>11} '
+        f'{"ms / utt":>9}')
+    for transport in TRANSPORTS:
+        kb_cntrl_mngr = KBCntrlrWrapperManager(backend='null_process',
+            transport=transport)
+        kb_cntrl_mngr.start()
+        kb_cntrl_wrapper = kb_cntrl_mngr.get_kb_cntrl_wrapper()
+        text_writer = TextWriter(kb_cntrl_wrapper)
+
+        def type_per_char(text):
+            for char in text:
+                kb_cntrl_wrapper.tap(char) # pylint: disable=cell-var-from-loop
+
+        methods = [
+            ('per char', type_per_char),
+            ('batched', text_writer.dispatch),
+        ]
+
+        for length in LENGTHS:
+            paragraph = make_paragraph(length)
+            for name, method in methods:
+                kb_cntrl_wrapper.barrier()
+                messages_before = kb_cntrl_wrapper.messages_sent
+                start = time.perf_counter()
+                for _ in range(NUMBER):
+                    method(paragraph)
+                kb_cntrl_wrapper.barrier()
+                elapsed = time.perf_counter() - start
+                # don't count the barrier's own message
+                num_messages = kb_cntrl_wrapper.messages_sent - \
+                    messages_before - 1
+                print(f'{transport:>9} {length:>6} {name:>9} '
+                    f'{num_messages / NUMBER:>11.1f} '
+                    f'{elapsed / NUMBER * 1e3:>9.2f}')
+
+        stats = kb_cntrl_mngr.command_queue_stats()
+        if stats:
+            print(f'{transport:>9} queue stats: {stats}')
+        kb_cntrl_mngr.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -13,12 +13,14 @@ if plats_sys == 'Linux':
     from ui.app_indicator_linux import app_indicator_thread, gtk_main_thread
 if plats_sys == 'Darwin':
     from ui.app_indicator_mac import MenuBarManager
-from ui.keyboard import keyb_listener
+from ui.keyboard import kb_mngr, keyb_listener
 from ui.mouse import mouse_listener
 from backend.manager import app_mngr
 from backend.executor import executor_inst, do_executor
 from backend.webspeech import do_webspeech
-from ui.kb_controller import KBCntrlrWrapperManager
+from backend.file_utils import unyaml_thing
+from backend.trace import set_log_levels, set_trace_levels
+from ui.kb_controller import KBCntrlrWrapperManager, choose_backend
 
 WEBSPEECH_HOST='localhost'
 WEBSPEECH_PORT=5682
@@ -28,10 +30,14 @@ logging.basicConfig(format=form,
                     datefmt="%H:%M:%S")
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 class BetterDictateApp:
     def start(self):
+        config = unyaml_thing('config.yaml')
+        # rather than everything at DEBUG, see backend/trace.py
+        set_log_levels(config.get('log_levels'))
+        set_trace_levels(config.get('trace_levels'))
+
         logging.info('Starting up')
 
         # interactive stuff
@@ -46,8 +52,11 @@ class BetterDictateApp:
         mouse_listener.start()
 
         # create the keyboard controller manager and start it
-        self.kb_cntrl_mngr = KBCntrlrWrapperManager()
+        self.kb_cntrl_mngr = KBCntrlrWrapperManager(backend=choose_backend(
+            config.get('kb_controller_backend', 'auto')))
         self.kb_cntrl_mngr.start()
+        # so the keyboard listener can tell our own keys from the user's
+        kb_mngr.injection_window = self.kb_cntrl_mngr.injection_window
         
         if plats_sys == 'Darwin':
             # create the menu bar manager and start it
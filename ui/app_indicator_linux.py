@@ -15,6 +15,7 @@ from gi.repository import Gtk as gtk, AppIndicator3 as appindicator
 
 from backend.manager import app_mngr
 from backend.executor import executor_inst
+from backend.trace import dump_trace
 #pylint: enable=wrong-import-position
 
 abs_file_dir = path.dirname(path.abspath(__file__))
@@ -39,6 +40,12 @@ def reload_commands(_):
     """
     executor_inst.reload_commands()
 
+
+def do_dump_trace(_):
+    """Write out the recent trace events, see backend/trace.py
+    """
+    dump_trace()
+
 ## Setup menu and app indicator
 
 def menu() -> gtk.Menu:
@@ -57,6 +64,10 @@ def menu() -> gtk.Menu:
     menu_reload.connect('activate', reload_commands)
     the_menu.append(menu_reload)
 
+    menu_dump_trace = gtk.MenuItem(label='Dump trace')
+    menu_dump_trace.connect('activate', do_dump_trace)
+    the_menu.append(menu_dump_trace)
+
     the_menu.show_all()
     return the_menu
 
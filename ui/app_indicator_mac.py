@@ -14,13 +14,13 @@ from PyQt5.QtCore import QThread
 from PyQt5.QtWidgets import QApplication, QSystemTrayIcon, QMenu, QAction
 
 from backend.manager import app_mngr
+from backend.trace import dump_trace
 
 form = "%(asctime)s %(levelname)-8s %(name)-15s %(message)s"
 logging.basicConfig(format=form,
                     datefmt="%H:%M:%S")
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 abs_file_dir = path.dirname(path.abspath(__file__))
 
@@ -62,6 +62,7 @@ class UpdaterThread(QThread):
 # event names
 EV_TOGGLE_SLEEP = "toggle_sleep"
 EV_UI_QUIT = "ui_quit"
+EV_DUMP_TRACE = "dump_trace"
 
 # --- menu process ---
 
@@ -90,6 +91,12 @@ def menu_bar_job(menu_command_to_queue: Queue, menu_event_from_ui: Queue):
     switch_state.triggered.connect(lambda _checked=False: menu_event_from_ui.put(EV_TOGGLE_SLEEP))
     menu.addAction(switch_state)
 
+    # Add an option to write out the recent trace events. The trace lives in
+    # the manager's process, so this goes up as an event too
+    dump_trace_action = QAction("Dump trace")
+    dump_trace_action.triggered.connect(lambda _checked=False: menu_event_from_ui.put(EV_DUMP_TRACE))
+    menu.addAction(dump_trace_action)
+
     # add an empty action just to avoid accidentally hitting quit too much
     empty_action = QAction("-")
     menu.addAction(empty_action)
@@ -161,6 +168,8 @@ class MenuBarManager:
                     ev = self._menu_event_from_ui.get_nowait()
                     if ev == EV_TOGGLE_SLEEP:
                         app_mngr.toggle_sleep()
+                    elif ev == EV_DUMP_TRACE:
+                        dump_trace()
                     elif ev == EV_UI_QUIT:
                         app_mngr.signal_quit()
                         self._menu_command_to_queue.put('quit')
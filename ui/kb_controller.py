@@ -1,12 +1,19 @@
 ## this module essentially wraps the Controller object from pynput and runs it in a separate process
 # this was necessary to do because pynput doesn't work out of the box on MacOS
 
-from collections import namedtuple
+from collections import deque, namedtuple
 import contextlib
 import logging
 import multiprocessing
 from multiprocessing import Process, Queue
+import multiprocessing.connection
+import multiprocessing.queues
+import platform
+import queue
+from queue import Empty, Full
+import threading
 import time
+from typing import Callable, Dict, List, Sequence, Tuple
 
 from pynput.keyboard import Controller, Key
 
@@ -16,40 +23,726 @@ logging.basicConfig(format=form,
                     datefmt="%H:%M:%S")
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 # commands to be sent to the keyboard controller process
 KBCntrlCommand = namedtuple('KBCntrlCommand', 'name, payload')
 
-def pynp_kb_cntrl_job(command_queue: Queue):
+# default amount of time to wait for the keyboard controller process to 
+# acknowledge a barrier
+BARRIER_TIMEOUT_S = 5.0
+
+# the kinds of keyboard controller KBCntrlrWrapperManager can run, see its 
+# __init__()
+BACKENDS = ['process', 'null', 'recording', 'null_process', 'thread']
+
+# ways of getting commands over to a separate keyboard controller process,
+# see KBCntrlrWrapperManager.__init__()
+TRANSPORTS = ['ring', 'queue']
+
+# max number of operations in a single batch message, see KBCntrlBatch
+MAX_BATCH_OPS = 256
+
+# max number of times a macro gets run for one message, see 
+# KBCntrlrWrapper.run_macro(). The ring transport has 16 bits for it
+MAX_MACRO_COUNT = 0xFFFF
+
+# max number of messages waiting in the command queue, for the transports 
+# that count messages (the ring counts records, see ui.kb_ring)
+COMMAND_QUEUE_SIZE = 1024
+
+# how often the controller checks for an abort while waiting out a delay, in
+# seconds. About a frame
+ABORT_POLL_S = 0.01
+
+# max number of characters typed in one go, so that long 'type' commands can 
+# be aborted part way through
+TYPE_CHUNK_CHARS = 16
+
+# default amount of time to wait for the keyboard controller to finish what 
+# it's doing when shutting down, before throwing the rest away
+TERMINATE_TIMEOUT_S = 2.0
+
+# how often an idle keyboard controller job checks in, in seconds
+HEARTBEAT_S = 0.5
+
+# a keyboard controller process that hasn't checked in for this long (in 
+# seconds) is taken to be hung, and gets replaced
+HEARTBEAT_TIMEOUT_S = 5.0
+
+# how often the supervisor checks on the keyboard controller, in seconds. A
+# process dying gets noticed straight away regardless
+SUPERVISE_POLL_S = 0.1
+
+# if the keyboard controller has to be replaced more than this many times in
+# RESTART_WINDOW_S seconds, something's badly wrong, and the supervisor gives
+# up
+MAX_RESTARTS = 5
+RESTART_WINDOW_S = 60.0
+
+# how long after the keyboard controller injects a key the keyboard listener
+# still takes key presses to be the controller's own, in seconds. Covers the
+# trip through the OS to the listener
+INJECTED_KEY_GRACE_S = 0.1
+
+# how long to wait for stragglers, when taking the commands a dead keyboard
+# controller job left queued, in seconds
+TAKE_QUEUED_TIMEOUT_S = 0.01
+
+class NullController:
+    """Headless stand in for pynput's keyboard Controller that discards every event
+
+    For running the executor without a display or any keyboard, e.g. for 
+    benchmarking. Doesn't wait on delays either.
+    """
+
+    def tap(self, key):
+        pass
+
+    def type(self, content: str):
+        pass
+
+    def press(self, key):
+        pass
+
+    def release(self, key):
+        pass
+
+    def delay(self, seconds: float):
+        pass
+
+class RecordingController(NullController):
+    """Headless stand in for pynput's keyboard Controller that records every event
+
+    Events are kept in memory, in order, as (name, payload) tuples, where name 
+    is one of 'tap', 'type', 'press', 'release' or 'delay'
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def tap(self, key):
+        self.events.append(('tap', key))
+
+    def type(self, content: str):
+        self.events.append(('type', content))
+
+    def press(self, key):
+        self.events.append(('press', key))
+
+    def release(self, key):
+        self.events.append(('release', key))
+
+    def delay(self, seconds: float):
+        self.events.append(('delay', seconds))
+
+    def clear(self):
+        """Forget all the events recorded so far
+        """
+        self.events.clear()
+
+class QueueLag:
+    """How long commands wait in the command queue before the controller gets to them
+
+    Recorded by the controller side, read by the executor side. Lives in 
+    shared memory, so it works across processes.
+    """
+
+    def __init__(self):
+        # last lag, max lag, in seconds
+        self._values = multiprocessing.Array('d', 2)
+
+    def record(self, lag: float):
+        """Record the lag of a command the controller just took off the queue
+
+        Args:
+            lag: the time since it was put on the queue, in seconds
+        """
+        with self._values.get_lock():
+            self._values[0] = lag
+            self._values[1] = max(self._values[1], lag)
+
+    @property
+    def last(self) -> float:
+        return self._values[0]
+
+    @property
+    def max(self) -> float:
+        return self._values[1]
+
+class JobHealth:
+    """Signs of life from a keyboard controller job, for the supervisor
+
+    Written by the job, read by KBCntrlrWrapperManager's supervisor. Lives in
+    shared memory, so it works across processes.
+    """
+
+    def __init__(self):
+        # last heartbeat (time.monotonic()), and whether a command is being
+        # carried out. Only the job writes, so no need for a lock
+        self._values = multiprocessing.Array('d', 2, lock=False)
+        self.beat()
+
+    def beat(self):
+        """Check in
+        """
+        self._values[0] = time.monotonic()
+
+    @property
+    def age(self) -> float:
+        """Time since the last heartbeat, in seconds
+        """
+        return time.monotonic() - self._values[0]
+
+    @property
+    def busy(self) -> bool:
+        """Whether the job is part way through carrying out a command
+        """
+        return bool(self._values[1])
+
+    @busy.setter
+    def busy(self, busy: bool):
+        self._values[1] = float(busy)
+
+class InjectionWindow:
+    """When the keyboard controller last injected keys, so that the keyboard listener can tell them from the user's
+
+    Written by the controller side, read by the keyboard listener (see 
+    ui.keyboard). Lives in shared memory, so it works across processes.
+    """
+
+    def __init__(self):
+        # time.monotonic() until which key presses are taken to be the 
+        # controller's. Only the controller writes, so no need for a lock
+        self._until = multiprocessing.Value('d', 0.0, lock=False)
+
+    def extend(self):
+        """Note that keys are being injected right now
+        """
+        self._until.value = time.monotonic() + INJECTED_KEY_GRACE_S
+
+    @property
+    def active(self) -> bool:
+        """Whether key presses happening now are most likely injected ones
+        """
+        return time.monotonic() < self._until.value
+
+class KBCommandRunner:
+    """Carries out keyboard controller commands, on the controller side
+
+    Also handles aborts (see KBCntrlrWrapper.abort()). The abort generation
+    is bumped out of band, straight away, and a 'resume' marker carrying the 
+    new generation is queued behind whatever is to be thrown away. Once the 
+    runner notices the bump, it stops what it's doing (including part way 
+    through a batch or a delay) and skips everything until it gets to the 
+    marker. Barrier 'sync' commands still get acknowledged while skipping.
+
+    The last generation caught up with is shared too, so that a standby 
+    taking over (see KBCntrlrWrapperManager) carries on from where the one
+    that died left off: aborting only if it was part way through an abort.
+    """
+
+    def __init__(self, kb_cntrl: Controller, ack_queue: Queue,
+            abort_generation: multiprocessing.Value, 
+            health: JobHealth = None, injection: InjectionWindow = None,
+            resumed_generation: multiprocessing.Value = None):
+        """Init
+
+        Args:
+            kb_cntrl: the pynput keyboard controller, or a headless stand in
+            ack_queue: see pynp_kb_cntrl_job()
+            abort_generation: shared counter, bumped on every abort
+            health: where to check in during long delays, if anywhere
+            injection: where to note when keys get injected, if anywhere
+            resumed_generation: shared with the runners that might take over
+                from this one, if any
+        """
+        self._kb_cntrl = kb_cntrl
+        self._health = health
+        self._injection = injection
+        self._ack_queue = ack_queue
+        self._abort_generation = abort_generation
+        # the last abort generation that we've caught up with. Only the 
+        # runner in use writes it, so no need for a lock
+        if resumed_generation is None:
+            resumed_generation = multiprocessing.Value('Q',
+                abort_generation.value, lock=False)
+        self._resumed_generation = resumed_generation
+        # keys pressed and not released yet, to release if we abort part way
+        # through a hotkey
+        self._pressed = set()
+        # sequences of commands, by id, see KBCntrlrWrapper.define_macro()
+        self._macros: Dict[int, List[KBCntrlCommand]] = {}
+        # headless controllers don't need to actually wait, see NullController
+        self._headless = isinstance(kb_cntrl, NullController)
+
+    @property
+    def aborting(self) -> bool:
+        """Whether we're skipping commands because of an abort
+        """
+        return self._abort_generation.value != self._resumed_generation.value
+
+    def _delay(self, seconds: float):
+        if self._headless:
+            self._kb_cntrl.delay(seconds)
+            return
+        # wait in small steps, so an abort cuts it short
+        deadline = time.monotonic() + seconds
+        while not self.aborting:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, ABORT_POLL_S))
+            # a long wait isn't a hang
+            if self._health is not None:
+                self._health.beat()
+
+    def _injecting(self):
+        if self._injection is not None:
+            self._injection.extend()
+
+    def _type(self, content: str):
+        # in chunks, so an abort can stop a long one part way through
+        for istart in range(0, len(content), TYPE_CHUNK_CHARS):
+            if self.aborting:
+                return
+            self._injecting()
+            self._kb_cntrl.type(content[istart:istart + TYPE_CHUNK_CHARS])
+        self._injecting()
+
+    def _skip(self, command: KBCntrlCommand):
+        """Handle a command while aborting. Only the control commands count
+        """
+        if command.name == 'batch':
+            for sub_command in command.payload:
+                self.run(sub_command)
+        elif command.name == 'sync':
+            self._ack_queue.put(command.payload)
+        # later commands may well need it
+        elif command.name == 'define':
+            self._define(*command.payload)
+        elif command.name == 'resume' and \
+                command.payload == self._abort_generation.value:
+            self._resumed_generation.value = command.payload
+
+    def _define(self, macro_id: int, commands: List[KBCntrlCommand]):
+        self._macros[macro_id] = commands
+
+    def _run_macro(self, macro_id: int, count: int):
+        commands = self._macros[macro_id]
+        for _ in range(count):
+            for sub_command in commands:
+                self.run(sub_command)
+
+    def run(self, command: KBCntrlCommand):
+        """Carry out a single keyboard controller command
+
+        Args:
+            command: the command. 'terminate' is handled by the caller
+        """
+        if self.aborting:
+            # let go of anything left held down, first thing
+            if self._pressed:
+                self._injecting()
+            for key in list(self._pressed):
+                self._kb_cntrl.release(key)
+            self._pressed.clear()
+            self._skip(command)
+            return
+
+        # tap key
+        if command.name == 'tap':
+            self._injecting()
+            self._kb_cntrl.tap(command.payload)
+        elif command.name == 'type':
+            self._type(command.payload)
+        elif command.name == 'press':
+            self._injecting()
+            self._kb_cntrl.press(command.payload)
+            self._pressed.add(command.payload)
+        elif command.name == 'release':
+            self._injecting()
+            self._kb_cntrl.release(command.payload)
+            self._pressed.discard(command.payload)
+        # wait for a bit, e.g. for an app to catch up after a hotkey
+        elif command.name == 'delay':
+            self._delay(command.payload)
+        # a whole sequence of commands sent over in one go
+        elif command.name == 'batch':
+            for sub_command in command.payload:
+                self.run(sub_command)
+        # a sequence of commands kept here, run by id
+        elif command.name == 'macro':
+            self._run_macro(*command.payload)
+        # keep a sequence of commands, to be run by id later
+        elif command.name == 'define':
+            self._define(*command.payload)
+        # everything queued before this has been injected, let the waiter know
+        elif command.name == 'sync':
+            self._ack_queue.put(command.payload)
+        # marks the end of an abort we've already caught up with
+        elif command.name == 'resume':
+            pass
+        else:
+            raise NotImplementedError(f'No command "{command.name}"')
+
+def pynp_kb_cntrl_job(command_queue: Queue, ack_queue: Queue,
+        abort_generation: multiprocessing.Value,
+        controller_cls: type = Controller, health: JobHealth = None,
+        injection: InjectionWindow = None,
+        resumed_generation: multiprocessing.Value = None):
     """Keyboard controller job meant to be run in a separate process
 
+    Anything going wrong with a command (e.g. the X connection dropping) 
+    takes the job down with it. KBCntrlrWrapperManager then swaps in a fresh
+    one, see KBCntrlrWrapperManager._supervise().
+
     Args:
         command_queue: inter-process queue for commanding the keyboard controller
+        ack_queue: inter-process queue on which the ids of 'sync' commands are
+            posted back, once every command queued before them has been 
+            injected
+        abort_generation: see KBCommandRunner
+        controller_cls: the keyboard controller to run. The pynput one,
+            unless we're just measuring the cost of getting commands across
+        health: where to check in, for supervision. None if not supervised
+        injection: see KBCommandRunner
+        resumed_generation: see KBCommandRunner
     """
-    kb_cntrl = Controller()
+    runner = KBCommandRunner(controller_cls(), ack_queue, abort_generation,
+        health, injection, resumed_generation)
     logger.info('Pynput keyboard controller job started')
+    # wake up every so often to check in, if anyone's checking
+    timeout = None if health is None else HEARTBEAT_S
 
     while True:
+        if health is not None:
+            health.beat()
         # blocks until something available
-        command: KBCntrlCommand = command_queue.get()
-        # tap key
-        if command.name == 'tap':
-            kb_cntrl.tap(command.payload)
-        elif command.name == 'type':
-            kb_cntrl.type(command.payload)
-        elif command.name == 'press':
-            kb_cntrl.press(command.payload)
-        elif command.name == 'release':
-            kb_cntrl.release(command.payload)
+        try:
+            command: KBCntrlCommand = command_queue.get(timeout=timeout)
+        except Empty:
+            continue
         # terminate the loop
-        elif command.name == 'terminate':
+        if command.name == 'terminate':
             break
-        else:
-            raise NotImplementedError(f'No command "{command.name}"')
+        if health is None:
+            runner.run(command)
+            continue
+        health.busy = True
+        runner.run(command)
+        health.busy = False
 
+    # acks nobody is waiting on anymore shouldn't keep the process hanging 
+    # around
+    if isinstance(ack_queue, multiprocessing.queues.Queue):
+        ack_queue.cancel_join_thread()
     logger.info('Pynput keyboard controller job terminated')
 
+class StampedQueue:
+    """Bounded multiprocessing.Queue of commands, that keeps track of lag
+
+    Each command goes over along with the time it was put on the queue, so the
+    controller side can record how long it waited, see QueueLag.
+
+    The put side also hangs on to each command until the other side has taken
+    it, see take_unconsumed().
+    """
+
+    def __init__(self, lag: QueueLag, maxsize: int = COMMAND_QUEUE_SIZE):
+        """Init
+
+        Args:
+            lag: where the controller side records lag
+            maxsize: max number of commands waiting. put() blocks beyond that
+        """
+        self._queue = Queue(maxsize=maxsize)
+        self._lag = lag
+        # number of commands taken so far. Only the get side writes it
+        self._num_taken = multiprocessing.Value('Q', 0, lock=False)
+
+        # the rest is put side only
+        self._put_lock = threading.Lock()
+        self._num_put = 0
+        # (number, command) of the commands that might not have been taken
+        self._unconsumed = deque()
+        # set once the get side's died, and its commands have been taken back
+        self._abandoned = False
+
+    def __getstate__(self):
+        # only what the get side needs. Locks can't be pickled, which matters
+        # when processes get spawned rather than forked (e.g. macOS)
+        return {'_queue': self._queue, '_lag': self._lag,
+            '_num_taken': self._num_taken}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._put_lock = threading.Lock()
+        self._num_put = 0
+        self._unconsumed = deque()
+        self._abandoned = False
+
+    def close(self):
+        """Done with the queue, see KBCntrlrWrapperManager.terminate()
+        """
+        self._queue.close()
+        self._queue.cancel_join_thread()
+
+    @property
+    def depth(self) -> int:
+        """Number of commands waiting, or -1 if the platform can't tell (macOS)
+        """
+        try:
+            return self._queue.qsize()
+        except NotImplementedError:
+            return -1
+
+    def put(self, command: KBCntrlCommand) -> bool:
+        """Put a command on the queue, waiting while it's full
+
+        Args:
+            command: the command
+
+        Returns:
+            False if the get side's died and it wasn't put, so it needs 
+            putting on whichever queue replaces this one
+        """
+        with self._put_lock:
+            if self._abandoned:
+                return False
+            self._num_put += 1
+            self._unconsumed.append((self._num_put, command))
+            num_taken = self._num_taken.value
+            while self._unconsumed[0][0] <= num_taken:
+                self._unconsumed.popleft()
+
+        # not holding the lock while the queue's full, so that if the get
+        # side died, its commands (this one included) can still be taken back
+        item = (time.monotonic(), command)
+        while True:
+            try:
+                self._queue.put(item, timeout=SUPERVISE_POLL_S)
+                return True
+            except Full:
+                if self._abandoned:
+                    return True
+
+    def get(self, timeout: float = None) -> KBCntrlCommand:
+        stamp, command = self._queue.get(timeout=timeout)
+        self._num_taken.value += 1
+        self._lag.record(time.monotonic() - stamp)
+        return command
+
+    def take_unconsumed(self) -> List[KBCntrlCommand]:
+        """Take back the commands the get side never took, once it's died
+
+        The queue itself can't be read from anymore by then, since the get 
+        side most likely died holding its lock. A put() still waiting on the
+        queue being full gives up, since what it was putting is taken back 
+        here too.
+
+        Returns:
+            the commands, in order
+        """
+        with self._put_lock:
+            self._abandoned = True
+            num_taken = self._num_taken.value
+            commands = [command for num, command in self._unconsumed 
+                if num > num_taken]
+            self._unconsumed.clear()
+        return commands
+
+class DequeCommandQueue:
+    """Hands commands off to a keyboard controller thread in this same process
+
+    Stands in for the command queue, with the same put()/get(). Just a deque, 
+    which is thread safe for appending on one end and popping off the other,
+    plus an event to wake up the controller thread when it's idle, and a 
+    semaphore to keep it bounded.
+    """
+
+    def __init__(self, lag: QueueLag, maxsize: int = COMMAND_QUEUE_SIZE):
+        """Init
+
+        Args:
+            lag: where the controller side records lag
+            maxsize: max number of commands waiting. put() blocks beyond that
+        """
+        self._commands = deque()
+        self._not_empty = threading.Event()
+        self._free_slots = threading.Semaphore(maxsize)
+        self._lag = lag
+
+    @property
+    def depth(self) -> int:
+        """Number of commands waiting
+        """
+        return len(self._commands)
+
+    def put(self, command: KBCntrlCommand):
+        self._free_slots.acquire()
+        self._commands.append((time.monotonic(), command))
+        self._not_empty.set()
+
+    def get(self, timeout: float = None) -> KBCntrlCommand:
+        """Take the next command, waiting until there is one
+
+        Args:
+            timeout: max time to wait, in seconds. None to wait forever
+
+        Returns:
+            the command
+
+        Raises:
+            Empty: if timed out
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                stamp, command = self._commands.popleft()
+            except IndexError:
+                pass
+            else:
+                self._free_slots.release()
+                self._lag.record(time.monotonic() - stamp)
+                return command
+            remaining = None if deadline is None \
+                else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise Empty
+            self._not_empty.wait(remaining)
+            # anything put after this sets it again, and anything put before
+            # it gets picked up by the popleft() above
+            self._not_empty.clear()
+
+class InlineCommandQueue:
+    """Stands in for the command queue when the keyboard controller is headless
+
+    Rather than handing commands off to another process, runs each one 
+    straight away on the calling thread. Headless controllers don't touch any
+    real keyboard, so there's nothing to gain from a separate process.
+    """
+
+    def __init__(self, kb_cntrl: NullController, ack_queue: queue.Queue,
+            abort_generation: multiprocessing.Value,
+            injection: InjectionWindow = None):
+        """Init
+
+        Args:
+            kb_cntrl: the headless controller to run commands on
+            ack_queue: where 'sync' commands get acknowledged
+            abort_generation: see KBCommandRunner
+            injection: see KBCommandRunner
+        """
+        self._runner = KBCommandRunner(kb_cntrl, ack_queue, abort_generation,
+            injection=injection)
+        # commands can come in from a few threads (executor, undo)
+        self._lock = threading.Lock()
+
+    @property
+    def depth(self) -> int:
+        """Nothing ever waits
+        """
+        return 0
+
+    def put(self, command: KBCntrlCommand):
+        if command.name == 'terminate':
+            return
+        with self._lock:
+            self._runner.run(command)
+
+class KBCntrlBatch:
+    """Builds up a sequence of keyboard operations, to be sent as one message
+
+    Obtained from KBCntrlrWrapper.batch(), and meant to be used with the
+    python "with" statement, which sends whatever's been built up at the end:
+        with kb_controller.batch() as batch:
+            batch.press(Key.ctrl).tap('a').release(Key.ctrl)
+            batch.delay(0.1)
+            batch.type('hello')
+
+    Consecutive 'type' operations get merged, as do consecutive delays. Really
+    long batches get sent in chunks of max_ops operations, so the controller
+    can start typing before we're done building.
+    """
+
+    def __init__(self, kb_cntrl_wrapper: 'KBCntrlrWrapper', 
+            max_ops: int = MAX_BATCH_OPS):
+        """Init
+
+        Args:
+            kb_cntrl_wrapper: the wrapper to send through
+            max_ops: max number of operations per message
+        """
+        self._kb_cntrl_wrapper = kb_cntrl_wrapper
+        self._max_ops = max_ops
+        self._commands: List[KBCntrlCommand] = []
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    def __enter__(self) -> 'KBCntrlBatch':
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        # don't send half built batches
+        if exc_type is None:
+            self.send()
+
+    def _add(self, command: KBCntrlCommand) -> 'KBCntrlBatch':
+        self._commands.append(command)
+        if len(self._commands) >= self._max_ops:
+            self.send()
+        return self
+
+    def tap(self, key: Key) -> 'KBCntrlBatch':
+        return self._add(KBCntrlCommand('tap', key))
+
+    def press(self, key: Key) -> 'KBCntrlBatch':
+        return self._add(KBCntrlCommand('press', key))
+
+    def release(self, key: Key) -> 'KBCntrlBatch':
+        return self._add(KBCntrlCommand('release', key))
+
+    def type(self, content: str) -> 'KBCntrlBatch':
+        if not content:
+            return self
+        if self._commands and self._commands[-1].name == 'type':
+            self._commands[-1] = KBCntrlCommand('type', 
+                self._commands[-1].payload + content)
+            return self
+        return self._add(KBCntrlCommand('type', content))
+
+    def delay(self, seconds: float) -> 'KBCntrlBatch':
+        """Wait for a bit in between operations
+
+        Args:
+            seconds: how long to wait
+        """
+        if seconds <= 0:
+            return self
+        if self._commands and self._commands[-1].name == 'delay':
+            self._commands[-1] = KBCntrlCommand('delay', 
+                self._commands[-1].payload + seconds)
+            return self
+        return self._add(KBCntrlCommand('delay', seconds))
+
+    def extend(self, commands: List[KBCntrlCommand]) -> 'KBCntrlBatch':
+        """Add a sequence of already built commands, e.g. from compile_keys()
+
+        Args:
+            commands: the commands
+        """
+        for command in commands:
+            self._add(command)
+        return self
+
+    def send(self):
+        """Send everything built up so far
+        """
+        commands = self._commands
+        self._commands = []
+        self._kb_cntrl_wrapper.send_batch(commands)
+
 class KBCntrlrWrapper:
     """This class is a wrapper around pynput.keyboard.Controller
     
@@ -57,20 +750,243 @@ class KBCntrlrWrapper:
     obtained from an instance of KBCntrlrWrapperManager
     """
 
-    def __init__(self, command_queue: Queue):
+    def __init__(self, command_queue: Queue, ack_queue: Queue,
+            abort_generation: multiprocessing.Value):
         self._command_queue = command_queue
+        self._ack_queue = ack_queue
+        # see KBCommandRunner
+        self._abort_generation = abort_generation
+
+        # id of the last barrier sent to the controller process
+        self._barrier_id = 0
+        # only one thread at a time can be waiting on acks
+        self._barrier_lock = threading.Lock()
+
+        # number of messages put on the command queue, for the curious
+        self.messages_sent = 0
+        # held while putting, so the queue can be swapped out in between, 
+        # see switch_queues()
+        self._put_lock = threading.Lock()
+
+        # the macros the controller has been given, by id, and the other way
+        # round, see define_macro()
+        self._macros: Dict[int, Tuple[KBCntrlCommand, ...]] = {}
+        self._macro_ids: Dict[Tuple[KBCntrlCommand, ...], int] = {}
+
+    def _put(self, command: KBCntrlCommand):
+        while True:
+            with self._put_lock:
+                command_queue = self._command_queue
+                if command_queue.put(command) is not False:
+                    self.messages_sent += 1
+                    return
+            # the controller died, wait for its replacement, see 
+            # switch_queues()
+            while self._command_queue is command_queue:
+                time.sleep(SUPERVISE_POLL_S / 10)
+
+    def define_macro(self, commands: Sequence[KBCntrlCommand]) -> int:
+        """Have the keyboard controller keep a sequence of commands, to run later
+
+        The sequence only goes over to the controller once, after which
+        running it (see run_macro()) is a tiny message, however long it is. 
+        Defining the same sequence again (e.g. when commands get reloaded) 
+        just gives back the same id.
+
+        Args:
+            commands: the commands, which can't include 'sync', 'resume' or 
+                'terminate'
+
+        Returns:
+            the macro id
+        """
+        commands = tuple(commands)
+        with self._put_lock:
+            macro_id = self._macro_ids.get(commands)
+            if macro_id is not None:
+                return macro_id
+            macro_id = len(self._macros)
+            self.messages_sent += 1
+            self._command_queue.put(
+                KBCntrlCommand('define', (macro_id, list(commands))))
+            self._macros[macro_id] = commands
+            self._macro_ids[commands] = macro_id
+        return macro_id
+
+    def run_macro(self, macro_id: int, count: int = 1):
+        """Run a sequence of commands the controller has been given
+
+        Big counts go over as a few messages, of up to MAX_MACRO_COUNT each
+
+        Args:
+            macro_id: from define_macro()
+            count: the number of times to run it
+        """
+        while count > 0:
+            self._put(KBCntrlCommand('macro', 
+                (macro_id, min(count, MAX_MACRO_COUNT))))
+            count -= MAX_MACRO_COUNT
+
+    def _define_macros_on(self, command_queue: Queue):
+        # a new controller doesn't know about any macros yet
+        for macro_id, commands in self._macros.items():
+            command_queue.put(
+                KBCntrlCommand('define', (macro_id, list(commands))))
+
+    def switch_queues(self, command_queue: Queue, ack_queue: Queue,
+            take_queued: Callable[[], List[KBCntrlCommand]],
+            timeout: float = TERMINATE_TIMEOUT_S) -> int:
+        """Switch over to a different keyboard controller, when the one in use died
+
+        Whatever was still queued for the old controller is taken off its 
+        queue, and goes to the new one first, so nothing gets reordered. Macros
+        get defined again on the new one before that.
+
+        Args:
+            command_queue: the new controller's command queue
+            ack_queue: the new controller's ack queue
+            take_queued: takes what's still queued for the old controller, 
+                see KBCntrlJob.take_queued()
+            timeout: max time to wait for anything part way through being 
+                put, in seconds. Past that, it's switched regardless
+
+        Returns:
+            the number of commands moved over
+        """
+        # taking from the old queue lets anything stuck on it being full
+        # finish putting, and let go of the lock
+        queued = []
+        deadline = time.monotonic() + timeout
+        while True:
+            locked = self._put_lock.acquire(timeout=SUPERVISE_POLL_S)
+            if locked or time.monotonic() > deadline:
+                break
+            queued += take_queued()
+        if not locked:
+            logger.error('Keyboard controller queue stuck, switching without '
+                'waiting for it')
+        try:
+            queued += take_queued()
+            self._define_macros_on(command_queue)
+            for command in queued:
+                command_queue.put(command)
+            old_ack_queue = self._ack_queue
+            self._command_queue = command_queue
+            self._ack_queue = ack_queue
+        finally:
+            if locked:
+                self._put_lock.release()
+
+        # don't lose acks nobody got round to reading
+        while True:
+            try:
+                ack_queue.put(old_ack_queue.get_nowait())
+            except Empty:
+                break
+        return len(queued)
 
     def tap(self, char: Key):
-        self._command_queue.put(KBCntrlCommand('tap', char))
+        self._put(KBCntrlCommand('tap', char))
     
     def type(self, content: str):
-        self._command_queue.put(KBCntrlCommand('type', content))
+        self._put(KBCntrlCommand('type', content))
     
     def press(self, key: Key):
-        self._command_queue.put(KBCntrlCommand('press', key))
+        self._put(KBCntrlCommand('press', key))
     
     def release(self, key: Key):
-        self._command_queue.put(KBCntrlCommand('release', key))
+        self._put(KBCntrlCommand('release', key))
+
+    def batch(self, max_ops: int = MAX_BATCH_OPS) -> KBCntrlBatch:
+        """Start building a batch of operations to send as a single message
+
+        Prefer this over individual tap() etc calls whenever there's more than
+        one thing to send, since every message has to be pickled and pushed
+        through a pipe.
+
+        Args:
+            max_ops: max number of operations per message, see KBCntrlBatch
+
+        Returns:
+            the batch builder
+        """
+        return KBCntrlBatch(self, max_ops)
+
+    def send_batch(self, commands: List[KBCntrlCommand]):
+        """Send a whole sequence of commands to the controller process at once
+
+        The sequence crosses the process boundary as a single message. It can
+        hold 'tap', 'type', 'press', 'release' and 'delay' (payload in seconds)
+        commands.
+
+        Args:
+            commands: the commands, in order
+        """
+        if commands:
+            self._put(KBCntrlCommand('batch', commands))
+
+    def barrier(self, timeout: float = BARRIER_TIMEOUT_S) -> bool:
+        """Block until every keyboard event sent so far has actually been injected
+
+        Sends a 'sync' command down the queue and waits for the controller 
+        process to acknowledge it. Because the queue is FIFO, the 
+        acknowledgement means everything before it has been typed.
+
+        Args:
+            timeout: max amount of time to wait, in seconds
+
+        Returns:
+            True if the controller acknowledged, False if we timed out
+        """
+        with self._barrier_lock:
+            self._barrier_id += 1
+            barrier_id = self._barrier_id
+            self._put(KBCntrlCommand('sync', barrier_id))
+
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning('Timed out waiting on keyboard barrier %d', 
+                        barrier_id)
+                    return False
+                # in steps, in case the controller gets replaced in the 
+                # meantime, along with its ack queue
+                try:
+                    acked_id = self._ack_queue.get(
+                        timeout=min(remaining, SUPERVISE_POLL_S))
+                except Empty:
+                    continue
+                # acks come back in order, so older ids are just stragglers
+                # from barriers that timed out
+                if acked_id >= barrier_id:
+                    return True
+
+    def drain(self, timeout: float = BARRIER_TIMEOUT_S) -> bool:
+        """Wait for the keyboard controller to get through everything queued so far
+
+        Args:
+            timeout: max amount of time to wait, in seconds
+
+        Returns:
+            True if everything got through, False if we timed out
+        """
+        return self.barrier(timeout)
+
+    def abort(self):
+        """Stop the keyboard controller, and throw away everything queued for it
+
+        This goes out of band, so the controller notices within about a frame
+        (see ABORT_POLL_S), even part way through a long batch. Keys it was
+        holding down get released. Anything sent after this goes through as
+        normal.
+        """
+        with self._abort_generation.get_lock():
+            self._abort_generation.value += 1
+            generation = self._abort_generation.value
+        logger.info('Aborting keyboard controller (%d)', generation)
+        # marks where the thrown away stuff ends
+        self._put(KBCntrlCommand('resume', generation))
 
     # stolen from pynput/keyboard/_base.py
     # this is used with the python "with" statement:
@@ -83,15 +999,165 @@ class KBCntrlrWrapper:
         :param keys: The keys to keep pressed.
         """
         for key in args:
-            # self.press(key)
-            self._command_queue.put(KBCntrlCommand('press', key))
+            self.press(key)
 
         try:
             yield
         finally:
             for key in reversed(args):
-                # self.release(key)
-                self._command_queue.put(KBCntrlCommand('release', key))
+                self.release(key)
+
+def choose_backend(configured: str = 'auto') -> str:
+    """Pick the keyboard controller backend to run, for this platform
+
+    pynput's controller doesn't work off the main thread on macOS, hence the 
+    separate process. Elsewhere (Linux/X11) it's happy on a thread, which 
+    saves spawning a process and a hop between processes for every key.
+
+    Args:
+        configured: 'auto', or one of BACKENDS. From 'kb_controller_backend' 
+            in config.yaml
+
+    Returns:
+        the backend, for KBCntrlrWrapperManager
+    """
+    is_mac = platform.system() == 'Darwin'
+    if configured == 'auto':
+        return 'process' if is_mac else 'thread'
+    if configured == 'thread' and is_mac:
+        logger.warning('Keyboard controller thread backend is broken on '
+            'macOS, using a separate process instead')
+        return 'process'
+    if configured not in BACKENDS:
+        raise ValueError(f'Unknown keyboard controller backend "{configured}"')
+    return configured
+
+class KBCntrlJob:
+    """A keyboard controller process (or thread), along with its own queues
+
+    See KBCntrlrWrapperManager, which keeps a spare one of these started and
+    waiting, to take over if the one in use dies.
+    """
+
+    def __init__(self, backend: str, transport: str,
+            abort_generation: multiprocessing.Value, lag: QueueLag,
+            injection: InjectionWindow = None,
+            resumed_generation: multiprocessing.Value = None):
+        """Init
+
+        Args:
+            backend: 'process', 'null_process' or 'thread', see 
+                KBCntrlrWrapperManager
+            transport: see KBCntrlrWrapperManager
+            abort_generation: see KBCommandRunner
+            lag: see QueueLag
+            injection: see KBCommandRunner
+            resumed_generation: see KBCommandRunner
+        """
+        self.health = JobHealth()
+        # the shared memory ring, if that's the transport
+        self.ring = None
+
+        if backend == 'thread':
+            self.command_queue = DequeCommandQueue(lag)
+            self.ack_queue = queue.Queue()
+            self._job = threading.Thread(target=pynp_kb_cntrl_job,
+                args=(self.command_queue, self.ack_queue, abort_generation,
+                    Controller, self.health, injection, resumed_generation),
+                name='kb_controller', daemon=True)
+            return
+
+        # bounded queue of KBCntrlCommand objects
+        if transport == 'ring':
+            # kb_ring needs KBCntrlCommand from this module
+            from ui.kb_ring import KBCommandRing # pylint: disable=import-outside-toplevel
+            self.ring = KBCommandRing(lag)
+            self.command_queue = self.ring
+        else:
+            self.command_queue = StampedQueue(lag)
+        # queue of acknowledged barrier ids, coming back from the process
+        self.ack_queue = Queue()
+        controller_cls = Controller if backend == 'process' \
+            else NullController
+        self._job = Process(target=pynp_kb_cntrl_job, 
+            args=(self.command_queue, self.ack_queue, abort_generation,
+                controller_cls, self.health, injection, resumed_generation))
+
+    def start(self):
+        self._job.start()
+
+    def is_alive(self) -> bool:
+        return self._job.is_alive()
+
+    def wait(self, timeout: float):
+        """Wait until the job dies, or for timeout, whichever comes first
+
+        Args:
+            timeout: max time to wait, in seconds
+        """
+        if isinstance(self._job, Process):
+            multiprocessing.connection.wait([self._job.sentinel], timeout)
+        else:
+            self._job.join(timeout)
+
+    def take_queued(self) -> List[KBCntrlCommand]:
+        """Take everything still waiting on the command queue
+
+        Only once the job is dead, since there can only be one taker
+
+        Returns:
+            the commands, in order
+        """
+        if isinstance(self.command_queue, StampedQueue):
+            return self.command_queue.take_unconsumed()
+        commands = []
+        while True:
+            try:
+                commands.append(
+                    self.command_queue.get(timeout=TAKE_QUEUED_TIMEOUT_S))
+            except Empty:
+                return commands
+
+    def stop(self, timeout: float = TERMINATE_TIMEOUT_S):
+        """Tell the job to stop once it's done what's queued, and wait for it
+
+        Args:
+            timeout: max time to wait, in seconds. A process that's still 
+                going after that gets killed
+        """
+        if self._job.is_alive():
+            self.command_queue.put(KBCntrlCommand('terminate', None))
+            self._job.join(timeout)
+        if self._job.is_alive():
+            logger.warning('Keyboard controller did not stop')
+            self.kill()
+
+    def kill(self, timeout: float = TERMINATE_TIMEOUT_S):
+        """Kill the job straight away. Only possible for processes
+
+        With SIGKILL, since a hung process may well not act on anything else
+        (e.g. one that's been stopped)
+
+        Args:
+            timeout: max time to wait for it to go, in seconds
+        """
+        if isinstance(self._job, Process):
+            self._job.kill()
+            self._job.join(timeout)
+            if self._job.is_alive():
+                logger.error('Keyboard controller process %d would not die',
+                    self._job.pid)
+
+    def close(self):
+        """Done with the queues, once the job's stopped
+        """
+        # nothing more is going to be read, so don't let anything left in the
+        # queues hold up exiting, per 
+        # https://docs.python.org/3/library/multiprocessing.html#programming-guidelines
+        if isinstance(self.command_queue, StampedQueue):
+            self.command_queue.close()
+        if self.ring is not None:
+            self.ring.close(unlink=True)
 
 class KBCntrlrWrapperManager:
     """Manages the keyboard controller. Only one instance of this class should be
@@ -99,7 +1165,8 @@ class KBCntrlrWrapperManager:
 
     This class is needed as a container for the separate process spun up for 
     managing the pynput keyboard controller. That separate process is needed 
-    because threading doesn't work with pynput on Mac.
+    because threading doesn't work with pynput on Mac. Elsewhere the 
+    controller can run on a thread instead, see choose_backend().
 
     Big fat note: an instance of this class can only be created *in a main module*. 
     Cannot be created as a module-level variable. Multiprocessing doesn't like that,
@@ -113,18 +1180,193 @@ class KBCntrlrWrapperManager:
      process managing the keyboard controller)
     """
 
-    def __init__(self):
-        # queue of KBCntrlCommand objects
-        self._command_queue = Queue()
-        self._kbc_proc = Process(target=pynp_kb_cntrl_job, 
-            args=(self._command_queue, ))
+    def __init__(self, backend: str = 'process', transport: str = 'ring',
+            supervise: bool = True):
+        """Init
+
+        Args:
+            backend: one of BACKENDS:
+                - 'process': the real pynput controller, in a separate process
+                - 'null': headless, every keyboard event is discarded
+                - 'recording': headless, every keyboard event is recorded in
+                    memory, see RecordingController
+                - 'null_process': the null controller, but in a separate
+                    process like the real one. For measuring the cost of 
+                    getting commands over there
+                - 'thread': the real pynput controller, on its own thread in
+                    this process. No good on macOS, see choose_backend()
+            transport: for the backends with a separate process, how 
+                commands get over there. One of TRANSPORTS:
+                - 'ring': a shared memory ring buffer, see ui.kb_ring
+                - 'queue': a multiprocessing.Queue, which pickles each command
+            supervise: for the backends with a separate process (or thread),
+                whether to replace it if it dies, see _supervise()
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown keyboard controller backend "{backend}"')
+        if transport not in TRANSPORTS:
+            raise ValueError(f'Unknown keyboard controller transport "{transport}"')
+        self.backend = backend
+        self.transport = transport
+
+        # the headless controller, if there is one
+        self.controller: NullController = None
+        # the controller process or thread in use, if there is one
+        self._job: KBCntrlJob = None
+        # a spare one, started and waiting to take over
+        self._standby: KBCntrlJob = None
+        self._started = False
+        self._terminated = False
+
+        # see KBCommandRunner
+        self._abort_generation = multiprocessing.Value('Q', 0)
+        # shared by the controller and its standby, see KBCommandRunner
+        self._resumed_generation = multiprocessing.Value('Q', 0, lock=False)
+        # recorded by the controller side
+        self._lag = QueueLag()
+        # for the keyboard listener to tell injected keys from the user's
+        self.injection_window = InjectionWindow()
+
+        # see _supervise()
+        self._supervise_thread: threading.Thread = None
+        self._stop_supervising = threading.Event()
+        # times of recent restarts
+        self._restart_times = deque(maxlen=MAX_RESTARTS)
+        # counters, for the curious
+        self.restarts = 0
+        self.replayed = 0
+        self.interrupted = 0
+
+        if backend in ('process', 'null_process', 'thread'):
+            self._job = self._new_job()
+            command_queue = self._job.command_queue
+            ack_queue = self._job.ack_queue
+            if supervise:
+                self._standby = self._new_job()
+                self._supervise_thread = threading.Thread(
+                    target=self._supervise, name='kb_controller_supervisor',
+                    daemon=True)
+        else:
+            if backend == 'recording':
+                self.controller = RecordingController()
+            else:
+                self.controller = NullController()
+            ack_queue = queue.Queue()
+            command_queue = InlineCommandQueue(self.controller, ack_queue,
+                self._abort_generation, self.injection_window)
+
+        self.kb_cntrl_wrapper = KBCntrlrWrapper(command_queue, ack_queue,
+            self._abort_generation)
 
-        self.kb_cntrl_wrapper = KBCntrlrWrapper(self._command_queue)
+    def _new_job(self) -> KBCntrlJob:
+        return KBCntrlJob(self.backend, self.transport, 
+            self._abort_generation, self._lag, self.injection_window,
+            self._resumed_generation)
         
     def start(self):
-        """Start the process. Need to call terminate() at some point too 
+        """Start the process (or thread). Need to call terminate() at some point too 
+
+        Also starts the standby, and the supervisor. Nothing to start for the 
+        headless backends
+        """
+        if self._job is not None:
+            self._job.start()
+        if self._standby is not None:
+            self._standby.start()
+        if self._supervise_thread is not None:
+            self._supervise_thread.start()
+        self._started = True
+
+    def _supervise(self):
+        """Keep an eye on the keyboard controller, and replace it if it dies
+
+        Otherwise everything typed from then on would just pile up in the
+        queue. A process that stops checking in (see JobHealth) is taken to
+        be hung, and killed first. Threads can't be killed, so a hung thread
+        only gets logged.
+        """
+        hang_logged = False
+        while not self._stop_supervising.is_set():
+            job = self._job
+            # returns straight away if a process dies
+            job.wait(SUPERVISE_POLL_S)
+            if self._stop_supervising.is_set():
+                return
+            if job.is_alive():
+                if job.health.age < HEARTBEAT_TIMEOUT_S:
+                    hang_logged = False
+                    continue
+                if self.backend == 'thread':
+                    if not hang_logged:
+                        logger.error('Keyboard controller thread is hung')
+                        hang_logged = True
+                    continue
+                logger.error('Keyboard controller process is hung, killing it')
+                job.kill()
+
+            if len(self._restart_times) == MAX_RESTARTS and \
+                    time.monotonic() - self._restart_times[0] < \
+                    RESTART_WINDOW_S:
+                logger.error('Keyboard controller keeps dying, giving up on '
+                    'it')
+                return
+            self._restart_times.append(time.monotonic())
+            self._fail_over()
+
+    def _fail_over(self):
+        """Switch over to the standby, once the keyboard controller has died
+
+        Commands still queued for the dead one are replayed on the standby. 
+        If it died part way through a command, that one can't be replayed
+        without typing some of it twice, so it's reported instead.
+        """
+        failed = self._job
+        standby = self._standby
+        if standby is None or not standby.is_alive():
+            standby = self._new_job()
+            standby.start()
+
+        replayed = self.kb_cntrl_wrapper.switch_queues(standby.command_queue,
+            standby.ack_queue, failed.take_queued)
+        self._job = standby
+        self.restarts += 1
+        self.replayed += replayed
+        if failed.health.busy:
+            self.interrupted += 1
+            logger.error('Keyboard controller died part way through a '
+                'command, some keyboard events may be missing')
+        logger.warning('Keyboard controller died, replaced it and replayed '
+            '%d queued commands', replayed)
+        failed.close()
+
+        # get the next spare ready
+        self._standby = self._new_job()
+        self._standby.start()
+
+    def command_queue_stats(self) -> dict:
+        """Depth and lag of the command queue, and the supervisor's counters
+
+        Returns:
+            dict of:
+            - depth: commands waiting right now (records, for the ring. -1 if
+                the platform can't tell)
+            - lag_s: how long the last command the controller took had been 
+                waiting, in seconds
+            - max_lag_s: the longest any command has been waiting
+            - restarts: number of times the controller's been replaced
+            - replayed: number of commands replayed on a replacement
+            - interrupted: number of commands cut short by the controller 
+                dying
+            plus, for the ring, the counters from KBCommandRing.stats()
         """
-        self._kbc_proc.start()
+        job = self._job
+        stats = {'depth': self.kb_cntrl_wrapper._command_queue.depth, # pylint: disable=protected-access
+            'lag_s': self._lag.last, 'max_lag_s': self._lag.max,
+            'restarts': self.restarts, 'replayed': self.replayed,
+            'interrupted': self.interrupted}
+        if job is not None and job.ring is not None:
+            stats.update(job.ring.stats())
+        return stats
 
     def get_kb_cntrl_wrapper(self) -> KBCntrlrWrapper:
         """Get the keyboard controller wrapper object
@@ -134,22 +1376,44 @@ class KBCntrlrWrapperManager:
         """
         return self.kb_cntrl_wrapper
 
-    def terminate(self):
-        """Terminate KB controller process
+    def terminate(self, timeout: float = TERMINATE_TIMEOUT_S):
+        """Terminate KB controller process (or thread)
 
-        Should be called when the separate keyboard controller process needs to be spun down
+        Should be called when the separate keyboard controller process needs
+        to be spun down. Gives the controller up to timeout to finish what's 
+        queued, then throws the rest away. Safe to call more than once.
+
+        Args:
+            timeout: max amount of time to wait for queued typing to finish,
+                and then again for the controller to stop, in seconds
         """
-        # tell the process' job to stop doing stuff
-        self._command_queue.put(KBCntrlCommand('terminate', None))
-        # end the proc
-        # todo make sure queue is clear, per https://docs.python.org/3/library/multiprocessing.html#programming-guidelines
-        # todo throw error if already joined
-        self._kbc_proc.join()
+        if self._job is None or self._terminated:
+            return
+        self._terminated = True
+
+        # stopping the controller isn't it dying
+        self._stop_supervising.set()
+        if self._supervise_thread is not None and self._started:
+            self._supervise_thread.join()
+
+        if self._started and self._job.is_alive():
+            if not self.kb_cntrl_wrapper.drain(timeout):
+                logger.warning('Keyboard controller still busy, throwing away '
+                    'the rest')
+                self.kb_cntrl_wrapper.abort()
+            # tell the job to stop doing stuff
+            self._job.stop(timeout)
+        self._job.close()
+
+        if self._standby is not None:
+            if self._started:
+                self._standby.stop(timeout)
+            self._standby.close()
 
 if __name__ == '__main__':
 
     mngr = KBCntrlrWrapperManager()
-    mngr._command_queue.put(KBCntrlCommand('tap', 'l'))
-    mngr._command_queue.put(KBCntrlCommand('tap', 'b'))
-    mngr._command_queue.put(KBCntrlCommand('tap', 'l'))
+    mngr.get_kb_cntrl_wrapper().tap('l')
+    mngr.get_kb_cntrl_wrapper().tap('b')
+    mngr.get_kb_cntrl_wrapper().tap('l')
     mngr.terminate()
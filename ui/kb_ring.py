@@ -0,0 +1,542 @@
+"""Single producer / single consumer ring of fixed size keyboard event records
+
+Keyboard commands (see KBCntrlCommand) are flattened into fixed size binary
+records, each one:
+- an opcode (tap, press, release, type, delay, sync, resume, terminate, 
+    define, end define, macro)
+- a code: a unicode code point for characters, KEY_FLAG | index into
+    KEY_NAMES for pynput Keys, the id / generation for syncs and resumes, or
+    the macro id (and repeat count, see encode_macro())
+- a delay, in seconds, to wait before carrying out the record
+- a time stamp of when it went in, for keeping track of lag
+
+The records go through a ring buffer in shared memory. The producer (the
+executor side) only ever writes the write index, and the consumer (the
+keyboard controller process) only the read index. A whole batch of records is
+published by a single write of the write index, so the consumer never sees
+half a batch. The indices (and the waiting flag, see below) are only read and
+written holding a lock shared by both sides. Besides the exclusion, that's a
+memory barrier: on weakly ordered CPUs (e.g. Apple Silicon) plain stores to
+shared memory can otherwise be seen out of order, such as the write index
+before the records it publishes. The records themselves are copied outside
+the lock. When the ring has been empty for a moment the consumer sleeps on a
+semaphore, which the producer only releases if the consumer said it's
+waiting. Uncontended, neither the lock nor the semaphore cost much more than
+an atomic operation.
+
+KBCommandRing has the same put()/get() interface as the queue it replaces, so
+pynp_kb_cntrl_job() doesn't know the difference.
+"""
+
+from functools import partial
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+from queue import Empty
+import struct
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from pynput.keyboard import Key
+
+from ui.kb_controller import MAX_MACRO_COUNT, KBCntrlCommand, QueueLag
+
+logger = logging.getLogger(__name__)
+
+# record opcodes
+OP_TAP = 1
+OP_PRESS = 2
+OP_RELEASE = 3
+OP_TYPE = 4
+OP_DELAY = 5
+OP_SYNC = 6
+OP_TERMINATE = 7
+OP_RESUME = 8
+# the records of a macro definition go between these two
+OP_DEFINE = 9
+OP_END_DEFINE = 10
+OP_MACRO = 11
+
+_KEY_OPS = {'tap': OP_TAP, 'press': OP_PRESS, 'release': OP_RELEASE}
+_KEY_OP_NAMES = {op: name for name, op in _KEY_OPS.items()}
+
+# makes a KBCntrlCommand from a (name, payload) tuple. A bit quicker than the
+# namedtuple's own constructor, which adds up when decoding lots of records
+_new_command = partial(tuple.__new__, KBCntrlCommand)
+
+# opcode, code, delay before the record, and when it was put in the ring (in
+# microseconds, wrapping around, see _stamp())
+RECORD = struct.Struct('<BxxxIfI')
+
+# set in the code of records for pynput Keys, rather than characters. Code
+# points only go up to 0x10FFFF, so they never have it
+KEY_FLAG = 1 << 31
+
+# the pynput Keys, by their index in this list
+KEY_NAMES = sorted(Key.__members__)
+_KEY_INDICES = {name: index for index, name in enumerate(KEY_NAMES)}
+
+# header layout: write index, read index, consumer waiting flag
+_WRITE_INDEX_OFFSET = 0
+_READ_INDEX_OFFSET = 8
+_WAITING_OFFSET = 16
+_HEADER_SIZE = 64
+_INDEX = struct.Struct('<Q')
+_INDICES = struct.Struct('<QQ')
+_FLAG = struct.Struct('<I')
+
+# default number of records in the ring
+RING_CAPACITY = 4096
+
+# max time the consumer sleeps before checking the ring again, in case a
+# wakeup got lost
+WAKEUP_TIMEOUT_S = 0.05
+
+# how long the consumer keeps checking an empty ring before going to sleep
+SPIN_S = 0.001
+
+# how long the producer sleeps at a time while the ring is full
+FULL_WAIT_S = 0.0005
+
+# max time to wait for the index lock, in seconds. Only reached if the other
+# side died holding it
+INDEX_LOCK_TIMEOUT_S = 1.0
+
+
+# stamps wrap around every 2**32 microseconds (71 minutes), which is fine for
+# measuring lags of well under that
+_STAMP_MASK = 0xFFFFFFFF
+
+
+def _stamp() -> int:
+    """Time stamp for records, see RECORD
+
+    time.monotonic() is system wide on Linux and macOS, so stamps can be 
+    compared across processes
+
+    Returns:
+        the stamp
+    """
+    return int(time.monotonic() * 1e6) & _STAMP_MASK
+
+
+def encode_key(key) -> int:
+    """Get the record code for a key
+
+    Args:
+        key: a single character, or a pynput Key
+
+    Returns:
+        the code
+    """
+    if isinstance(key, Key):
+        return KEY_FLAG | _KEY_INDICES[key.name]
+    if isinstance(key, str) and len(key) == 1:
+        return ord(key)
+    raise ValueError(f'Cannot encode key {key!r}')
+
+
+def decode_key(code: int):
+    """Inverse of encode_key()
+
+    Args:
+        code: the record code
+
+    Returns:
+        the single character, or pynput Key
+    """
+    if code & KEY_FLAG:
+        return Key[KEY_NAMES[code & ~KEY_FLAG]]
+    return chr(code)
+
+
+# macro ids, and repeat counts (MAX_MACRO_COUNT), have to fit in 16 bits, see
+# encode_macro()
+MAX_MACRO_ID = 0xFFFF
+
+
+def encode_macro(macro_id: int, count: int) -> int:
+    """Get the record code for running a macro
+
+    Args:
+        macro_id: the macro id
+        count: how many times to run it
+
+    Returns:
+        the code
+    """
+    if not 0 <= macro_id <= MAX_MACRO_ID or not 0 <= count <= MAX_MACRO_COUNT:
+        raise ValueError(f'Cannot encode macro {macro_id} x {count}')
+    return macro_id | count << 16
+
+
+def _encode_into(commands: List[KBCntrlCommand], 
+        records: List[Tuple[int, int, float]], delay: float) -> float:
+    """Flatten keyboard commands into records, see encode_commands()
+
+    Args:
+        commands: the commands
+        records: list to append the records to
+        delay: delay left over from before, to attach to the first record
+
+    Returns:
+        delay left over at the end, to attach to whatever record comes next
+    """
+    append = records.append
+    for name, payload in commands:
+        op = _KEY_OPS.get(name)
+        if op is not None:
+            # plain characters are by far the most common, so skip the call
+            if payload.__class__ is str and len(payload) == 1:
+                append((op, ord(payload), delay))
+            else:
+                append((op, encode_key(payload), delay))
+            delay = 0.0
+        elif name == 'type':
+            for char in payload:
+                append((OP_TYPE, ord(char), delay))
+                delay = 0.0
+        elif name == 'delay':
+            delay += payload
+        elif name == 'batch':
+            delay = _encode_into(payload, records, delay)
+        elif name == 'sync':
+            append((OP_SYNC, payload, delay))
+            delay = 0.0
+        elif name == 'resume':
+            append((OP_RESUME, payload, delay))
+            delay = 0.0
+        elif name == 'terminate':
+            append((OP_TERMINATE, 0, delay))
+            delay = 0.0
+        elif name == 'macro':
+            append((OP_MACRO, encode_macro(*payload), delay))
+            delay = 0.0
+        elif name == 'define':
+            macro_id, macro_commands = payload
+            append((OP_DEFINE, encode_macro(macro_id, 0), delay))
+            records += encode_commands(macro_commands)
+            append((OP_END_DEFINE, macro_id, 0.0))
+            delay = 0.0
+        else:
+            raise NotImplementedError(f'No command "{name}"')
+    return delay
+
+
+def encode_commands(commands: List[KBCntrlCommand]) -> List[Tuple[int, int, float]]:
+    """Flatten keyboard commands into records
+
+    Args:
+        commands: the commands. Batches get flattened
+
+    Returns:
+        list of (opcode, code, delay) records
+    """
+    records = []
+    delay = _encode_into(commands, records, 0.0)
+    if delay > 0:
+        records.append((OP_DELAY, 0, delay))
+    return records
+
+
+def decode_records(records: List[Tuple[int, int, float]]) -> List[KBCntrlCommand]:
+    """Turn records back into keyboard commands
+
+    Runs of typed characters are merged back into a single 'type' command
+
+    Args:
+        records: list of (opcode, code, delay)
+
+    Returns:
+        the commands
+    """
+    commands = []
+    append = commands.append
+    new_command = _new_command
+    # characters of the 'type' command being built up
+    typed = []
+    # records of the macro being defined, if any
+    macro_records = None
+    for record in records:
+        op, code, delay = record
+        if macro_records is not None:
+            if op == OP_END_DEFINE:
+                append(new_command(('define', 
+                    (code, decode_records(macro_records)))))
+                macro_records = None
+            else:
+                macro_records.append(record)
+            continue
+
+        if typed and (op != OP_TYPE or delay > 0):
+            append(new_command(('type', ''.join(typed))))
+            typed = []
+        if delay > 0:
+            append(new_command(('delay', delay)))
+
+        if op == OP_TYPE:
+            typed.append(chr(code))
+        elif op in _KEY_OP_NAMES:
+            append(new_command((_KEY_OP_NAMES[op], 
+                decode_key(code) if code & KEY_FLAG else chr(code))))
+        elif op == OP_SYNC:
+            append(new_command(('sync', code)))
+        elif op == OP_RESUME:
+            append(new_command(('resume', code)))
+        elif op == OP_TERMINATE:
+            append(new_command(('terminate', None)))
+        elif op == OP_MACRO:
+            append(new_command(('macro', (code & MAX_MACRO_ID, code >> 16))))
+        elif op == OP_DEFINE:
+            macro_records = []
+        elif op != OP_DELAY:
+            raise ValueError(f'Bad record opcode {op}')
+    if typed:
+        append(new_command(('type', ''.join(typed))))
+    return commands
+
+
+class KBCommandRing:
+    """Shared memory ring buffer of keyboard event records
+
+    Create it in the main process, and pass it to the keyboard controller
+    process as an argument. put() is for the main process side and get() for
+    the controller process side. Multiple threads can put(), but only one
+    thread (in one process) can get().
+    """
+
+    def __init__(self, lag: Optional[QueueLag] = None,
+            capacity: int = RING_CAPACITY):
+        """Init
+
+        Args:
+            lag: where the consumer records lag, if anywhere
+            capacity: max number of records in the ring at once
+        """
+        self.capacity = capacity
+        self._lag = lag
+        self._shm = shared_memory.SharedMemory(create=True,
+            size=_HEADER_SIZE + capacity * RECORD.size)
+        self._shm.buf[:_HEADER_SIZE] = bytes(_HEADER_SIZE)
+        # released by the producer when the consumer is waiting. Can end up
+        # released more than once, which just means a spurious wakeup
+        self._wakeup = multiprocessing.Semaphore(0)
+        # held to read or write the indices and the waiting flag
+        self._index_lock = multiprocessing.Lock()
+
+        # the rest is producer side only
+        self._put_lock = threading.Lock()
+        self._write_index = 0
+        # counters, for the curious
+        self.records_put = 0
+        self.max_depth = 0
+        self.full_waits = 0
+
+    def __getstate__(self):
+        # only what the consumer needs
+        return {'capacity': self.capacity, '_shm': self._shm,
+            '_wakeup': self._wakeup, '_index_lock': self._index_lock,
+            '_lag': self._lag}
+
+    @property
+    def depth(self) -> int:
+        """Number of records waiting to be consumed. Only roughly, since it 
+        doesn't take the index lock
+        """
+        write_index, read_index = _INDICES.unpack_from(self._shm.buf, 0)
+        return write_index - read_index
+
+    def _lock_indices(self) -> bool:
+        """Take the index lock, giving up if it's held for too long
+
+        The other side only ever holds it for a moment, unless it died holding
+        it, in which case it's about to be replaced and there's nothing left 
+        to order against.
+
+        Returns:
+            True if the lock was taken, and needs releasing
+        """
+        if self._index_lock.acquire(timeout=INDEX_LOCK_TIMEOUT_S):
+            return True
+        logger.warning('Keyboard ring index lock is stuck, going on without it')
+        return False
+
+    def _indices(self) -> Tuple[int, int]:
+        """Read the write and read indices, holding the index lock
+
+        Returns:
+            the write index and the read index
+        """
+        locked = self._lock_indices()
+        indices = _INDICES.unpack_from(self._shm.buf, 0)
+        if locked:
+            self._index_lock.release()
+        return indices
+
+    def _publish_index(self, offset: int, index: int) -> int:
+        """Write the write or read index, holding the index lock
+
+        Args:
+            offset: _WRITE_INDEX_OFFSET or _READ_INDEX_OFFSET
+            index: the index
+
+        Returns:
+            the waiting flag, as it was while the index was written
+        """
+        locked = self._lock_indices()
+        _INDEX.pack_into(self._shm.buf, offset, index)
+        waiting = _FLAG.unpack_from(self._shm.buf, _WAITING_OFFSET)[0]
+        if locked:
+            self._index_lock.release()
+        return waiting
+
+    def _set_waiting(self, waiting: int) -> Tuple[int, int]:
+        """Write the waiting flag, holding the index lock
+
+        Args:
+            waiting: 1 if the consumer is about to sleep, else 0
+
+        Returns:
+            the write index and the read index, as they were while the flag
+                was written
+        """
+        locked = self._lock_indices()
+        _FLAG.pack_into(self._shm.buf, _WAITING_OFFSET, waiting)
+        indices = _INDICES.unpack_from(self._shm.buf, 0)
+        if locked:
+            self._index_lock.release()
+        return indices
+
+    def stats(self) -> dict:
+        """Queue depth counters
+
+        Returns:
+            dict of:
+            - depth: records waiting right now
+            - max_depth: most records ever waiting at once
+            - records_put: total records put in
+            - full_waits: number of times put() had to wait on a full ring
+        """
+        return {'depth': self.depth, 'max_depth': self.max_depth,
+            'records_put': self.records_put, 'full_waits': self.full_waits}
+
+    def put(self, command: KBCntrlCommand):
+        """Put a command into the ring, waiting for space if it's full
+
+        Args:
+            command: the command. Batches are put in as a whole, unless they
+                don't fit in the ring, in which case they go in chunks. Macro
+                definitions have to fit
+        """
+        records = encode_commands([command])
+        if command.name == 'define' and len(records) > self.capacity:
+            raise ValueError(f'Macro {command.payload[0]} does not fit in the '
+                'ring')
+        buf = self._shm.buf
+        capacity = self.capacity
+        with self._put_lock:
+            stamp = _stamp()
+            # only we ever write the write index, so no need to read it back
+            write_index = self._write_index
+            read_index = self._indices()[1]
+            istart = 0
+            while istart < len(records):
+                free = capacity - (write_index - read_index)
+                # wait for room for the whole lot, unless it's bigger than
+                # the ring, so that it gets to the consumer in one go
+                if free < min(len(records) - istart, capacity):
+                    self.full_waits += 1
+                    time.sleep(FULL_WAIT_S)
+                    read_index = self._indices()[1]
+                    continue
+
+                chunk = records[istart:istart + free]
+                for record in chunk:
+                    RECORD.pack_into(buf, _HEADER_SIZE +
+                        (write_index % capacity) * RECORD.size, *record, stamp)
+                    write_index += 1
+                istart += len(chunk)
+                # publish the lot in one go
+                waiting = self._publish_index(_WRITE_INDEX_OFFSET, write_index)
+                self._write_index = write_index
+
+                self.max_depth = max(self.max_depth, write_index - read_index)
+                if waiting:
+                    self._wakeup.release()
+
+            self.records_put += len(records)
+
+    def get(self, timeout: Optional[float] = None) -> KBCntrlCommand:
+        """Take everything that's in the ring, waiting until there's something
+
+        Args:
+            timeout: max time to wait, in seconds. None to wait forever
+
+        Returns:
+            a single command, or a 'batch' of them. 'terminate' is always
+                returned on its own
+
+        Raises:
+            Empty: if timed out
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        buf = self._shm.buf
+        spin_until = time.monotonic() + SPIN_S
+        while True:
+            write_index, read_index = self._indices()
+            if write_index > read_index:
+                break
+
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                raise Empty
+            # more is usually on its way right behind what we just took, so 
+            # keep checking for a little while before going to sleep
+            if now < spin_until:
+                time.sleep(0)
+                continue
+            # tell the producer to wake us up, then make sure it didn't
+            # publish something in the meantime
+            write_index, read_index = self._set_waiting(1)
+            if write_index == read_index:
+                self._wakeup.acquire(timeout=WAKEUP_TIMEOUT_S)
+            self._set_waiting(0)
+
+        records = []
+        while read_index < write_index:
+            record = RECORD.unpack_from(buf, _HEADER_SIZE +
+                (read_index % self.capacity) * RECORD.size)
+            if record[0] == OP_TERMINATE:
+                # terminate gets returned on its own, next time
+                if records:
+                    break
+                self._publish_index(_READ_INDEX_OFFSET, read_index + 1)
+                return KBCntrlCommand('terminate', None)
+            if not records:
+                # the first record is the one that's been waiting longest
+                first_stamp = record[3]
+            records.append(record[:3])
+            read_index += 1
+        # only once they've all been read, so the producer doesn't overwrite
+        # them
+        self._publish_index(_READ_INDEX_OFFSET, read_index)
+
+        if self._lag is not None:
+            self._lag.record(((_stamp() - first_stamp) & _STAMP_MASK) / 1e6)
+
+        commands = decode_records(records)
+        if len(commands) == 1:
+            return commands[0]
+        return KBCntrlCommand('batch', commands)
+
+    def close(self, unlink: bool = False):
+        """Let go of the shared memory
+
+        Args:
+            unlink: also destroy it. Only the creator should do this, once
+                the consumer is done with it
+        """
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
@@ -10,7 +10,6 @@ from pynput.keyboard import Key, Controller
 from backend.manager import app_mngr, event_mngr
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 HOTKEY_MOD = 'ctrl'
 HOTKEY_LETTER = 'Key.esc'
@@ -30,13 +29,24 @@ class KeyboardManager():
     # we look for the user to type '.' and then ' ' to manually trigger an end
     # of sentence condition
     manual_sentence_end_primed = False
+    # when the keyboard controller is injecting keys, see 
+    # KBCntrlrWrapperManager.injection_window. Set once there is one
+    injection_window = None
 
+    def injected(self) -> bool:
+        """Whether the key event happening now is most likely one the
+        keyboard controller injected, rather than the user's
+        """
+        return self.injection_window is not None and \
+            self.injection_window.active
 
     def on_press(self, key: keyboard.KeyCode):
         # if str(key) in keys_for_parser:
         #     # print("setting key_pressed_parser_event")
         #     key_pressed_parser_event.set()
 
+        if self.injected():
+            return
         event_mngr.key_pressed.set()
 
     def on_release(self,
@@ -49,6 +59,10 @@ class KeyboardManager():
         Returns:
             Usually nothing, but False when the thread should be shut down
         """
+        # e.g. '. ' typed by the keyboard controller isn't the user ending a
+        # sentence
+        if self.injected():
+            return
         keystring = str(key)
         # print(keystring)
 